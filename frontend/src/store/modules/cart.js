@@ -3,6 +3,8 @@ import api from '@/api';
 // Initial state
 const state = {
   cartItems: [],
+  // Итоги корзины с сервера: количество билетов, сумма и нехватка мест
+  summary: null,
   loading: false,
   error: null,
   lastAddedItem: null
@@ -11,12 +13,21 @@ const state = {
 // Getters
 const getters = {
   cartItemsCount: (state) => {
+    if (state.summary) {
+      return state.summary.seats_count;
+    }
     return state.cartItems.reduce((sum, item) => sum + item.quantity, 0);
   },
   cartTotal: (state) => {
+    if (state.summary) {
+      return Number(state.summary.total_amount);
+    }
     return state.cartItems.reduce((sum, item) => {
       return sum + (item.performance_schedule.price * item.quantity);
     }, 0);
+  },
+  cartWarnings: (state) => {
+    return state.summary ? state.summary.warnings : [];
   }
 };
 
@@ -25,6 +36,9 @@ const mutations = {
   SET_CART_ITEMS(state, items) {
     state.cartItems = items;
   },
+  SET_SUMMARY(state, summary) {
+    state.summary = summary;
+  },
   SET_LOADING(state, status) {
     state.loading = status;
   },
@@ -46,10 +60,12 @@ const actions = {
       commit('SET_LOADING', true);
       commit('CLEAR_ERROR');
       
-      const response = await api.get('cart/');
-      commit('SET_CART_ITEMS', response.data);
+      // Элементы корзины и итоги приходят одним запросом
+      const response = await api.get('cart/', { params: { summary: 1 } });
+      commit('SET_CART_ITEMS', response.data.items);
+      commit('SET_SUMMARY', response.data.summary);
       
-      return response.data;
+      return response.data.items;
     } catch (error) {
       commit('SET_ERROR', error.response?.data?.error || 'Ошибка загрузки корзины');
       return [];
@@ -124,6 +140,7 @@ const actions = {
       
       await api.post('cart/clear/');
       commit('SET_CART_ITEMS', []);
+      commit('SET_SUMMARY', null);
     } catch (error) {
       commit('SET_ERROR', error.response?.data?.error || 'Ошибка очистки корзины');
       throw error;
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Theater, Hall
+from django.core.exceptions import ValidationError
+from django.forms.models import BaseInlineFormSet
+from .models import Theater, Hall, SeatZone, HallRow
 
 @admin.register(Theater)
 class TheaterAdmin(admin.ModelAdmin):
@@ -7,8 +9,27 @@ class TheaterAdmin(admin.ModelAdmin):
     search_fields = ('name', 'address')
     ordering = ('name',)
 
+class SeatZoneInline(admin.TabularInline):
+    model = SeatZone
+    extra = 0
+
+class HallRowFormSet(BaseInlineFormSet):
+    def clean(self):
+        super().clean()
+        # Добавление и изменение рядов проверяет HallRow.clean, удаление - здесь
+        if self.deleted_forms and self.instance.pk and self.instance.has_seat_maps():
+            raise ValidationError(
+                "Ряды нельзя удалять: на показы в этом зале уже есть карты мест"
+            )
+
+class HallRowInline(admin.TabularInline):
+    model = HallRow
+    formset = HallRowFormSet
+    extra = 0
+
 @admin.register(Hall)
 class HallAdmin(admin.ModelAdmin):
     list_display = ('number_hall', 'theater')
     list_filter = ('theater',)
     search_fields = ('theater__name', 'number_hall')
+    inlines = [SeatZoneInline, HallRowInline]
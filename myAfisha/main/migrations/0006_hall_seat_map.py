@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_hall'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatZone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название зоны')),
+                ('price_factor', models.DecimalField(decimal_places=2, default=1, max_digits=4, verbose_name='Коэффициент цены')),
+                ('hall', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='zones', to='main.hall', verbose_name='Зал')),
+            ],
+            options={
+                'verbose_name': 'Зона зала',
+                'verbose_name_plural': 'Зоны зала',
+            },
+        ),
+        migrations.CreateModel(
+            name='HallRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='Номер ряда')),
+                ('seats', models.PositiveIntegerField(verbose_name='Количество мест')),
+                ('hall', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='main.hall', verbose_name='Зал')),
+                ('zone', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rows', to='main.seatzone', verbose_name='Зона')),
+            ],
+            options={
+                'verbose_name': 'Ряд',
+                'verbose_name_plural': 'Ряды',
+                'ordering': ['number'],
+                'constraints': [models.UniqueConstraint(fields=('hall', 'number'), name='hall_row_number_unique')],
+            },
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from typing import Any  # str не нужно импортировать, это встроенный тип
 
@@ -55,7 +56,73 @@ class Hall(models.Model):
         """
         return f"{self.number_hall}"
 
-    
-    
-    
-    
\ No newline at end of file
+    def has_seat_maps(self) -> bool:
+        """
+        Есть ли у зала показы с картой занятости мест.
+        Схему рядов такого зала менять нельзя: смещения мест в картах перестанут совпадать.
+        """
+        return self.schedule.filter(seat_map__isnull=False).exists()
+
+
+class SeatZone(models.Model):
+    """
+    Зона зала (партер, амфитеатр, балкон).
+
+    Цена места в зоне - цена билета показа, умноженная на price_factor.
+    """
+    hall = models.ForeignKey(Hall, on_delete=models.CASCADE, related_name='zones', verbose_name="Зал")
+    name = models.CharField(max_length=100, verbose_name="Название зоны")
+    price_factor = models.DecimalField(max_digits=4, decimal_places=2, default=1, verbose_name="Коэффициент цены")
+
+    class Meta:
+        verbose_name = "Зона зала"
+        verbose_name_plural = "Зоны зала"
+
+    def __str__(self) -> str:
+        return f"{self.hall} - {self.name}"
+
+
+class HallRow(models.Model):
+    """
+    Ряд зала.
+
+    Места ряда нумеруются с 1. В карте занятости показа места рядов идут
+    подряд в порядке номеров рядов, поэтому ряды зала, у показов которого
+    уже есть карты занятости, нельзя добавлять, менять и удалять
+    (проверяется в clean и в админке). Зону ряда менять можно.
+    """
+    hall = models.ForeignKey(Hall, on_delete=models.CASCADE, related_name='rows', verbose_name="Зал")
+    zone = models.ForeignKey(
+        SeatZone,
+        on_delete=models.SET_NULL,
+        related_name='rows',
+        verbose_name="Зона",
+        null=True,
+        blank=True
+    )
+    number = models.PositiveIntegerField(verbose_name="Номер ряда")
+    seats = models.PositiveIntegerField(verbose_name="Количество мест")
+
+    class Meta:
+        ordering = ['number']
+        verbose_name = "Ряд"
+        verbose_name_plural = "Ряды"
+        constraints = [
+            models.UniqueConstraint(fields=['hall', 'number'], name='hall_row_number_unique'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.hall}, ряд {self.number}"
+
+    def clean(self) -> None:
+        if self.hall_id is None:
+            return
+        if self.pk is not None:
+            stored = HallRow.objects.filter(pk=self.pk).values_list('hall_id', 'number', 'seats').first()
+            if stored == (self.hall_id, self.number, self.seats):
+                return
+        if self.hall.has_seat_maps():
+            raise ValidationError(
+                "Схему зала нельзя менять: на показы в этом зале уже есть карты мест"
+            )
+
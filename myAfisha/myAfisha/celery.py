@@ -23,6 +23,18 @@ app.conf.beat_schedule = {
         'task': 'perfomance.tasks.update_performance_stats',
         'schedule': crontab(minute='*/30'),  # Выполнять каждые 30 минут
     },
+    'purge-idempotency-keys': {
+        'task': 'perfomance.tasks.purge_idempotency_keys',
+        'schedule': crontab(minute=15),  # Выполнять каждый час
+    },
+    'reclaim-seat-holds': {
+        'task': 'perfomance.tasks.reclaim_seat_holds',
+        'schedule': 60.0,  # Выполнять каждую минуту
+    },
+    'flush-inventory': {
+        'task': 'perfomance.tasks.flush_inventory',
+        'schedule': 5.0,  # Выполнять каждые 5 секунд
+    },
     'send-reminder-emails': {
         'task': 'users.tasks.send_reminder_emails',
         'schedule': crontab(hour=10, minute=0, day_of_week='mon,wed,fri'),  # Понедельник, среда, пятница в 10:00
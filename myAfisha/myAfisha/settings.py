@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import re
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -76,6 +78,10 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Режим совместимости для пагинации: запросы без параметров cursor/page_size
+# получают прежний ответ-список целиком. Отключить после перехода фронтенда на курсоры.
+PAGINATION_COMPAT_MODE = True
+
 # Настройки CORS (разрешаем все источники для разработки)
 CORS_ALLOW_ALL_ORIGINS = True
 # Если хотите ограничить только нужными адресами, закомментируйте строку выше и раскомментируйте ниже:
@@ -234,6 +240,63 @@ SILKY_INTERCEPT_PERCENT = 100  # Перехват 100% запросов (мож
 SILKY_MAX_RECORDED_REQUESTS = 1000
 SILKY_MAX_RECORDED_REQUESTS_CHECK_PERCENT = 10
 
+
+def SILKY_INTERCEPT_FUNC(request):
+    # Опрос очереди ожидания не должен обращаться к базе (см. perfomance/waiting_room.py)
+    return not WAITING_ROOM_POLL_PATH.match(request.path)
+
+# Кеш. В production задается REDIS_CACHE_URL (например, redis://redis:6379/1),
+# без него используется локальная память процесса. Тесты от окружения не зависят:
+# они переопределяют кеш и адреса Redis через override_settings (см. perfomance/tests)
+REDIS_CACHE_URL = os.environ.get('REDIS_CACHE_URL')
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+            'KEY_PREFIX': 'afisha',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'afisha',
+        }
+    }
+
+# Время жизни закешированных ответов каталога (секунды); при изменении
+# данных каталога ключи меняются раньше за счет версии
+CATALOG_CACHE_TIMEOUT = 300
+
+# Сколько хранить ответы на запросы с заголовком Idempotency-Key (секунды)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# Через сколько секунд незавершенный запрос с ключом считается упавшим и ключ можно
+# занять заново. Должно быть заметно больше таймаута воркера (gunicorn --timeout,
+# 30 секунд по умолчанию), иначе медленный заказ выполнится повторно
+IDEMPOTENCY_LEASE = 10 * 60
+
+# Сколько удерживать места под добавленные в корзину билеты (секунды)
+SEAT_HOLD_TTL = 15 * 60
+
+# Остатки мест "горячих" расписаний в Redis (см. perfomance/inventory.py),
+# например redis://redis:6379/2. Без него все расписания работают через базу
+INVENTORY_REDIS_URL = os.environ.get('INVENTORY_REDIS_URL')
+# Сколько расписаний переносить из Redis в базу одним UPDATE
+INVENTORY_FLUSH_BATCH_SIZE = 500
+
+# Очередь ожидания перед покупкой на показы с admission_limit (см. perfomance/waiting_room.py),
+# например redis://redis:6379/3. Без него очередь выключена и покупка открыта всем
+WAITING_ROOM_REDIS_URL = os.environ.get('WAITING_ROOM_REDIS_URL')
+# Сколько секунд пропущенный из очереди покупатель может оформлять заказ
+WAITING_ROOM_ADMISSION_TTL = 10 * 60
+# Через сколько секунд без опроса покупатель выбывает из очереди
+WAITING_ROOM_HEARTBEAT = 60
+# Как часто клиенту опрашивать очередь (секунды)
+WAITING_ROOM_POLL_INTERVAL = 5
+WAITING_ROOM_POLL_PATH = re.compile(r'^/api/schedules/\d+/queue/[^/]+/$')
+
 # Настройки для Celery
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
@@ -13,6 +13,9 @@ class PerformanceViewSet(viewsets.ModelViewSet):
     queryset = Performance.objects.all()
     serializer_class = PerformanceSerializer
 
+    def get_queryset(self):
+        return Performance.objects.with_catalog_stats(self.request.user)
+
 
 class UserView(APIView):
     permission_classes = [IsAuthenticated]  # Требуем аутентификацию
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django import forms
 from django.urls import path
 from django.http import JsonResponse, FileResponse
-from .models import Performance, PerformanceCategory, PerformanceSchedule, Promotion, Review, Like, CartItem, Order, OrderItem
+from .models import Counter, Performance, PerformanceCategory, PerformanceSchedule, Promotion, Review, Like, CartItem, Order, OrderItem, OrderStatus
+from .orders import TransitionError, check_transition, transition
 from main.models import Hall, Theater
 import io
 from reportlab.pdfgen import canvas
@@ -135,7 +136,7 @@ class PromotionAdmin(admin.ModelAdmin):
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
-    list_display = ('user', 'performance', 'created_at')
+    list_display = ('user', 'performance', 'rating', 'likes_count', 'created_at')
     list_filter = ('performance', 'created_at')
     search_fields = ('user__username', 'performance__name')
     date_hierarchy = 'created_at'
@@ -148,6 +149,11 @@ class LikeAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
 
 
+@admin.register(Counter)
+class CounterAdmin(admin.ModelAdmin):
+    list_display = ('name', 'value')
+
+
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ('user', 'get_performance', 'get_theater', 'get_hall', 'quantity', 'added_at')
@@ -241,50 +247,37 @@ class OrderAdmin(admin.ModelAdmin):
         return FileResponse(buffer, as_attachment=True, filename='orders.pdf')
     generate_order_pdf.short_description = "Сгенерировать PDF для выбранных заказов"
     
+    def _mark_as(self, request, queryset, new_status, done):
+        # Места всех заказов меняются пачкой, неподходящие заказы пропускаются
+        try:
+            changed = transition(queryset, new_status)
+        except TransitionError as e:
+            self.message_user(request, f"Статусы не изменены: {e}", level='ERROR')
+            return
+        self.message_user(request, f"{len(changed)} заказов отмечены как {done}.")
+
     def mark_as_confirmed(self, request, queryset):
-        updated = queryset.update(status=OrderStatus.CONFIRMED)
-        self.message_user(request, f"{updated} заказов отмечены как подтвержденные.")
+        self._mark_as(request, queryset, OrderStatus.CONFIRMED, 'подтвержденные')
     mark_as_confirmed.short_description = "Отметить как подтвержденные"
     
     def mark_as_completed(self, request, queryset):
-        updated = queryset.update(status=OrderStatus.COMPLETED)
-        self.message_user(request, f"{updated} заказов отмечены как выполненные.")
+        self._mark_as(request, queryset, OrderStatus.COMPLETED, 'выполненные')
     mark_as_completed.short_description = "Отметить как выполненные"
     
     def mark_as_cancelled(self, request, queryset):
-        for order in queryset:
-            if order.status != OrderStatus.CANCELLED:
-                # Возвращаем места в расписание при отмене
-                for item in order.items.all():
-                    item.performance_schedule.release_seats(item.quantity)
-                order.status = OrderStatus.CANCELLED
-                order.save()
-        
-        self.message_user(request, f"{queryset.count()} заказов отмечены как отмененные.")
+        self._mark_as(request, queryset, OrderStatus.CANCELLED, 'отмененные')
     mark_as_cancelled.short_description = "Отметить как отмененные"
     
     def save_model(self, request, obj, form, change):
-        # Если изменился статус с отмененного на другой, резервируем места
+        # Отмена возвращает места, восстановление отмененного заказа снова их бронирует
         if change and 'status' in form.changed_data:
-            old_order = Order.objects.get(pk=obj.pk)
-            if old_order.status == OrderStatus.CANCELLED and obj.status != OrderStatus.CANCELLED:
-                # Резервируем места
-                for item in obj.items.all():
-                    if not item.performance_schedule.reserve_seats(item.quantity):
-                        # Если недостаточно мест, оставляем заказ отмененным
-                        self.message_user(
-                            request, 
-                            f"Недостаточно мест для '{item.performance_schedule.performance.name}'. "
-                            f"Доступно: {item.performance_schedule.available_seats}, "
-                            f"требуется: {item.quantity}",
-                            level='ERROR'
-                        )
-                        obj.status = OrderStatus.CANCELLED
-                        break
-            # Если изменился статус с другого на отмененный, возвращаем места
-            elif old_order.status != OrderStatus.CANCELLED and obj.status == OrderStatus.CANCELLED:
-                for item in obj.items.all():
-                    item.performance_schedule.release_seats(item.quantity)
+            old_status = Order.objects.values_list('status', flat=True).get(pk=obj.pk)
+            try:
+                check_transition(old_status, obj.status)
+                transition(Order.objects.filter(pk=obj.pk), obj.status)
+            except TransitionError as e:
+                self.message_user(request, f"{e}, статус заказа не изменен.", level='ERROR')
+                obj.status = old_status
         
         super().save_model(request, obj, form, change)
 
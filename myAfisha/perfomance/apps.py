@@ -6,4 +6,5 @@ class PerfomanseConfig(AppConfig):
     name = 'perfomance'
     verbose_name = 'Спектакль'
 
-
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,196 @@
+"""
+Помощники для работы с кешем.
+
+Версии - счетчики в общем кеше, по которым процессы узнают, что их
+локальные данные (например, индексы в памяти) устарели.
+Ответы каталога кешируются вместе с версией каталога: при изменении
+данных версия увеличивается (см. signals.py), и значение считается устаревшим.
+
+Пересчет значения выполняет только один процесс (single-flight): он берет
+блокировку cache.add с коротким сроком аренды (SET NX в Redis; с LocMemCache
+блокировка действует внутри процесса). Остальные отдают устаревшее значение
+или недолго ждут нового. Чтобы значения не истекали у всех одновременно,
+свежее значение может быть пересчитано заранее с вероятностью, растущей
+к концу срока жизни (XFetch).
+"""
+import hashlib
+import math
+import random
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+CATALOG_VERSION = 'catalog'
+
+# Срок аренды блокировки пересчета, секунд
+SINGLE_FLIGHT_LEASE = 10
+# Сколько ждать чужого пересчета, если устаревшего значения нет, секунд
+SINGLE_FLIGHT_WAIT = 2.0
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+# Сколько хранить значение после истечения, чтобы отдавать его во время пересчета
+STALE_TTL = 600
+# Чем больше, тем раньше начинается досрочный пересчет (XFetch)
+EARLY_REFRESH_BETA = 1.0
+
+HIT, MISS, STALE = 'HIT', 'MISS', 'STALE'
+
+
+def _version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    """
+    Возвращает текущую версию (при первом обращении создает версию 1)
+    """
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def _incr(key, initial=0):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Ключа еще нет (или он вытеснен из кеша)
+        cache.add(key, initial, timeout=None)
+        return cache.incr(key)
+
+
+def bump_version(name):
+    """
+    Увеличивает версию и возвращает новое значение
+    """
+    return _incr(_version_key(name), initial=1)
+
+
+def _store(key, compute, timeout, version):
+    started = time.monotonic()
+    value = compute()
+    entry = {
+        'version': version,
+        'value': value,
+        'expires_at': time.time() + timeout,
+        # Время пересчета: чем дольше он идет, тем раньше начинается досрочный пересчет
+        'delta': time.monotonic() - started,
+    }
+    cache.set(key, entry, timeout + STALE_TTL)
+    return value
+
+
+def single_flight(key, compute, timeout, version=None, lease=SINGLE_FLIGHT_LEASE,
+                  wait=SINGLE_FLIGHT_WAIT, beta=EARLY_REFRESH_BETA):
+    """
+    Возвращает (значение, состояние) для ключа, вызывая compute() не более
+    чем в одном процессе одновременно. Состояние - HIT, MISS (значение
+    посчитано в этом вызове) или STALE (отдано устаревшее значение, пока
+    другой процесс пересчитывает).
+
+    Значение устаревает по истечении timeout или при смене version.
+    """
+    entry = cache.get(key)
+    now = time.time()
+    current = entry is not None and entry['version'] == version
+    if current:
+        # XFetch: now - delta * beta * ln(U) достигает срока истечения раньше для дорогих значений
+        early = now - entry['delta'] * beta * math.log(1.0 - random.random())
+        if early < entry['expires_at']:
+            return entry['value'], HIT
+    fresh = current and now < entry['expires_at']
+
+    lock_key = f'lock:{key}'
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, lease):
+        try:
+            return _store(key, compute, timeout, version), MISS
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    # Значение пересчитывает другой процесс
+    if entry is not None:
+        return entry['value'], HIT if fresh else STALE
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry['version'] == version:
+            return entry['value'], HIT
+
+    # Не дождались (процесс с блокировкой завис или упал) - считаем сами
+    return _store(key, compute, timeout, version), MISS
+
+
+def _metric_key(name, outcome):
+    return f'metrics:response-cache:{name}:{outcome}'
+
+
+def get_cache_metrics(names):
+    """
+    Возвращает {имя: {'hits', 'misses', 'stale', 'hit_ratio'}} для кешей ответов.
+    Отданные устаревшие значения считаются попаданиями в hit_ratio.
+    """
+    outcomes = ('hit', 'miss', 'stale')
+    keys = [_metric_key(name, outcome) for name in names for outcome in outcomes]
+    values = cache.get_many(keys)
+    metrics = {}
+    for name in names:
+        hits, misses, stale = (values.get(_metric_key(name, outcome), 0) for outcome in outcomes)
+        total = hits + misses + stale
+        metrics[name] = {
+            'hits': hits,
+            'misses': misses,
+            'stale': stale,
+            'hit_ratio': round((hits + stale) / total, 3) if total else None,
+        }
+    return metrics
+
+
+class _Uncacheable(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+def cached_response(name, version_name=CATALOG_VERSION, timeout=None):
+    """
+    Декоратор метода get у APIView: кеширует данные успешного ответа
+    по полному пути запроса (с параметрами) и версии данных, пересчитывая
+    их через single_flight. Заголовок X-Cache показывает HIT, MISS или STALE,
+    счетчики доступны через get_cache_metrics.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = f'response:{name}:{path_hash}'
+
+            def compute():
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    raise _Uncacheable(response)
+                return response.data
+
+            try:
+                data, state = single_flight(
+                    key, compute,
+                    timeout if timeout is not None else settings.CATALOG_CACHE_TIMEOUT,
+                    version=get_version(version_name)
+                )
+            except _Uncacheable as error:
+                return error.response
+
+            _incr(_metric_key(name, state.lower()))
+            response = Response(data)
+            response['X-Cache'] = state
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,114 @@
+"""
+Фасеты для боковой панели фильтров каталога: сколько найденных спектаклей
+в каждой категории, театре, ценовом диапазоне и диапазоне дат.
+
+Фасеты считаются в базе тремя запросами независимо от размера каталога:
+группировка найденных спектаклей по категориям, группировка их предстоящих
+показов по театрам и один запрос с условными агрегатами по ценам и датам.
+Показы учитываются только предстоящие и подходящие под активные фильтры
+расписания (цена, даты, места, театр), поэтому счетчики совпадают
+с отфильтрованным списком.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db.models import Count, Q
+from django.utils import timezone
+
+# (ключ, нижняя граница включительно, верхняя граница не включительно)
+PRICE_BUCKETS = (
+    ('0-1000', None, Decimal('1000')),
+    ('1000-3000', Decimal('1000'), Decimal('3000')),
+    ('3000-5000', Decimal('3000'), Decimal('5000')),
+    ('5000+', Decimal('5000'), None),
+)
+
+# (ключ, первый день от сегодня, последний день включительно)
+DATE_BUCKETS = (
+    ('today', 0, 0),
+    ('tomorrow', 1, 1),
+    ('week', 2, 7),
+    ('month', 8, 30),
+    ('later', 31, None),
+)
+
+
+def _range(field, low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(**{f'{field}__gte': low})
+    if high is not None:
+        condition &= Q(**{f'{field}__lt': high})
+    return condition
+
+
+def _date_range(today, first, last):
+    from .filters import start_of_day
+
+    low = start_of_day(today + datetime.timedelta(days=first))
+    high = start_of_day(today + datetime.timedelta(days=last + 1)) if last is not None else None
+    return _range('date_time', low, high)
+
+
+def _distinct_performances(condition):
+    return Count('performance_id', distinct=True, filter=condition)
+
+
+def compute_facets(queryset, schedule_conditions=None):
+    """
+    Считает фасеты по уже отфильтрованному queryset спектаклей.
+    Спектакль учитывается в театре, цене и дате, если у него есть
+    предстоящий показ с такими значениями, подходящий под schedule_conditions
+    (Q по PerformanceSchedule, см. PerformanceFilter.get_schedule_conditions).
+    """
+    from .models import Performance, PerformanceSchedule
+
+    now = timezone.now()
+    today = timezone.localdate(now)
+    performance_ids = queryset.order_by().values('pk')
+
+    categories = (
+        Performance.objects.filter(pk__in=performance_ids, category__isnull=False)
+        .values('category_id', 'category__name').annotate(count=Count('id'))
+        .order_by('-count', 'category__name')
+    )
+
+    schedules = PerformanceSchedule.objects.filter(
+        schedule_conditions or Q(), performance__in=performance_ids, date_time__gt=now
+    ).order_by()
+    theaters = (
+        schedules.filter(theater__isnull=False)
+        .values('theater_id', 'theater__name').annotate(count=Count('performance_id', distinct=True))
+        .order_by('-count', 'theater__name')
+    )
+    buckets = schedules.aggregate(
+        **{
+            f'price_{key}': _distinct_performances(_range('price', low, high))
+            for key, low, high in PRICE_BUCKETS
+        },
+        **{
+            f'date_{key}': _distinct_performances(_date_range(today, first, last))
+            for key, first, last in DATE_BUCKETS
+        }
+    )
+
+    return {
+        'categories': [
+            {'id': row['category_id'], 'name': row['category__name'], 'count': row['count']}
+            for row in categories
+        ],
+        'theaters': [
+            {'id': row['theater_id'], 'name': row['theater__name'], 'count': row['count']}
+            for row in theaters
+        ],
+        'prices': [
+            {
+                'key': key,
+                'min': float(low) if low is not None else None,
+                'max': float(high) if high is not None else None,
+                'count': buckets[f'price_{key}'],
+            }
+            for key, low, high in PRICE_BUCKETS
+        ],
+        'dates': [{'key': key, 'count': buckets[f'date_{key}']} for key, _, _ in DATE_BUCKETS],
+    }
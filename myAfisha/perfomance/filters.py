@@ -1,7 +1,42 @@
+import datetime
+
 import django_filters
-from django.db.models import Min, Max
+from django.db.models import Exists, Min, Max, OuterRef, Q
+from django.utils import timezone
+from rest_framework.filters import OrderingFilter, SearchFilter
 from .models import Performance, PerformanceCategory, PerformanceSchedule
 
+
+def start_of_day(date):
+    """
+    Начало дня в текущей временной зоне
+    """
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    Поиск по параметру search через полнотекстовый индекс спектаклей
+    вместо icontains по каждому полю из search_fields
+    """
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return queryset.search(' '.join(terms))
+
+
+class RelevanceOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter, который не перебивает сортировку по релевантности:
+    если queryset отсортирован по search_rank и клиент не передал ordering,
+    порядок сохраняется
+    """
+    def filter_queryset(self, request, queryset, view):
+        if 'search_rank' in queryset.query.annotations and not request.query_params.get(self.ordering_param):
+            return queryset
+        return super().filter_queryset(request, queryset, view)
+
 class PerformanceFilter(django_filters.FilterSet):
     """
     Фильтр для спектаклей с различными опциями фильтрации
@@ -20,34 +55,41 @@ class PerformanceFilter(django_filters.FilterSet):
         lookup_expr='icontains'
     )
     
+    # Фильтры по расписанию (цена, даты, места, театр) применяются вместе
+    # одним EXISTS, поэтому все условия должны выполняться для одного показа
+    # (см. filter_queryset)
+
     # Фильтр по минимальной и максимальной цене билета
     min_price = django_filters.NumberFilter(
         field_name='schedule__price', 
         lookup_expr='gte',
-        method='filter_by_price'
+        method='filter_by_schedule'
     )
     max_price = django_filters.NumberFilter(
         field_name='schedule__price', 
         lookup_expr='lte',
-        method='filter_by_price'
+        method='filter_by_schedule'
     )
     
-    # Фильтр по дате (спектакли, которые проходят после указанной даты)
+    # Фильтр по дате (спектакли, которые проходят начиная с указанной даты)
     date_after = django_filters.DateFilter(
         field_name='schedule__date_time', 
-        lookup_expr='gte'
+        lookup_expr='gte',
+        method='filter_by_schedule'
     )
     
-    # Фильтр по дате (спектакли, которые проходят до указанной даты)
+    # Фильтр по дате (спектакли, которые проходят до указанной даты включительно)
     date_before = django_filters.DateFilter(
         field_name='schedule__date_time', 
-        lookup_expr='lte'
+        lookup_expr='lte',
+        method='filter_by_schedule'
     )
     
     # Фильтр по наличию мест (спектакли с количеством мест больше указанного)
     min_seats = django_filters.NumberFilter(
         field_name='schedule__available_seats', 
-        lookup_expr='gte'
+        lookup_expr='gte',
+        method='filter_by_schedule'
     )
     
     # Фильтр по продолжительности (в минутах)
@@ -57,24 +99,46 @@ class PerformanceFilter(django_filters.FilterSet):
     # Фильтр по театру
     theater = django_filters.CharFilter(
         field_name='schedule__theater__name', 
-        lookup_expr='icontains'
+        lookup_expr='icontains',
+        method='filter_by_schedule'
     )
-    
-    def filter_by_price(self, queryset, name, value):
+
+    def filter_by_schedule(self, queryset, name, value):
+        """
+        Условия по расписанию собираются в filter_queryset
         """
-        Метод для фильтрации по цене с учетом связанных расписаний
+        return queryset
+
+    def get_schedule_conditions(self):
+        """
+        Возвращает Q для одной строки PerformanceSchedule по всем заданным фильтрам расписания.
+        Границы дат переводятся в диапазон date_time по текущей временной зоне,
+        чтобы сравнение шло по самому столбцу и могло использовать индекс.
         """
-        # Получаем ID спектаклей, у которых есть расписания с подходящей ценой
-        if name == 'schedule__price__gte':
-            performance_ids = PerformanceSchedule.objects.filter(
-                price__gte=value
-            ).values_list('performance_id', flat=True).distinct()
-        else:
-            performance_ids = PerformanceSchedule.objects.filter(
-                price__lte=value
-            ).values_list('performance_id', flat=True).distinct()
-            
-        return queryset.filter(id__in=performance_ids)
+        data = self.form.cleaned_data
+        conditions = Q()
+        if data.get('min_price') is not None:
+            conditions &= Q(price__gte=data['min_price'])
+        if data.get('max_price') is not None:
+            conditions &= Q(price__lte=data['max_price'])
+        if data.get('date_after'):
+            conditions &= Q(date_time__gte=start_of_day(data['date_after']))
+        if data.get('date_before'):
+            conditions &= Q(date_time__lt=start_of_day(data['date_before'] + datetime.timedelta(days=1)))
+        if data.get('min_seats') is not None:
+            conditions &= Q(available_seats__gte=data['min_seats'])
+        if data.get('theater'):
+            conditions &= Q(theater__name__icontains=data['theater'])
+        return conditions
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        conditions = self.get_schedule_conditions()
+        if conditions:
+            queryset = queryset.filter(Exists(
+                PerformanceSchedule.objects.filter(conditions, performance=OuterRef('pk'))
+            ))
+        return queryset
     
     def filter_by_duration_min(self, queryset, name, value):
         """
@@ -100,4 +164,33 @@ class PerformanceFilter(django_filters.FilterSet):
             'date_after', 'date_before',
             'min_seats', 'min_duration', 'max_duration',
             'theater'
-        ] 
\ No newline at end of file
+        ]
+
+
+class ScheduleFilter(django_filters.FilterSet):
+    """
+    Фильтр показов. Условия накладываются прямо на строки расписания,
+    поэтому JOIN со спектаклями и DISTINCT не нужны
+    """
+    date_after = django_filters.DateFilter(method='filter_date_after')
+    date_before = django_filters.DateFilter(method='filter_date_before')
+    theater = django_filters.NumberFilter(field_name='theater_id')
+    theater_name = django_filters.CharFilter(field_name='theater__name', lookup_expr='icontains')
+    performance = django_filters.NumberFilter(field_name='performance_id')
+    category = django_filters.NumberFilter(field_name='performance__category_id')
+    min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    min_seats = django_filters.NumberFilter(field_name='available_seats', lookup_expr='gte')
+
+    def filter_date_after(self, queryset, name, value):
+        return queryset.filter(date_time__gte=start_of_day(value))
+
+    def filter_date_before(self, queryset, name, value):
+        return queryset.filter(date_time__lt=start_of_day(value + datetime.timedelta(days=1)))
+
+    class Meta:
+        model = PerformanceSchedule
+        fields = [
+            'date_after', 'date_before', 'theater', 'theater_name', 'performance',
+            'category', 'min_price', 'max_price', 'min_seats'
+        ]
@@ -0,0 +1,214 @@
+"""
+Нечеткий поиск по названиям спектаклей, категорий и театров
+для подсказок "возможно, вы имели в виду".
+
+Поиск двухуровневый. Сначала каждое слово запроса сопоставляется со словарем
+слов всех названий по триграммам, как в pg_trgm: слово дополняется пробелами
+('  гамлет ') и режется на тройки символов, сходство - коэффициент Жаккара.
+Затем названия, содержащие найденные слова, берутся из списков слово -> названия.
+Словарь слов намного меньше числа названий, поэтому опечатка исправляется
+без перебора всего каталога.
+
+Индекс строится в памяти процесса при первом обращении и сбрасывается
+сигналами при изменении названий (см. signals.py), а также по истечении
+FUZZY_INDEX_TTL, чтобы остальные процессы тоже увидели изменения.
+"""
+import heapq
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+
+# Минимальное сходство слова запроса со словом из словаря (как pg_trgm.similarity_threshold)
+DEFAULT_THRESHOLD = 0.3
+# Сколько вариантов исправления учитывается для одного слова запроса
+MAX_CORRECTIONS = 5
+FUZZY_INDEX_TTL = 300
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def words(text):
+    """
+    Слова строки в нижнем регистре, 'ё' приравнена к 'е'
+    """
+    return _WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Индекс названий. Запись - кортеж (тип, id, название).
+    """
+
+    def __init__(self, entries):
+        self.entries = []
+        self.entry_sizes = array('H')
+        self.vocabulary = {}
+        self.word_entries = []
+        for entry in entries:
+            entry_words = set(words(entry[2]))
+            if not entry_words:
+                continue
+            number = len(self.entries)
+            self.entries.append(entry)
+            self.entry_sizes.append(min(len(entry_words), 65535))
+            for word in entry_words:
+                word_number = self.vocabulary.get(word)
+                if word_number is None:
+                    word_number = self.vocabulary[word] = len(self.word_entries)
+                    self.word_entries.append(array('I'))
+                self.word_entries[word_number].append(number)
+
+        # Триграммный индекс по словарю: триграмма -> номера слов
+        self.word_list = list(self.vocabulary)
+        self.word_trigrams = []
+        self.trigram_ids = {}
+        postings = {}
+        for word_number, word in enumerate(self.word_list):
+            ids = []
+            for gram in trigrams(word):
+                gram_id = self.trigram_ids.setdefault(gram, len(self.trigram_ids))
+                postings.setdefault(gram_id, array('I')).append(word_number)
+                ids.append(gram_id)
+            self.word_trigrams.append(tuple(ids))
+        self.postings = postings
+
+    def __len__(self):
+        return len(self.entries)
+
+    def similar_words(self, word, threshold=DEFAULT_THRESHOLD, limit=MAX_CORRECTIONS):
+        """
+        Возвращает до limit пар (номер слова, сходство) со сходством не ниже threshold.
+
+        Если сходство Жаккара не ниже t, то общих триграмм не меньше t * n, где n -
+        число триграмм запроса. Слово с m общими триграммами обязано встретиться
+        хотя бы в одном из n - m + 1 самых редких списков, поэтому частые
+        триграммы для отбора кандидатов не читаются.
+        """
+        exact = self.vocabulary.get(word)
+        query_grams = trigrams(word)
+        size = len(query_grams)
+        required = max(1, math.ceil(threshold * size))
+        known = [self.trigram_ids[gram] for gram in query_grams if gram in self.trigram_ids]
+        known.sort(key=lambda gram_id: len(self.postings[gram_id]))
+        prefix = len(known) - required + 1
+        if prefix <= 0:
+            return [(exact, 1.0)] if exact is not None else []
+
+        candidates = Counter()
+        for gram_id in known[:prefix]:
+            candidates.update(self.postings[gram_id])
+
+        query_ids = set(known)
+        scored = []
+        for word_number in candidates:
+            word_ids = self.word_trigrams[word_number]
+            shared = len(query_ids.intersection(word_ids))
+            similarity = shared / (size + len(word_ids) - shared)
+            if similarity >= threshold:
+                scored.append((similarity, word_number))
+        return [(number, similarity) for similarity, number in heapq.nlargest(limit, scored)]
+
+    def search(self, query, limit=10, threshold=DEFAULT_THRESHOLD):
+        """
+        Возвращает до limit записей в виде списка словарей {type, id, name, score}.
+
+        score - среднее по словам запроса сходство с лучшим подходящим словом
+        названия. Сначала ищутся названия, в которых нашлись все слова запроса,
+        если таких нет - хотя бы одно. При равном score выше названия с меньшим
+        числом слов.
+        """
+        query_words = [word for word in dict.fromkeys(words(query)) if len(word) > 1]
+        if not query_words:
+            return []
+
+        matches = []
+        for word in query_words:
+            best = {}
+            # Лучшее сходство записывается последним и перекрывает худшие
+            for word_number, similarity in reversed(self.similar_words(word, threshold)):
+                best.update(dict.fromkeys(self.word_entries[word_number], similarity))
+            if best:
+                matches.append(best)
+        if not matches:
+            return []
+
+        matches.sort(key=len)
+        candidates = set(matches[0]).intersection(*matches[1:])
+        if not candidates:
+            candidates = set().union(*matches)
+
+        size = len(query_words)
+        scored = heapq.nsmallest(
+            limit,
+            (
+                (-sum(best.get(number, 0.0) for best in matches) / size, self.entry_sizes[number], number)
+                for number in candidates
+            )
+        )
+        return [
+            {
+                'type': self.entries[number][0],
+                'id': self.entries[number][1],
+                'name': self.entries[number][2],
+                'score': round(-score, 3),
+            }
+            for score, _, number in scored
+        ]
+
+
+def load_entries():
+    from main.models import Theater
+    from .models import Performance, PerformanceCategory
+
+    sources = (
+        ('performance', Performance._base_manager),
+        ('category', PerformanceCategory._base_manager),
+        ('theater', Theater._base_manager),
+    )
+    for kind, manager in sources:
+        for pk, name in manager.values_list('id', 'name').iterator():
+            yield kind, pk, name
+
+
+_index = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Возвращает индекс текущего процесса, перестраивая его при необходимости
+    """
+    global _index, _built_at
+    index = _index
+    if index is not None and time.monotonic() - _built_at < FUZZY_INDEX_TTL:
+        return index
+    with _lock:
+        if _index is None or time.monotonic() - _built_at >= FUZZY_INDEX_TTL:
+            _index = TrigramIndex(load_entries())
+            _built_at = time.monotonic()
+        return _index
+
+
+def invalidate_index():
+    global _index
+    _index = None
+
+
+def fuzzy_search(query, limit=10, threshold=DEFAULT_THRESHOLD):
+    return get_index().search(query, limit=limit, threshold=threshold)
+
+
+def did_you_mean(matches):
+    """
+    Название лучшего совпадения или None
+    """
+    return matches[0]['name'] if matches else None
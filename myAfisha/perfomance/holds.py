@@ -0,0 +1,120 @@
+"""
+Удержание мест под элементы корзины.
+
+При добавлении в корзину места переносятся из свободных (available_seats)
+в удержанные (held_seats) расписания и закрепляются за элементом корзины
+на SEAT_HOLD_TTL секунд. Поэтому доступность читается из одного поля
+без суммирования удержаний, а при оформлении заказа удержанные места
+продаются без повторной проверки.
+
+Истекшие удержания возвращаются в свободные места пачками периодической
+задачей (см. tasks.py) и лениво - перед новым удержанием мест того же
+расписания. Пока удержание не возвращено, владелец корзины может оформить
+заказ на эти места. Вместе с удержанием освобождаются и выбранные
+на карте зала места (см. seatmap.py).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import inventory, seatmap
+from .models import CartItem, PerformanceSchedule
+
+RECLAIM_BATCH_SIZE = 1000
+
+
+def _by_schedule(rows):
+    quantities = {}
+    for schedule_id, quantity in rows:
+        quantities[schedule_id] = quantities.get(schedule_id, 0) + quantity
+    return quantities
+
+
+def hold_for_cart_item(cart_item, quantity):
+    """
+    Устанавливает количество билетов элемента корзины (новый элемент создается)
+    и удерживает под него места, продлевая удержание.
+    Возвращает False, если свободных мест не хватает; тогда элемент не меняется.
+    """
+    with inventory.compensating(), transaction.atomic():
+        held = 0
+        if cart_item.pk is not None:
+            held = CartItem.objects.select_for_update().filter(pk=cart_item.pk).values_list(
+                'held_quantity', flat=True
+            ).first() or 0
+        schedule_id = cart_item.performance_schedule_id
+        if quantity > held:
+            if not PerformanceSchedule.objects.hold_many({schedule_id: quantity - held}):
+                return False
+        elif quantity < held:
+            PerformanceSchedule.objects.release_holds({schedule_id: held - quantity})
+
+        cart_item.quantity = quantity
+        cart_item.held_quantity = quantity
+        cart_item.hold_expires_at = timezone.now() + timedelta(seconds=settings.SEAT_HOLD_TTL)
+        cart_item.save()
+    return True
+
+
+def delete_cart_items(queryset):
+    """
+    Удаляет элементы корзины, возвращая удержанные под них места
+    """
+    with transaction.atomic():
+        rows = list(queryset.select_for_update().values_list('performance_schedule_id', 'held_quantity', 'seats'))
+        queryset.delete()
+        PerformanceSchedule.objects.release_holds(_by_schedule((schedule_id, held) for schedule_id, held, _ in rows))
+        seatmap.free_item_seats((schedule_id, seats) for schedule_id, held, seats in rows if held)
+
+
+def reclaim_expired_holds(schedule_ids=None, now=None, batch_size=RECLAIM_BATCH_SIZE):
+    """
+    Возвращает в свободные места удержания, срок которых истек.
+    schedule_ids ограничивает проверку расписаниями (ленивый возврат).
+    Каждая пачка - три запроса: выбор, сброс удержаний в корзинах и один
+    UPDATE расписаний. Возвращает количество освобожденных мест.
+    """
+    now = now or timezone.now()
+    expired = CartItem.objects.filter(held_quantity__gt=0, hold_expires_at__lte=now)
+    if schedule_ids is not None:
+        expired = expired.filter(performance_schedule_id__in=schedule_ids)
+
+    reclaimed = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                expired.select_for_update(skip_locked=True).order_by('pk')
+                .values_list('pk', 'performance_schedule_id', 'held_quantity', 'seats')[:batch_size]
+            )
+            if not rows:
+                break
+            selected = len(rows)
+            if not _reset_holds([pk for pk, _, _, _ in rows], now):
+                # Часть удержаний успели продлить, продать или удалить:
+                # остальные сбрасываем по одному, измененные пропускаем
+                rows = [row for row in rows if _reset_holds([row[0]], now)]
+            PerformanceSchedule.objects.release_holds(
+                _by_schedule((schedule_id, quantity) for _, schedule_id, quantity, _ in rows)
+            )
+            seatmap.free_item_seats((schedule_id, seats) for _, schedule_id, _, seats in rows)
+            reclaimed += sum(quantity for _, _, quantity, _ in rows)
+        if selected < batch_size:
+            break
+    return reclaimed
+
+
+def _reset_holds(pks, now):
+    """
+    Сбрасывает удержания элементов корзины pks, если все они еще истекшие.
+    Иначе ничего не меняет и возвращает False.
+    """
+    with transaction.atomic():
+        updated = CartItem.objects.filter(
+            pk__in=pks, held_quantity__gt=0, hold_expires_at__lte=now
+        ).update(held_quantity=0, hold_expires_at=None, seats=[])
+        if updated != len(pks):
+            transaction.set_rollback(True)
+            return False
+    return True
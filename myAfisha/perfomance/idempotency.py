@@ -0,0 +1,145 @@
+"""
+Ключи идемпотентности для POST-запросов, которые клиенты повторяют
+по таймауту (оформление заказа, изменения корзины).
+
+Первый запрос с заголовком Idempotency-Key занимает ключ строкой
+IdempotencyKey (уникальная пара пользователь + ключ) и после выполнения
+сохраняет в ней код и тело ответа. Повтор с тем же ключом получает
+сохраненный ответ без повторного выполнения, а повтор, пришедший пока
+первый запрос еще выполняется, ждет его завершения и затем получает 409.
+Незавершенный ключ занимается заново только через IDEMPOTENCY_LEASE секунд,
+когда первый запрос заведомо прерван таймаутом воркера.
+Ключи хранятся IDEMPOTENCY_KEY_TTL секунд, истекшие удаляет периодическая
+задача (см. tasks.py).
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+# Сколько ждать завершения такого же запроса, секунд
+IDEMPOTENCY_WAIT = 10.0
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+
+def request_fingerprint(endpoint, request, kwargs):
+    """
+    Хеш операции, параметров URL и тела запроса: повтор с тем же ключом
+    должен совпадать с исходным запросом
+    """
+    payload = json.dumps([endpoint, kwargs, request.data], sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _claim(user, key, endpoint, fingerprint):
+    """
+    Занимает ключ. Возвращает (True, новая запись) или (False, существующая запись или None)
+    """
+    try:
+        with transaction.atomic():
+            return True, IdempotencyKey.objects.create(
+                user=user,
+                key=key,
+                endpoint=endpoint,
+                request_hash=fingerprint,
+                expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+            )
+    except IntegrityError:
+        return False, IdempotencyKey.objects.filter(user=user, key=key).first()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.status_code)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _execute(view, record, request, args, kwargs):
+    try:
+        response = view(request, *args, **kwargs)
+    except Exception:
+        record.delete()
+        raise
+    if response.status_code >= 500:
+        # Ошибку сервера не запоминаем: повтор выполнится заново
+        record.delete()
+    else:
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            status_code=response.status_code, response_body=response.data
+        )
+    return response
+
+
+def idempotent(endpoint, wait=IDEMPOTENCY_WAIT):
+    """
+    Декоратор функции-представления (под @api_view): если в запросе есть
+    заголовок Idempotency-Key, выполняет представление один раз на пару
+    пользователь + ключ и отдает повторам сохраненный ответ
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key or not request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {"error": f"Ключ идемпотентности длиннее {MAX_KEY_LENGTH} символов"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            fingerprint = request_fingerprint(endpoint, request, kwargs)
+            deadline = time.monotonic() + wait
+            while True:
+                claimed, record = _claim(request.user, key, endpoint, fingerprint)
+                if claimed:
+                    return _execute(view, record, request, args, kwargs)
+
+                if record is not None:
+                    now = timezone.now()
+                    abandoned = (
+                        record.status_code is None
+                        and record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LEASE)
+                    )
+                    if record.expires_at <= now or abandoned:
+                        # Истекший или брошенный ключ освобождаем и занимаем заново
+                        IdempotencyKey.objects.filter(pk=record.pk).delete()
+                        continue
+                    if record.endpoint != endpoint or record.request_hash != fingerprint:
+                        return Response(
+                            {"error": "Ключ идемпотентности уже использован для другого запроса"},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                        )
+                    if record.status_code is not None:
+                        return _replay(record)
+
+                # Такой же запрос еще выполняется - ждем его ответа
+                if time.monotonic() >= deadline:
+                    return Response(
+                        {"error": "Запрос с этим ключом идемпотентности еще выполняется"},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+        return wrapper
+    return decorator
+
+
+def purge_expired_keys(now=None):
+    """
+    Удаляет истекшие ключи, возвращает их количество
+    """
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
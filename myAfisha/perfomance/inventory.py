@@ -0,0 +1,399 @@
+"""
+Остатки мест "горячих" расписаний в Redis.
+
+Когда на старте продаж тысячи покупателей бронируют места одного показа,
+узким местом становится блокировка его строки в базе. Для расписаний
+с флагом hot_inventory свободные и удержанные места хранятся в хеше Redis,
+а проверка и списание - один Lua-скрипт, атомарный сразу для нескольких
+расписаний. Остальные расписания работают через условные UPDATE в базе
+(см. PerformanceScheduleQuerySet).
+
+Изменения копятся в хеше (pending_*) и переносятся в available_seats
+и held_seats пачками задачей flush_inventory (write-behind). Перенос
+выполняется ровно один раз: перед записью в базу накопленное переносится
+в inflight_* под номером seq, а UPDATE меняет только строку с тем же
+inventory_seq и увеличивает его. Если процесс упал после записи в базу,
+следующий перенос увидит увеличенный номер и только подтвердит его в Redis.
+
+Изменения в Redis не откатываются вместе с транзакцией базы: код, который
+после бронирования может упасть, оборачивается в compensating().
+Расписание переводится в Redis до открытия продаж (manage.py inventory enable),
+остатки "горячих" расписаний в базе отстают от Redis на период переноса.
+При запуске воркера Celery остатки сверяются с базой (reconcile).
+
+Режим включается настройкой INVENTORY_REDIS_URL.
+"""
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from redis.commands.core import Script
+
+# Все ключи в одном слоте Redis Cluster, чтобы скрипты могли менять несколько расписаний
+KEY_PREFIX = '{inventory}:schedule:'
+DIRTY_KEY = '{inventory}:dirty'
+# Сколько раз переносить изменения, дожидаясь, пока расписание можно будет убрать из Redis
+DRAIN_ATTEMPTS = 10
+
+# KEYS[1] - множество расписаний с неперенесенными изменениями, KEYS[2..] - хеши остатков.
+# ARGV[1] - проверять ли нехватку мест, далее по три значения на расписание:
+# id, изменение свободных и изменение удержанных мест.
+# Возвращает {1 или 0 при нехватке мест, id расписаний без хеша в Redis}.
+APPLY_SCRIPT = Script(None, b"""
+local check = ARGV[1] == '1'
+local cold = {}
+for i = 2, #KEYS do
+    local arg = (i - 2) * 3 + 2
+    if redis.call('EXISTS', KEYS[i]) == 0 then
+        cold[#cold + 1] = ARGV[arg]
+    elseif check then
+        local state = redis.call('HMGET', KEYS[i], 'available', 'held')
+        if (tonumber(state[1]) or 0) + tonumber(ARGV[arg + 1]) < 0
+            or (tonumber(state[2]) or 0) + tonumber(ARGV[arg + 2]) < 0 then
+            return {0, {}}
+        end
+    end
+end
+for i = 2, #KEYS do
+    local arg = (i - 2) * 3 + 2
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('HINCRBY', KEYS[i], 'available', ARGV[arg + 1])
+        redis.call('HINCRBY', KEYS[i], 'held', ARGV[arg + 2])
+        redis.call('HINCRBY', KEYS[i], 'pending_available', ARGV[arg + 1])
+        redis.call('HINCRBY', KEYS[i], 'pending_held', ARGV[arg + 2])
+        redis.call('SADD', KEYS[1], ARGV[arg])
+    end
+end
+return {1, cold}
+""")
+
+# KEYS - хеши остатков, ARGV - по три значения на расписание: свободные, удержанные, номер переноса.
+# Создает хеши, которых еще нет; возвращает количество созданных.
+LOAD_SCRIPT = Script(None, b"""
+local loaded = 0
+for i = 1, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 0 then
+        local arg = (i - 1) * 3 + 1
+        redis.call('HSET', KEYS[i], 'available', ARGV[arg], 'held', ARGV[arg + 1], 'seq', ARGV[arg + 2],
+            'pending_available', 0, 'pending_held', 0, 'inflight_available', 0, 'inflight_held', 0)
+        loaded = loaded + 1
+    end
+end
+return loaded
+""")
+
+# KEYS - хеши остатков. Если предыдущий перенос подтвержден, переносит накопленные
+# изменения в inflight_*. Возвращает по четыре числа на расписание:
+# есть ли хеш, номер переноса, изменение свободных и удержанных мест.
+BEGIN_FLUSH_SCRIPT = Script(None, b"""
+local result = {}
+for i = 1, #KEYS do
+    local state = redis.call('HMGET', KEYS[i], 'seq', 'inflight_available', 'inflight_held',
+        'pending_available', 'pending_held')
+    if not state[1] then
+        result[#result + 1] = 0
+        result[#result + 1] = 0
+        result[#result + 1] = 0
+        result[#result + 1] = 0
+    else
+        local available, held = tonumber(state[2]) or 0, tonumber(state[3]) or 0
+        if available == 0 and held == 0 then
+            available, held = tonumber(state[4]) or 0, tonumber(state[5]) or 0
+            redis.call('HSET', KEYS[i], 'inflight_available', available, 'inflight_held', held,
+                'pending_available', 0, 'pending_held', 0)
+        end
+        result[#result + 1] = 1
+        result[#result + 1] = tonumber(state[1])
+        result[#result + 1] = available
+        result[#result + 1] = held
+    end
+end
+return result
+""")
+
+# KEYS[1] - множество расписаний с неперенесенными изменениями, KEYS[2..] - хеши остатков.
+# ARGV - по два значения на расписание: id и номер записанного в базу переноса.
+# Подтверждает перенос, если номер не изменился, и убирает расписание из множества,
+# если новых изменений нет.
+ACK_FLUSH_SCRIPT = Script(None, b"""
+for i = 2, #KEYS do
+    local arg = (i - 2) * 2 + 1
+    local state = redis.call('HMGET', KEYS[i], 'seq', 'pending_available', 'pending_held')
+    if state[1] and tonumber(state[1]) == tonumber(ARGV[arg + 1]) then
+        redis.call('HSET', KEYS[i], 'seq', tonumber(state[1]) + 1, 'inflight_available', 0, 'inflight_held', 0)
+        if (tonumber(state[2]) or 0) == 0 and (tonumber(state[3]) or 0) == 0 then
+            redis.call('SREM', KEYS[1], ARGV[arg])
+        end
+    end
+end
+return 1
+""")
+
+# KEYS[1] - множество расписаний с неперенесенными изменениями, KEYS[2..] - хеши остатков,
+# ARGV - id расписаний. Удаляет хеши, все изменения которых перенесены в базу;
+# возвращает id остальных.
+DROP_SCRIPT = Script(None, b"""
+local left = {}
+for i = 2, #KEYS do
+    local state = redis.call('HMGET', KEYS[i], 'pending_available', 'pending_held',
+        'inflight_available', 'inflight_held')
+    if (tonumber(state[1]) or 0) == 0 and (tonumber(state[2]) or 0) == 0
+        and (tonumber(state[3]) or 0) == 0 and (tonumber(state[4]) or 0) == 0 then
+        redis.call('DEL', KEYS[i])
+        redis.call('SREM', KEYS[1], ARGV[i - 1])
+    else
+        left[#left + 1] = ARGV[i - 1]
+    end
+end
+return left
+""")
+
+_client_override = None
+_local = threading.local()
+
+
+@lru_cache(maxsize=None)
+def _connect(url):
+    return redis.Redis.from_url(url)
+
+
+def get_client():
+    """
+    Клиент Redis с остатками или None, если режим выключен
+    """
+    if _client_override is not None:
+        return _client_override
+    url = settings.INVENTORY_REDIS_URL
+    return _connect(url) if url else None
+
+
+@contextmanager
+def using_client(client):
+    """
+    Временно ведет остатки в переданном клиенте (тесты, бенчмарк)
+    """
+    global _client_override
+    previous, _client_override = _client_override, client
+    try:
+        yield client
+    finally:
+        _client_override = previous
+
+
+def enabled():
+    return get_client() is not None
+
+
+def _key(pk):
+    return f'{KEY_PREFIX}{pk}'
+
+
+def _chunks(values, size):
+    return [values[index:index + size] for index in range(0, len(values), size)]
+
+
+def apply(changes, check=True):
+    """
+    Меняет остатки расписаний, которые ведутся в Redis.
+    changes - {id расписания: (изменение свободных, изменение удержанных мест)}.
+    Возвращает (False, ...) без изменений, если check и мест не хватает,
+    иначе (True, id расписаний, которых нет в Redis - их меняет база).
+    """
+    client = get_client()
+    if client is None or not changes:
+        return True, set(changes)
+    args = ['1' if check else '0']
+    for pk, (available, held) in changes.items():
+        args += [pk, available, held]
+    applied, cold = APPLY_SCRIPT(keys=[DIRTY_KEY] + [_key(pk) for pk in changes], args=args, client=client)
+    return bool(applied), {int(pk) for pk in cold}
+
+
+def revert(changes):
+    """
+    Отменяет изменения, ранее примененные apply
+    """
+    if changes:
+        apply({pk: (-available, -held) for pk, (available, held) in changes.items()}, check=False)
+
+
+def record(changes):
+    """
+    Запоминает примененные изменения для отмены в блоке compensating()
+    """
+    journal = getattr(_local, 'journal', None)
+    if changes and journal is not None:
+        journal.append(changes)
+
+
+@contextmanager
+def compensating():
+    """
+    Отменяет изменения остатков в Redis, сделанные в блоке, если он завершился
+    исключением: в отличие от базы они не откатываются вместе с транзакцией
+    """
+    parent = getattr(_local, 'journal', None)
+    _local.journal = journal = []
+    try:
+        yield
+    except BaseException:
+        for changes in reversed(journal):
+            revert(changes)
+        raise
+    else:
+        if parent is not None:
+            parent.extend(journal)
+    finally:
+        _local.journal = parent
+
+
+def seats(pk):
+    """
+    (свободные, удержанные) места расписания в Redis или None
+    """
+    client = get_client()
+    if client is None:
+        return None
+    available, held = client.hmget(_key(pk), 'available', 'held')
+    if available is None:
+        return None
+    return int(available), int(held)
+
+
+def _flush_batch(client, ids):
+    from .models import PerformanceSchedule
+
+    if not ids:
+        return 0
+    state = BEGIN_FLUSH_SCRIPT(keys=[_key(pk) for pk in ids], client=client)
+    batch, missing = {}, []
+    for pk, (exists, seq, available, held) in zip(ids, _chunks(state, 4)):
+        if exists:
+            batch[pk] = (seq, available, held)
+        else:
+            missing.append(pk)
+
+    applied = PerformanceSchedule.objects.apply_inventory(batch)
+    # Номер в базе на единицу больше - пачка записана (этим или параллельным переносом)
+    acked = [pk for pk, (seq, _, _) in batch.items() if applied.get(pk) == seq + 1]
+    if acked:
+        args = []
+        for pk in acked:
+            args += [pk, batch[pk][0]]
+        ACK_FLUSH_SCRIPT(keys=[DIRTY_KEY] + [_key(pk) for pk in acked], args=args, client=client)
+    # Удаленные расписания больше не ведем
+    deleted = [pk for pk in batch if pk not in applied]
+    if deleted:
+        client.delete(*[_key(pk) for pk in deleted])
+    if missing or deleted:
+        client.srem(DIRTY_KEY, *missing, *deleted)
+    return len(acked)
+
+
+def flush(schedule_ids=None, batch_size=None):
+    """
+    Переносит в базу изменения остатков, накопленные в Redis: по одному
+    UPDATE на пачку расписаний. Без schedule_ids - все измененные расписания.
+    Возвращает количество перенесенных расписаний.
+    """
+    client = get_client()
+    if client is None:
+        return 0
+    batch_size = batch_size or settings.INVENTORY_FLUSH_BATCH_SIZE
+    if schedule_ids is not None:
+        return sum(_flush_batch(client, ids) for ids in _chunks(list(schedule_ids), batch_size))
+
+    flushed = 0
+    # Не больше проходов, чем было пачек в начале: горячие расписания снова попадают в множество
+    for _ in range(-(-client.scard(DIRTY_KEY) // batch_size)):
+        ids = [int(pk) for pk in client.srandmember(DIRTY_KEY, batch_size)]
+        flushed += _flush_batch(client, ids)
+        if len(ids) < batch_size:
+            break
+    return flushed
+
+
+def _load(client, schedules):
+    args = []
+    for schedule in schedules:
+        args += [schedule.available_seats, schedule.held_seats, schedule.inventory_seq]
+    if not args:
+        return 0
+    return LOAD_SCRIPT(keys=[_key(schedule.pk) for schedule in schedules], args=args, client=client)
+
+
+def _drain(client, ids):
+    """
+    Переносит изменения и удаляет хеши расписаний из Redis.
+    Возвращает id расписаний, которые не удалось убрать из-за новых изменений.
+    """
+    left = list(ids)
+    for _ in range(DRAIN_ATTEMPTS):
+        if not left:
+            break
+        flush(left)
+        left = [
+            int(pk)
+            for chunk in _chunks(left, settings.INVENTORY_FLUSH_BATCH_SIZE)
+            for pk in DROP_SCRIPT(keys=[DIRTY_KEY] + [_key(pk) for pk in chunk], args=chunk, client=client)
+        ]
+    return left
+
+
+def enable(schedule_ids):
+    """
+    Переводит остатки расписаний в Redis. Строки блокируются, пока остатки
+    копируются, чтобы параллельное бронирование через базу не потерялось.
+    Возвращает количество расписаний, загруженных в Redis.
+    """
+    from .models import PerformanceSchedule
+
+    client = get_client()
+    if client is None:
+        return 0
+    with transaction.atomic():
+        schedules = list(
+            PerformanceSchedule.objects.select_for_update().filter(pk__in=schedule_ids).order_by('pk')
+            .only('id', 'available_seats', 'held_seats', 'inventory_seq')
+        )
+        PerformanceSchedule.objects.filter(pk__in=[schedule.pk for schedule in schedules]).update(hot_inventory=True)
+        return _load(client, schedules)
+
+
+def disable(schedule_ids):
+    """
+    Возвращает остатки расписаний в базу. Возвращает id расписаний,
+    которые остались в Redis из-за продолжающихся изменений.
+    """
+    from .models import PerformanceSchedule
+
+    schedule_ids = list(schedule_ids)
+    PerformanceSchedule.objects.filter(pk__in=schedule_ids).update(hot_inventory=False)
+    client = get_client()
+    if client is None:
+        return []
+    return _drain(client, schedule_ids)
+
+
+def reconcile():
+    """
+    Сверка после перезапуска: переносит в базу все накопленные изменения,
+    заново загружает из базы остатки "горячих" расписаний, потерянные Redis,
+    и убирает из Redis расписания, которые больше не "горячие".
+    Возвращает (загружено, убрано) расписаний.
+    """
+    from .models import PerformanceSchedule
+
+    client = get_client()
+    if client is None:
+        return 0, 0
+    flush()
+    cached = {int(key.rsplit(b':', 1)[1]) for key in client.scan_iter(match=f'{KEY_PREFIX}*', count=1000)}
+    hot = set(PerformanceSchedule.objects.filter(hot_inventory=True).values_list('pk', flat=True))
+    loaded = enable(hot - cached) if hot - cached else 0
+    stale = cached - hot
+    left = _drain(client, stale) if stale else []
+    return loaded, len(stale) - len(left)
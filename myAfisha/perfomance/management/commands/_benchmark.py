@@ -0,0 +1,95 @@
+"""
+Общие помощники для команд-бенчмарков: генерация каталога и замер времени.
+Все бенчмарки выполняются внутри транзакции, которая откатывается в конце.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+WORDS = [
+    'горе', 'ума', 'вишневый', 'сад', 'чайка', 'ревизор', 'гамлет', 'король', 'лир', 'три',
+    'сестры', 'дядя', 'ваня', 'женитьба', 'гроза', 'бесприданница', 'лес', 'мастер', 'маргарита',
+    'собачье', 'сердце', 'идиот', 'братья', 'карамазовы', 'преступление', 'наказание', 'отцы',
+    'дети', 'мертвые', 'души', 'евгений', 'онегин', 'пиковая', 'дама', 'щелкунчик', 'лебединое',
+    'озеро', 'спящая', 'красавица', 'кармен', 'травиата', 'тоска', 'жизель', 'ромео', 'джульетта',
+    'отелло', 'макбет', 'буря', 'сон', 'летнюю', 'ночь', 'двенадцатая', 'много', 'шума', 'ничего',
+    'любовь', 'война', 'мир', 'анна', 'каренина', 'вечер', 'комедия', 'трагедия', 'драма', 'мюзикл',
+    'постановка', 'режиссер', 'спектакль', 'актеры', 'сцена', 'премьера', 'классика', 'история',
+]
+
+
+def random_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed_performances(size, seed=42, schedules_per_performance=0, theaters=None, description_words=20):
+    """
+    Создает size спектаклей (и при необходимости расписаний) через bulk_create
+    """
+    from perfomance.models import Performance, PerformanceSchedule
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    performances = Performance.objects.bulk_create(
+        [
+            Performance(
+                name=random_text(rng, rng.randint(1, 4)).capitalize(),
+                description=random_text(rng, description_words),
+                duration_time=timedelta(minutes=rng.randint(60, 240)),
+                created_at=now - timedelta(minutes=index)
+            )
+            for index in range(size)
+        ],
+        batch_size=1000
+    )
+    if schedules_per_performance:
+        schedules = [
+            PerformanceSchedule(
+                performance_id=performance.pk,
+                theater=rng.choice(theaters) if theaters else None,
+                date_time=now + timedelta(hours=rng.randint(-24 * 30, 24 * 90)),
+                available_seats=rng.randint(0, 500),
+                price=Decimal(rng.randrange(300, 10000, 50))
+            )
+            for performance in performances
+            for _ in range(schedules_per_performance)
+        ]
+        PerformanceSchedule.objects.bulk_create(schedules, batch_size=1000)
+    return performances
+
+
+def measure(func, repeat):
+    """
+    Возвращает (медиана, p95) времени выполнения func в миллисекундах
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return statistics.median(timings), p95
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """
+    Выполняет блок в транзакции и откатывает все изменения
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
@@ -0,0 +1,79 @@
+import random
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.utils import timezone
+
+from perfomance.models import PerformanceSchedule
+
+from ._benchmark import seed_performances
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускает параллельных покупателей на одно расписание и проверяет, что продано '
+        'не больше мест, чем было. Потокам нужны закоммиченные данные, поэтому спектакль '
+        'и расписание создаются в базе и удаляются в конце.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=200, help='Количество параллельных покупателей')
+        parser.add_argument('--seats', type=int, default=50, help='Мест в расписании')
+
+    def handle(self, *args, buyers, seats, **options):
+        performance = seed_performances(1)[0]
+        try:
+            schedule = PerformanceSchedule.objects.create(
+                performance=performance,
+                date_time=timezone.now() + timedelta(days=1),
+                available_seats=seats,
+                price=Decimal('1000')
+            )
+            sold, retries, elapsed = self._run(schedule, buyers)
+            schedule.refresh_from_db()
+            oversold = sum(sold) + schedule.available_seats != seats or schedule.available_seats < 0
+            self.stdout.write(
+                f'{buyers} покупателей за {elapsed:.2f} s: продано {sum(sold)} из {seats} мест '
+                f'в {len(sold)} покупках, осталось {schedule.available_seats}, повторов {retries}'
+            )
+            if oversold:
+                self.stderr.write(self.style.ERROR('Продано больше мест, чем было'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Лишних мест не продано'))
+        finally:
+            performance.delete()
+
+    def _run(self, schedule, buyers):
+        # Все покупатели загрузили расписание до начала продаж и видят все места свободными
+        schedules = [PerformanceSchedule.objects.get(pk=schedule.pk) for _ in range(buyers)]
+        barrier = threading.Barrier(buyers)
+        sold = []
+        retries = []
+
+        def buyer(number):
+            try:
+                barrier.wait()
+                quantity = 1 + number % 3
+                while True:
+                    try:
+                        if schedules[number].reserve_seats(quantity):
+                            sold.append(quantity)
+                        return
+                    except OperationalError:
+                        # SQLite блокирует базу целиком - повторяем, как повторил бы клиент
+                        retries.append(number)
+                        time.sleep(random.uniform(0.001, 0.02))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer, args=(number,)) for number in range(buyers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sold, len(retries), time.perf_counter() - started
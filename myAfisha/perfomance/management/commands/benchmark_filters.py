@@ -0,0 +1,88 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.models import Theater
+from perfomance.filters import PerformanceFilter, start_of_day
+from perfomance.models import Performance, PerformanceSchedule
+
+from ._benchmark import measure, rolled_back, seed_performances
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает прежнюю фильтрацию по расписанию (отдельные подзапросы и JOIN с DISTINCT) '
+        'и один JOIN с теми же условиями, что у PerformanceFilter, с одним EXISTS из PerformanceFilter. '
+        'Данные создаются в транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=20000, help='Количество спектаклей')
+        parser.add_argument('--schedules', type=int, default=5, help='Показов на спектакль')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого запроса')
+        parser.add_argument('--explain', action='store_true', help='Вывести планы запросов')
+
+    def handle(self, *args, size, schedules, repeat, explain, **options):
+        today = timezone.localdate()
+        params = {
+            'min_price': '2000',
+            'max_price': '3000',
+            'date_after': (today + datetime.timedelta(days=7)).isoformat(),
+            'date_before': (today + datetime.timedelta(days=14)).isoformat(),
+            'min_seats': '100',
+            'theater': 'Театр 1',
+        }
+
+        with rolled_back():
+            self.stdout.write(f'Генерация {size} спектаклей по {schedules} показов...')
+            theaters = Theater.objects.bulk_create(
+                [Theater(name=f'Театр {index}', address='', description='') for index in range(20)]
+            )
+            seed_performances(size, schedules_per_performance=schedules, theaters=theaters, description_words=3)
+
+            # Те же границы, что у PerformanceFilter: date_before включает весь день
+            date_after = start_of_day(today + datetime.timedelta(days=7))
+            date_before_end = start_of_day(today + datetime.timedelta(days=15))
+
+            def legacy_queryset():
+                # Прежний вариант: цена - два независимых подзапроса, остальные
+                # условия - отдельные JOIN на каждый фильтр и DISTINCT
+                queryset = Performance.objects.all()
+                for lookup in ('price__gte', 'price__lte'):
+                    ids = PerformanceSchedule.objects.filter(
+                        **{lookup: params['min_price' if lookup == 'price__gte' else 'max_price']}
+                    ).values_list('performance_id', flat=True).distinct()
+                    queryset = queryset.filter(id__in=ids)
+                queryset = queryset.filter(schedule__date_time__gte=date_after)
+                queryset = queryset.filter(schedule__date_time__lt=date_before_end)
+                queryset = queryset.filter(schedule__available_seats__gte=params['min_seats'])
+                queryset = queryset.filter(schedule__theater__name__icontains=params['theater'])
+                return queryset.distinct().order_by('name', 'id')
+
+            def join_queryset():
+                # Те же условия одним JOIN по одной строке расписания и DISTINCT:
+                # находит те же спектакли, что и EXISTS, и сравнивается с ним напрямую
+                return Performance.objects.filter(
+                    schedule__price__gte=params['min_price'],
+                    schedule__price__lte=params['max_price'],
+                    schedule__date_time__gte=date_after,
+                    schedule__date_time__lt=date_before_end,
+                    schedule__available_seats__gte=params['min_seats'],
+                    schedule__theater__name__icontains=params['theater'],
+                ).distinct().order_by('name', 'id')
+
+            def exists_queryset():
+                return PerformanceFilter(params, queryset=Performance.objects.order_by('name', 'id')).qs
+
+            # legacy находит больше спектаклей: его условия могут выполняться на разных показах
+            for label, build in (('legacy', legacy_queryset), ('join', join_queryset), ('exists', exists_queryset)):
+                queryset = build()
+                median, p95 = measure(lambda: list(queryset.values_list('id', flat=True)[:20]), repeat)
+                count_median, _ = measure(queryset.count, repeat)
+                self.stdout.write(
+                    f'{label:7} first page: {median:8.1f} ms (p95 {p95:8.1f})   '
+                    f'count: {count_median:8.1f} ms   matches: {queryset.count()}'
+                )
+                if explain:
+                    self.stdout.write(queryset.explain())
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from perfomance.fuzzy import TrigramIndex, load_entries
+
+from ._benchmark import measure, rolled_back, seed_performances
+
+QUERIES = ['гамлт', 'вишнвый сад', 'щелкунчек', 'лебедино озеро', 'кармин', 'мастер и маргарта', 'ревизер']
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет построение и поиск по триграммному индексу названий на сгенерированном каталоге. '
+        'Данные создаются в транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100000, help='Количество спектаклей')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов каждого запроса')
+
+    def handle(self, *args, size, repeat, **options):
+        with rolled_back():
+            self.stdout.write(f'Генерация {size} спектаклей...')
+            seed_performances(size, description_words=1)
+
+            started = time.perf_counter()
+            index = TrigramIndex(load_entries())
+            self.stdout.write(
+                f'Индекс: {len(index)} названий, {len(index.postings)} триграмм, '
+                f'построен за {(time.perf_counter() - started) * 1000:.0f} ms'
+            )
+
+            for query in QUERIES:
+                median, p95 = measure(lambda: index.search(query), repeat)
+                matches = index.search(query, limit=1)
+                best = matches[0]['name'] if matches else '-'
+                self.stdout.write(f'{query!r:22} {median:7.2f} ms (p95 {p95:7.2f})   -> {best}')
@@ -0,0 +1,70 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from perfomance import inventory
+from perfomance.models import PerformanceSchedule
+
+from ._benchmark import rolled_back, seed_performances
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет бронирования в секунду для расписания с остатками в базе и в Redis '
+        '(по умолчанию fakeredis, --redis-url - настоящий сервер). '
+        'Данные в базе создаются в транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reservations', type=int, default=5000, help='Количество бронирований в каждом режиме')
+        parser.add_argument('--redis-url', help='Redis для режима остатков в Redis (по умолчанию fakeredis)')
+
+    def handle(self, *args, reservations, redis_url, **options):
+        if redis_url:
+            import redis
+            client = redis.Redis.from_url(redis_url)
+        else:
+            try:
+                import fakeredis
+            except ImportError:
+                raise CommandError('Установите fakeredis и lupa или укажите --redis-url')
+            client = fakeredis.FakeRedis()
+
+        with rolled_back():
+            performance = seed_performances(1)[0]
+            for mode in ('db', 'redis'):
+                schedule = PerformanceSchedule.objects.create(
+                    performance=performance,
+                    date_time=timezone.now() + timedelta(days=1),
+                    available_seats=reservations,
+                    price=Decimal('1000')
+                )
+                if mode == 'db':
+                    self._report(mode, schedule, reservations)
+                else:
+                    with inventory.using_client(client):
+                        inventory.enable([schedule.pk])
+                        try:
+                            self._report(mode, schedule, reservations)
+                            started = time.perf_counter()
+                            inventory.flush()
+                            self.stdout.write(f'{mode:5} перенос в базу: {(time.perf_counter() - started) * 1000:.1f} ms')
+                        finally:
+                            inventory.disable([schedule.pk])
+
+                schedule.refresh_from_db()
+                self.stdout.write(f'{mode:5} осталось мест в базе: {schedule.available_seats}')
+
+    def _report(self, mode, schedule, reservations):
+        started = time.perf_counter()
+        for _ in range(reservations):
+            PerformanceSchedule.objects.reserve_many({schedule.pk: 1})
+        elapsed = time.perf_counter() - started
+        oversold = PerformanceSchedule.objects.reserve_many({schedule.pk: 1})
+        self.stdout.write(
+            f'{mode:5} {reservations} бронирований за {elapsed:.2f} s: '
+            f'{reservations / elapsed:,.0f} брон./с, лишнее бронирование {"прошло" if oversold else "отклонено"}'
+        )
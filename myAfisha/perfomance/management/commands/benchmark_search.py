@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from perfomance.models import Performance
+from perfomance.search import rebuild_index
+
+from ._benchmark import measure, rolled_back, seed_performances
+
+QUERIES = ['гамлет', 'вишневый сад', 'сестры', 'любовь', 'мастера маргариту', 'премьера', 'щелкунчик', 'несуществующий']
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает поиск через icontains и полнотекстовый индекс на сгенерированном каталоге. '
+        'Данные создаются в транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100000, help='Количество спектаклей')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого запроса')
+
+    def handle(self, *args, size, repeat, **options):
+        with rolled_back():
+            self.stdout.write(f'Генерация {size} спектаклей...')
+            seed_performances(size)
+            rebuild_index()
+
+            for query in QUERIES:
+                def legacy():
+                    return list(
+                        Performance.objects.filter(
+                            Q(name__icontains=query) | Q(description__icontains=query)
+                        ).order_by('name').values_list('id', flat=True)[:20]
+                    )
+
+                def full_text():
+                    return list(Performance.objects.search(query).values_list('id', flat=True)[:20])
+
+                legacy_median, legacy_p95 = measure(legacy, repeat)
+                fts_median, fts_p95 = measure(full_text, repeat)
+                self.stdout.write(
+                    f'{query!r:24} icontains: {legacy_median:8.1f} ms (p95 {legacy_p95:8.1f})   '
+                    f'full-text: {fts_median:8.1f} ms (p95 {fts_p95:8.1f})'
+                )
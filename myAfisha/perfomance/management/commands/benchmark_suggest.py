@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from perfomance.suggest import POINT_UPDATE_LIMIT, PrefixIndex, load_entries
+
+from ._benchmark import rolled_back, seed_performances
+
+QUERIES = ['г', 'га', 'гам', 'вишн', 'сад', 'мастер м', 'щелкунчик', 'лебединое оз', 'несуществ']
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет построение индекса автодополнения, задержку подсказок (p50/p99) '
+        'и применение массовых изменений названий на сгенерированном каталоге. Данные создаются в транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100000, help='Количество спектаклей')
+        parser.add_argument('--repeat', type=int, default=1000, help='Повторов каждого запроса')
+        parser.add_argument('--updates', type=int, default=10000, help='Переименований при массовом изменении')
+
+    def handle(self, *args, size, repeat, updates, **options):
+        with rolled_back():
+            self.stdout.write(f'Генерация {size} спектаклей...')
+            seed_performances(size, description_words=1)
+
+            started = time.perf_counter()
+            index = PrefixIndex(load_entries())
+            self.stdout.write(
+                f'Индекс: {len(index)} записей, {len(index.keys)} ключей, {len(index.top)} готовых префиксов, '
+                f'построен за {(time.perf_counter() - started) * 1000:.0f} ms'
+            )
+
+            for query in QUERIES:
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    index.suggest(query)
+                    timings.append((time.perf_counter() - started) * 1_000_000)
+                timings.sort()
+                p50 = timings[len(timings) // 2]
+                p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+                self.stdout.write(f'{query!r:16} p50 {p50:7.1f} us   p99 {p99:7.1f} us')
+
+            # Массовое пересохранение: изменения применяются одной перестройкой,
+            # точечное применение стоит O(n) на изменение
+            changes = {(entry[0], entry[1]): f'{entry[2]} бис' for entry in index.entries[:updates]}
+            started = time.perf_counter()
+            index.apply(changes)
+            self.stdout.write(
+                f'{len(changes)} изменений одной перестройкой: {(time.perf_counter() - started) * 1000:.0f} ms'
+            )
+            sample = dict(list(changes.items())[:POINT_UPDATE_LIMIT])
+            started = time.perf_counter()
+            index.apply(sample)
+            per_change = (time.perf_counter() - started) / max(len(sample), 1)
+            self.stdout.write(
+                f'Точечно: {per_change * 1000:.2f} ms на изменение, '
+                f'~{per_change * len(changes):.1f} s на {len(changes)} изменений'
+            )
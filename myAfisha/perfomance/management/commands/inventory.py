@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from perfomance import inventory
+from perfomance.models import PerformanceSchedule
+
+
+class Command(BaseCommand):
+    help = (
+        'Управляет остатками мест "горячих" расписаний в Redis: enable/disable переводят '
+        'расписания в Redis и обратно, flush переносит изменения в базу, reconcile сверяет '
+        'Redis с базой, status показывает остатки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['enable', 'disable', 'flush', 'reconcile', 'status'])
+        parser.add_argument('schedule_ids', nargs='*', type=int, help='id расписаний (для enable и disable)')
+
+    def handle(self, *args, action, schedule_ids, **options):
+        if not inventory.enabled():
+            raise CommandError('Не задан INVENTORY_REDIS_URL')
+        if action in ('enable', 'disable') and not schedule_ids:
+            raise CommandError('Укажите id расписаний')
+
+        if action == 'enable':
+            loaded = inventory.enable(schedule_ids)
+            self.stdout.write(self.style.SUCCESS(f'Загружено в Redis {loaded} расписаний'))
+        elif action == 'disable':
+            left = inventory.disable(schedule_ids)
+            if left:
+                raise CommandError(f'Остатки еще меняются, расписания остались в Redis: {left}')
+            self.stdout.write(self.style.SUCCESS('Остатки возвращены в базу'))
+        elif action == 'flush':
+            self.stdout.write(self.style.SUCCESS(f'Перенесено {inventory.flush()} расписаний'))
+        elif action == 'reconcile':
+            loaded, dropped = inventory.reconcile()
+            self.stdout.write(self.style.SUCCESS(f'Загружено в Redis {loaded}, убрано из Redis {dropped} расписаний'))
+        else:
+            schedules = PerformanceSchedule.objects.filter(hot_inventory=True).order_by('pk')
+            for schedule in schedules.only('id', 'available_seats', 'held_seats'):
+                seats = inventory.seats(schedule.pk)
+                redis_state = f'{seats[0]} свободно, {seats[1]} удержано' if seats else 'нет в Redis'
+                self.stdout.write(
+                    f'#{schedule.pk}: Redis - {redis_state}; '
+                    f'база - {schedule.available_seats} свободно, {schedule.held_seats} удержано'
+                )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from perfomance.models import Counter, Like, Performance, Review
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает с нуля счетчики лайков отзывов, общий счетчик лайков '
+        'и счетчики отзывов и оценок спектаклей'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            reviews = Review.objects.recount_likes()
+            likes = Like.objects.count()
+            Counter.objects.update_or_create(name=Counter.LIKES, defaults={'value': likes})
+            performances = Performance.objects.rebuild_review_stats()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитаны лайки {reviews} отзывов, всего лайков: {likes}'))
+        self.stdout.write(self.style.SUCCESS(f'Пересчитаны отзывы и оценки {performances} спектаклей'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from perfomance.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс спектаклей'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Полнотекстовый индекс перестроен'))
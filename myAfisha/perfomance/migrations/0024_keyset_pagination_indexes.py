@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_hall'),
+        ('perfomance', '0023_auto_20250616_1331'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', 'id'], name='order_user_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['-created_at', 'id'], name='performance_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['name', 'id'], name='performance_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performanceschedule',
+            index=models.Index(fields=['date_time', 'id'], name='schedule_date_time_id_idx'),
+        ),
+    ]
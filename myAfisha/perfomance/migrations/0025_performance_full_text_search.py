@@ -0,0 +1,65 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:53
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Имя таблицы задано здесь, а не импортировано из perfomance.search:
+# миграция не должна меняться вместе с кодом приложения
+FTS_TABLE = 'perfomance_performance_fts'
+
+
+def create_search_index(apps, schema_editor):
+    """
+    SQLite: виртуальная таблица FTS5; PostgreSQL: GIN-индекс по search_vector.
+    Индекс сразу заполняется существующими спектаклями.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"name, description, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        # Приложение хранит в индексе стеммированный текст, но стемминг только
+        # отбрасывает окончания, поэтому префиксный запрос "основа"* находит
+        # и исходные слова. Точный вид индекс получает при следующем сохранении
+        # спектакля или командой rebuild_search_index
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+            "SELECT id, replace(replace(name, 'ё', 'е'), 'Ё', 'Е'), "
+            "replace(replace(coalesce(description, ''), 'ё', 'е'), 'Ё', 'Е') "
+            "FROM perfomance_performance"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS perfomance_performance_search_gin "
+            "ON perfomance_performance USING gin (search_vector)"
+        )
+        schema_editor.execute(
+            "UPDATE perfomance_performance SET search_vector = "
+            "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(description, '')), 'B')"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS perfomance_performance_search_gin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfomance', '0024_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='performance',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_hall'),
+        ('perfomance', '0025_performance_full_text_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='performanceschedule',
+            index=models.Index(fields=['performance', 'date_time'], name='schedule_perf_date_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performanceschedule',
+            index=models.Index(fields=['performance', 'price'], name='schedule_perf_price_idx'),
+        ),
+    ]
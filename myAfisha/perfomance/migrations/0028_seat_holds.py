@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfomance', '0027_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='held_quantity',
+            field=models.PositiveIntegerField(default=0, verbose_name='Удержано мест'),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Удержание до'),
+        ),
+        migrations.AddField(
+            model_name='performanceschedule',
+            name='held_seats',
+            field=models.PositiveIntegerField(default=0, verbose_name='Удержано мест'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfomance', '0028_seat_holds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='performanceschedule',
+            name='hot_inventory',
+            field=models.BooleanField(default=False, verbose_name='Остатки в Redis'),
+        ),
+        migrations.AddField(
+            model_name='performanceschedule',
+            name='inventory_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Номер переноса остатков'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfomance', '0029_schedule_inventory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='seats',
+            field=models.JSONField(blank=True, default=list, verbose_name='Места'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='seats',
+            field=models.JSONField(blank=True, default=list, verbose_name='Места'),
+        ),
+        migrations.AddField(
+            model_name='performanceschedule',
+            name='seat_map',
+            field=models.BinaryField(null=True, verbose_name='Карта занятости мест'),
+        ),
+        migrations.AddField(
+            model_name='performanceschedule',
+            name='seat_map_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия карты мест'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfomance', '0030_schedule_seat_map'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='performanceschedule',
+            name='admission_limit',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Лимит покупателей без очереди'),
+        ),
+    ]
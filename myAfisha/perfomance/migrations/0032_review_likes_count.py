@@ -0,0 +1,41 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:47
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_likes(apps, schema_editor):
+    """
+    Заполняет счетчик лайков существующих отзывов
+    """
+    Review = apps.get_model('perfomance', 'Review')
+    Like = apps.get_model('perfomance', 'Like')
+    likes = Like.objects.filter(review=OuterRef('pk')).order_by().values('review').annotate(value=Count('id'))
+    Review.objects.update(likes_count=Coalesce(Subquery(likes.values('value')[:1]), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfomance', '0031_schedule_admission_limit'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество лайков'),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['performance', '-created_at', '-id'], name='review_perf_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['performance', '-likes_count', '-id'], name='review_perf_likes_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:52
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def dedupe_likes(apps, schema_editor):
+    """
+    Удаляет повторные лайки (остается самый ранний), пересчитывает
+    счетчики лайков отзывов и заполняет общий счетчик лайков
+    """
+    Like = apps.get_model('perfomance', 'Like')
+    Review = apps.get_model('perfomance', 'Review')
+    Counter = apps.get_model('perfomance', 'Counter')
+    first_ids = Like.objects.values('user', 'review').annotate(first_id=Min('id')).values('first_id')
+    Like.objects.exclude(id__in=Subquery(first_ids)).delete()
+    likes = Like.objects.filter(review=OuterRef('pk')).order_by().values('review').annotate(value=Count('id'))
+    Review.objects.update(likes_count=Coalesce(Subquery(likes.values('value')[:1]), 0))
+    Counter.objects.update_or_create(name='likes', defaults={'value': Like.objects.count()})
+
+
+def drop_likes_counter(apps, schema_editor):
+    apps.get_model('perfomance', 'Counter').objects.filter(name='likes').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfomance', '0032_review_likes_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Название')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Счетчик',
+                'verbose_name_plural': 'Счетчики',
+            },
+        ),
+        migrations.RunPython(dedupe_likes, drop_likes_counter),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('user', 'review'), name='like_user_review_uniq'),
+        ),
+    ]
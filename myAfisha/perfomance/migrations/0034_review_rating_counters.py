@@ -0,0 +1,60 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:55
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_reviews(apps, schema_editor):
+    """
+    Заполняет количество отзывов спектаклей (оценок у существующих отзывов нет)
+    """
+    Performance = apps.get_model('perfomance', 'Performance')
+    Review = apps.get_model('perfomance', 'Review')
+    reviews = Review.objects.filter(performance=OuterRef('pk')).order_by().values('performance').annotate(value=Count('id'))
+    Performance.objects.update(review_count=Coalesce(Subquery(reviews.values('value')[:1]), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('perfomance', '0033_unique_like_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='performance',
+            name='average_rating',
+            field=models.FloatField(default=0, editable=False, verbose_name='Средняя оценка'),
+        ),
+        migrations.AddField(
+            model_name='performance',
+            name='rating_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.AddField(
+            model_name='performance',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.AddField(
+            model_name='performance',
+            name='review_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество отзывов'),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)], verbose_name='Оценка'),
+        ),
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['-average_rating', 'id'], name='performance_rating_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['-review_count', 'id'], name='performance_reviews_id_idx'),
+        ),
+    ]
@@ -1,9 +1,18 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+from django.db.models import (
+    Avg, Case, Count, Exists, ExpressionWrapper, F, Min, OuterRef, Prefetch, Subquery, Sum, Value, When, Window
+)
+from django.db.models.functions import Cast, Coalesce
 from django.utils import timezone
 from django.urls import reverse
 from main.models import Hall, Theater
 from users.models import User
 
+from . import inventory
+
 # Категория спектакля
 class PerformanceCategory(models.Model):
     name = models.CharField(max_length=255, unique=True, verbose_name='Имя')
@@ -17,6 +26,108 @@ class PerformanceCategory(models.Model):
         return self.name
 
 
+def _performance_aggregate(queryset, aggregate, output_field):
+    """
+    Оборачивает агрегат по связанным со спектаклем строкам (расписаниям, отзывам)
+    в коррелированный подзапрос, чтобы аннотации не размножали строки основного запроса
+    """
+    return Subquery(
+        queryset.order_by().values('performance').annotate(value=aggregate).values('value')[:1],
+        output_field=output_field
+    )
+
+
+def _average_rating():
+    """
+    Средняя оценка из счетчиков спектакля, 0 - оценок нет
+    """
+    return Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=Cast('rating_sum', models.FloatField()) / F('rating_count'),
+        output_field=models.FloatField()
+    )
+
+
+class PerformanceQuerySet(models.QuerySet):
+    def with_catalog_stats(self, user=None, with_reviews=True, reviews_limit=None):
+        """
+        Read model каталога: аннотирует спектакли количеством предстоящих показов,
+        средней и минимальной ценой и ближайшим показом,
+        а также (если with_reviews) подгружает отзывы с количеством лайков и отметкой
+        текущего пользователя, с reviews_limit - только столько новых отзывов каждого
+        спектакля в атрибут first_reviews.
+        Сериализаторы читают эти аннотации без дополнительных запросов на каждую строку.
+        """
+        now = timezone.now()
+        schedules = PerformanceSchedule.objects.filter(performance=OuterRef('pk'))
+        upcoming = schedules.filter(date_time__gt=now)
+        nearest = upcoming.order_by('date_time', 'id')
+
+        queryset = self.select_related('category').annotate(
+            upcoming_shows_count=Coalesce(
+                _performance_aggregate(upcoming, Count('id'), models.IntegerField()), 0
+            ),
+            avg_price=_performance_aggregate(
+                schedules, Avg('price'), models.DecimalField(max_digits=10, decimal_places=2)
+            ),
+            min_price=_performance_aggregate(
+                schedules, Min('price'), models.DecimalField(max_digits=10, decimal_places=2)
+            ),
+            nearest_show_id=Subquery(nearest.values('id')[:1]),
+            nearest_show_date_time=Subquery(nearest.values('date_time')[:1]),
+            nearest_show_price=Subquery(nearest.values('price')[:1]),
+            nearest_show_theater=Subquery(nearest.values('theater__name')[:1]),
+        )
+        if with_reviews:
+            reviews = Review.objects.with_user_state(user)
+            if reviews_limit:
+                # Первая страница отзывов в порядке ReviewPagination (sort=recent),
+                # срез подгружается только в отдельный атрибут
+                queryset = queryset.prefetch_related(Prefetch(
+                    'reviews', queryset=reviews.order_by('-created_at', '-id')[:reviews_limit], to_attr='first_reviews'
+                ))
+            else:
+                queryset = queryset.prefetch_related(Prefetch('reviews', queryset=reviews))
+        return queryset
+
+    def count_review(self, pk, rating, sign=1):
+        """
+        Учитывает (sign=1) или убирает (sign=-1) отзыв с оценкой rating (или без нее)
+        в счетчиках спектакля pk. Два UPDATE по первичному ключу, без пересчета отзывов.
+        """
+        rated = rating is not None
+        performances = self.filter(pk=pk)
+        performances.update(
+            review_count=F('review_count') + sign,
+            rating_sum=F('rating_sum') + sign * (rating or 0),
+            rating_count=F('rating_count') + sign * rated
+        )
+        if rated:
+            performances.update(average_rating=_average_rating())
+
+    def rebuild_review_stats(self):
+        """
+        Пересчитывает счетчики отзывов и оценок спектаклей по таблице отзывов
+        """
+        reviews = Review.objects.filter(performance=OuterRef('pk'))
+        rated = reviews.filter(rating__isnull=False)
+        updated = self.update(
+            review_count=Coalesce(_performance_aggregate(reviews, Count('id'), models.IntegerField()), 0),
+            rating_sum=Coalesce(_performance_aggregate(rated, Sum('rating'), models.IntegerField()), 0),
+            rating_count=Coalesce(_performance_aggregate(rated, Count('id'), models.IntegerField()), 0)
+        )
+        self.update(average_rating=_average_rating())
+        return updated
+
+    def search(self, query):
+        """
+        Полнотекстовый поиск по названию и описанию с сортировкой по релевантности
+        (аннотация search_rank), см. search.py
+        """
+        from .search import full_text_search
+        return full_text_search(self, query)
+
+
 # Спектакль (без театра и зала)
 class Performance(models.Model):
     name = models.CharField(max_length=255, verbose_name='Имя')
@@ -33,11 +144,27 @@ class Performance(models.Model):
         verbose_name='Категория спектакля'
     )
     related_link = models.URLField(max_length=200, blank=True, null=True, verbose_name='Ссылка на дополнительную информацию')
+    # Заполняется только на PostgreSQL (GIN-индекс), на SQLite используется таблица FTS5
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='Поисковый вектор')
+    # Счетчики отзывов и оценок, меняются вместе с отзывами (см. signals.py)
+    review_count = models.IntegerField(default=0, editable=False, verbose_name='Количество отзывов')
+    rating_sum = models.IntegerField(default=0, editable=False, verbose_name='Сумма оценок')
+    rating_count = models.IntegerField(default=0, editable=False, verbose_name='Количество оценок')
+    average_rating = models.FloatField(default=0, editable=False, verbose_name='Средняя оценка')
+
+    objects = PerformanceQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Спектакль'
         verbose_name_plural = "Спектакли"
+        indexes = [
+            # Индексы под keyset-пагинацию списков спектаклей
+            models.Index(fields=['-created_at', 'id'], name='performance_created_id_idx'),
+            models.Index(fields=['name', 'id'], name='performance_name_id_idx'),
+            models.Index(fields=['-average_rating', 'id'], name='performance_rating_id_idx'),
+            models.Index(fields=['-review_count', 'id'], name='performance_reviews_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -45,6 +172,136 @@ class Performance(models.Model):
     def get_absolute_url(self):
         return reverse('performance_detail', args=[self.id])
 
+    @property
+    def rating(self):
+        """
+        Средняя оценка или None, если оценок нет
+        """
+        return round(self.average_rating, 2) if self.rating_count else None
+
+
+def _seat_deltas(quantities):
+    """
+    CASE id WHEN ... THEN количество END для пакетного изменения мест
+    """
+    return Case(
+        *(When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()),
+        output_field=models.IntegerField()
+    )
+
+
+class PerformanceScheduleQuerySet(models.QuerySet):
+    def _update_seats(self, quantities, available, held, checked):
+        """
+        Меняет места в базе одним UPDATE. available и held - знак изменения
+        свободных и удержанных мест (-1, 0 или 1). Если checked, уменьшаемые поля
+        проверяются на нехватку и UPDATE выполняется целиком или никак.
+        """
+        if not quantities:
+            return True
+        deltas = _seat_deltas(quantities)
+        changes, conditions = {}, {}
+        for field, sign in (('available_seats', available), ('held_seats', held)):
+            if sign > 0:
+                changes[field] = F(field) + deltas
+            elif sign < 0:
+                changes[field] = F(field) - deltas
+                if checked:
+                    conditions[f'{field}__gte'] = deltas
+        if not conditions:
+            self.filter(pk__in=quantities).update(**changes)
+            return True
+        with transaction.atomic():
+            updated = self.filter(pk__in=quantities, **conditions).update(**changes)
+            if updated != len(quantities):
+                # Хотя бы в одном расписании мест не хватило - откатываем остальные
+                transaction.set_rollback(True)
+                return False
+        return True
+
+    def _change_seats(self, quantities, available=0, held=0, checked=True):
+        """
+        Меняет места сразу в нескольких расписаниях, целиком или никак.
+        Остатки "горячих" расписаний меняются в Redis (см. inventory.py),
+        остальных - условным UPDATE в базе.
+        """
+        quantities = {pk: quantity for pk, quantity in quantities.items() if quantity}
+        if not quantities:
+            return True
+        changes = {}
+        if inventory.enabled():
+            changes = {pk: (available * quantity, held * quantity) for pk, quantity in quantities.items()}
+            applied, cold = inventory.apply(changes, checked)
+            if not applied:
+                return False
+            changes = {pk: change for pk, change in changes.items() if pk not in cold}
+            quantities = {pk: quantity for pk, quantity in quantities.items() if pk in cold}
+        try:
+            updated = self._update_seats(quantities, available, held, checked)
+        except Exception:
+            inventory.revert(changes)
+            raise
+        if not updated:
+            inventory.revert(changes)
+            return False
+        inventory.record(changes)
+        return True
+
+    def reserve_many(self, quantities):
+        """
+        Бронирует места сразу в нескольких расписаниях одним UPDATE.
+        quantities - словарь {id расписания: количество мест}.
+        Бронирование выполняется целиком или не выполняется вовсе:
+        возвращает True, если мест хватило во всех расписаниях, иначе False.
+        """
+        return self._change_seats(quantities, available=-1)
+
+    def release_many(self, quantities):
+        """
+        Возвращает места сразу в несколько расписаний одним UPDATE
+        """
+        self._change_seats(quantities, available=1, checked=False)
+
+    def hold_many(self, quantities):
+        """
+        Удерживает места под корзины: переносит их из свободных в удержанные
+        (held_seats). Как и reserve_many, целиком или никак.
+        """
+        return self._change_seats(quantities, available=-1, held=1)
+
+    def release_holds(self, quantities):
+        """
+        Возвращает удержанные места в свободные
+        """
+        self._change_seats(quantities, available=1, held=-1, checked=False)
+
+    def sell_holds(self, quantities):
+        """
+        Продает удержанные места при оформлении заказа: свободные места
+        уже списаны при удержании, уменьшается только held_seats
+        """
+        return self._change_seats(quantities, held=-1)
+
+    def apply_inventory(self, batch):
+        """
+        Переносит в базу изменения остатков, накопленные в Redis (см. inventory.py).
+        batch - {id расписания: (номер переноса, изменение свободных, изменение удержанных)}.
+        Строка меняется, только если ее inventory_seq равен номеру переноса,
+        поэтому повторный перенос той же пачки ничего не меняет.
+        Возвращает {id расписания: inventory_seq после переноса}.
+        """
+        if not batch:
+            return {}
+        with transaction.atomic():
+            self.filter(
+                pk__in=batch, inventory_seq=_seat_deltas({pk: seq for pk, (seq, _, _) in batch.items()})
+            ).update(
+                available_seats=F('available_seats') + _seat_deltas({pk: change[1] for pk, change in batch.items()}),
+                held_seats=F('held_seats') + _seat_deltas({pk: change[2] for pk, change in batch.items()}),
+                inventory_seq=F('inventory_seq') + 1
+            )
+        return dict(self.filter(pk__in=batch).values_list('pk', 'inventory_seq'))
+
 
 # Расписание спектакля
 class PerformanceSchedule(models.Model):
@@ -53,11 +310,29 @@ class PerformanceSchedule(models.Model):
     hall = models.ForeignKey(Hall, on_delete=models.CASCADE, related_name='schedule', verbose_name='Зал', null=True)
     date_time = models.DateTimeField(verbose_name='Дата и время')
     available_seats = models.IntegerField(verbose_name='Количество мест')
+    # Места, удержанные в корзинах: уже вычтены из available_seats, но еще не проданы
+    held_seats = models.PositiveIntegerField(default=0, verbose_name='Удержано мест')
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Цена билета')
+    # Остатки мест ведутся в Redis и переносятся в базу пачками (см. inventory.py)
+    hot_inventory = models.BooleanField(default=False, verbose_name='Остатки в Redis')
+    # Номер последнего перенесенного из Redis изменения остатков
+    inventory_seq = models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Номер переноса остатков')
+    # Карта занятости мест зала: бит на место, 1 - место удержано или продано (см. seatmap.py)
+    seat_map = models.BinaryField(null=True, editable=False, verbose_name='Карта занятости мест')
+    seat_map_version = models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия карты мест')
+    # Сколько покупателей одновременно проходят к корзине, остальные ждут в очереди (см. waiting_room.py)
+    admission_limit = models.PositiveIntegerField(null=True, blank=True, verbose_name='Лимит покупателей без очереди')
+
+    objects = PerformanceScheduleQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Расписание спектаклей'
         verbose_name_plural = "Расписание спектаклей"
+        indexes = [
+            models.Index(fields=['date_time', 'id'], name='schedule_date_time_id_idx'),
+            models.Index(fields=['performance', 'date_time'], name='schedule_perf_date_time_idx'),
+            models.Index(fields=['performance', 'price'], name='schedule_perf_price_idx'),
+        ]
 
     def __str__(self):
         return f"{self.performance.name} - {self.date_time}"
@@ -66,19 +341,29 @@ class PerformanceSchedule(models.Model):
         """
         Бронирует указанное количество мест для данного расписания.
         Возвращает True, если бронирование успешно, False если недостаточно мест.
+
+        Проверка и списание выполняются одним условным UPDATE в базе
+        (или скриптом в Redis для "горячих" расписаний), поэтому параллельные
+        покупатели не могут продать одно место дважды.
         """
-        if self.available_seats >= quantity:
-            self.available_seats -= quantity
-            self.save()
-            return True
-        return False
+        with inventory.compensating(), transaction.atomic():
+            reserved = PerformanceSchedule.objects.reserve_many({self.pk: quantity})
+            self._refresh_available_seats()
+        return reserved
 
     def release_seats(self, quantity):
         """
         Освобождает указанное количество мест для данного расписания.
         """
-        self.available_seats += quantity
-        self.save()
+        with inventory.compensating(), transaction.atomic():
+            PerformanceSchedule.objects.release_many({self.pk: quantity})
+            self._refresh_available_seats()
+
+    def _refresh_available_seats(self):
+        self.refresh_from_db(fields=['available_seats'])
+        seats = inventory.seats(self.pk)
+        if seats is not None:
+            self.available_seats = seats[0]
 
 
 # Акции
@@ -99,17 +384,49 @@ class Promotion(models.Model):
         return self.title
 
 
+class ReviewQuerySet(models.QuerySet):
+    def with_user_state(self, user=None):
+        """
+        Аннотирует отзывы количеством лайков и отметкой, поставил ли лайк
+        указанный пользователь, и подгружает автора отзыва одним запросом
+        """
+        queryset = self.select_related('user')
+        if user is not None and user.is_authenticated:
+            liked = Like.objects.filter(review=OuterRef('pk'), user=user)
+            return queryset.annotate(is_liked=Exists(liked))
+        return queryset.annotate(is_liked=Value(False, output_field=models.BooleanField()))
+
+    def recount_likes(self):
+        """
+        Пересчитывает счетчик likes_count по таблице лайков
+        """
+        likes = Like.objects.filter(review=OuterRef('pk')).order_by().values('review').annotate(value=Count('id'))
+        return self.update(likes_count=Coalesce(Subquery(likes.values('value')[:1]), 0))
+
+
 # Отзыв
 class Review(models.Model):
     user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='reviews', verbose_name='Пользователь', null=True, blank=True)
     performance = models.ForeignKey(Performance, on_delete=models.CASCADE, related_name='reviews', verbose_name='Спектакль')
     text = models.TextField(verbose_name='Текст')
+    rating = models.PositiveSmallIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1), MaxValueValidator(5)], verbose_name='Оценка'
+    )
     created_at = models.DateTimeField(default=timezone.now, verbose_name='Дата создания')
+    # Счетчик лайков, меняется вместе с лайками (см. signals.py)
+    likes_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество лайков')
+
+    objects = ReviewQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Отзыв'
         verbose_name_plural = "Отзывы"
+        indexes = [
+            # Индексы под keyset-пагинацию отзывов спектакля (см. ReviewPagination)
+            models.Index(fields=['performance', '-created_at', '-id'], name='review_perf_created_idx'),
+            models.Index(fields=['performance', '-likes_count', '-id'], name='review_perf_likes_idx'),
+        ]
 
     def __str__(self):
         return f"Отзыв от {self.user.username} на {self.performance.name}"
@@ -124,6 +441,39 @@ class Like(models.Model):
     class Meta:
         verbose_name = 'Лайк'
         verbose_name_plural = "Лайки"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'review'], name='like_user_review_uniq'),
+        ]
+
+
+class CounterQuerySet(models.QuerySet):
+    def add(self, name, delta):
+        """
+        Атомарно прибавляет delta к счетчику name, создавая его при первом изменении
+        """
+        if not self.filter(name=name).update(value=F('value') + delta):
+            self.get_or_create(name=name)
+            self.filter(name=name).update(value=F('value') + delta)
+
+    def value(self, name):
+        return self.filter(name=name).values_list('value', flat=True).first() or 0
+
+
+# Глобальный счетчик (общее количество лайков и т.п.), читается одной строкой
+class Counter(models.Model):
+    LIKES = 'likes'
+
+    name = models.CharField(max_length=50, primary_key=True, verbose_name='Название')
+    value = models.BigIntegerField(default=0, verbose_name='Значение')
+
+    objects = CounterQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Счетчик'
+        verbose_name_plural = 'Счетчики'
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
 
 
 # Заглушка
@@ -155,12 +505,47 @@ class PlaceholderThrough(models.Model):
         verbose_name_plural = 'Связи заглушек'
 
 
+class CartItemQuerySet(models.QuerySet):
+    def with_summary(self):
+        """
+        Подгружает показ, спектакль, театр и зал одним запросом и добавляет
+        в каждую строку стоимость элемента (line_total), нехватку мест
+        (missing_seats) и итоги корзины пользователя оконными агрегатами
+        (cart_items, cart_seats, cart_total)
+        """
+        line_total = ExpressionWrapper(
+            F('quantity') * F('performance_schedule__price'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        )
+        cart = {'partition_by': [F('user_id')]}
+        return self.select_related(
+            'performance_schedule__performance', 'performance_schedule__theater', 'performance_schedule__hall'
+        ).annotate(
+            line_total=line_total,
+            # Удержанные места уже вычтены из свободных
+            missing_seats=ExpressionWrapper(
+                F('quantity') - F('held_quantity') - F('performance_schedule__available_seats'),
+                output_field=models.IntegerField()
+            ),
+            cart_items=Window(Count('id'), **cart),
+            cart_seats=Window(Sum('quantity'), **cart),
+            cart_total=Window(Sum(line_total), **cart),
+        ).order_by('added_at', 'id')
+
+
 # Корзина для спектаклей
 class CartItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items', verbose_name='Пользователь')
     performance_schedule = models.ForeignKey(PerformanceSchedule, on_delete=models.CASCADE, related_name='cart_items', verbose_name='Расписание спектакля')
     quantity = models.PositiveIntegerField(default=1, verbose_name='Количество билетов')
     added_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
+    # Сколько мест удержано под элемент и до какого времени (см. holds.py)
+    held_quantity = models.PositiveIntegerField(default=0, verbose_name='Удержано мест')
+    hold_expires_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name='Удержание до')
+    # Выбранные на карте зала места: [{"row": ряд, "seat": место}, ...]
+    seats = models.JSONField(default=list, blank=True, verbose_name='Места')
+
+    objects = CartItemQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Элемент корзины'
@@ -186,6 +571,26 @@ class OrderStatus(models.TextChoices):
     COMPLETED = 'completed', 'Выполнен'
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        """
+        Подгружает элементы заказов вместе с показом, спектаклем и театром
+        одним дополнительным запросом на всю выборку
+        """
+        return self.prefetch_related(Prefetch(
+            'items',
+            queryset=OrderItem.objects.select_related(
+                'performance_schedule__performance', 'performance_schedule__theater'
+            ).order_by('id')
+        ))
+
+    def with_items_count(self):
+        """
+        Аннотирует заказы количеством элементов (items_count) без загрузки элементов
+        """
+        return self.annotate(items_count=Count('items'))
+
+
 # Заказ
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders', verbose_name='Пользователь')
@@ -204,11 +609,16 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=50, default='Онлайн', verbose_name='Метод оплаты')
     payment_id = models.CharField(max_length=255, blank=True, null=True, verbose_name='Идентификатор платежа')
     delivery_address = models.TextField(blank=True, null=True, verbose_name='Адрес доставки')
+
+    objects = OrderQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            models.Index(fields=['user', '-created_at', 'id'], name='order_user_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"Заказ #{self.id} ({self.user.username})"
@@ -223,13 +633,10 @@ class Order(models.Model):
         """
         Отменяет заказ и возвращает количество мест в расписание
         """
-        if self.status != OrderStatus.CANCELLED:
-            # Возвращаем места в расписание
-            for item in self.items.all():
-                item.performance_schedule.release_seats(item.quantity)
-            
-            self.status = OrderStatus.CANCELLED
-            self.save()
+        from .orders import cancel_orders
+
+        if self.status != OrderStatus.CANCELLED and cancel_orders(Order.objects.filter(pk=self.pk)):
+            self.refresh_from_db(fields=['status', 'updated_at'])
             return True
         return False
 
@@ -240,6 +647,7 @@ class OrderItem(models.Model):
     performance_schedule = models.ForeignKey(PerformanceSchedule, on_delete=models.PROTECT, verbose_name='Расписание спектакля')
     quantity = models.PositiveIntegerField(verbose_name='Количество билетов')
     price_per_unit = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Цена за билет')
+    seats = models.JSONField(default=list, blank=True, verbose_name='Места')
     
     class Meta:
         verbose_name = 'Элемент заказа'
@@ -253,4 +661,26 @@ class OrderItem(models.Model):
         """
         Возвращает общую стоимость элемента заказа
         """
-        return self.price_per_unit * self.quantity
\ No newline at end of file
+        return self.price_per_unit * self.quantity
+
+# Ключ идемпотентности: сохраненный ответ на запрос с заголовком Idempotency-Key
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys', verbose_name='Пользователь')
+    key = models.CharField(max_length=255, verbose_name='Ключ')
+    endpoint = models.CharField(max_length=100, verbose_name='Операция')
+    request_hash = models.CharField(max_length=64, verbose_name='Хеш запроса')
+    # Пустой код ответа - запрос еще выполняется
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='Код ответа')
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, verbose_name='Тело ответа')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='Действует до')
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key} ({self.endpoint})"
@@ -0,0 +1,132 @@
+"""
+Переходы статусов заказов.
+
+Разрешенные переходы и их влияние на места описаны в TRANSITIONS: отмена
+возвращает места в расписания, восстановление отмененного заказа снова
+их бронирует. Переход применяется сразу к пачке заказов фиксированным
+числом запросов независимо от количества заказов и элементов в них:
+места суммируются по расписаниям в SQL и меняются одним UPDATE
+(см. PerformanceScheduleQuerySet), статусы меняются одним UPDATE, а места
+на карте зала - одним изменением карты на показ. Все выполняется
+в одной транзакции.
+
+После коммита на всю пачку отправляется один сигнал order_status_changed
+(уведомления покупателей, статистика).
+"""
+from django.db import transaction
+from django.db.models import Sum
+from django.dispatch import Signal
+from django.utils import timezone
+
+from . import inventory, seatmap
+from .models import Order, OrderItem, OrderStatus, PerformanceSchedule
+
+# Из какого статуса в какие можно перевести заказ. Выполненный заказ не меняется.
+TRANSITIONS = {
+    OrderStatus.PENDING: {OrderStatus.CONFIRMED, OrderStatus.COMPLETED, OrderStatus.CANCELLED},
+    OrderStatus.CONFIRMED: {OrderStatus.COMPLETED, OrderStatus.CANCELLED},
+    OrderStatus.CANCELLED: {OrderStatus.PENDING, OrderStatus.CONFIRMED},
+    OrderStatus.COMPLETED: set(),
+}
+
+# Заказы перешли в статус status. Аргументы: status, order_ids и previous -
+# {прежний статус: id заказов}. Отправляется один раз на пачку после коммита.
+order_status_changed = Signal()
+
+
+class TransitionError(Exception):
+    """
+    Переход запрещен или для восстановления заказов не хватает мест
+    """
+
+
+def check_transition(current, status):
+    """
+    Бросает TransitionError, если заказ в статусе current нельзя перевести в status
+    """
+    if current != status and status not in TRANSITIONS[current]:
+        raise TransitionError(
+            f"Нельзя перевести заказ из статуса '{OrderStatus(current).label}' в '{OrderStatus(status).label}'"
+        )
+
+
+def _quantities(order_ids):
+    return dict(
+        OrderItem.objects.filter(order_id__in=order_ids).order_by()
+        .values('performance_schedule_id').annotate(total=Sum('quantity'))
+        .values_list('performance_schedule_id', 'total')
+    )
+
+
+def _seat_rows(order_ids):
+    return OrderItem.objects.filter(order_id__in=order_ids).exclude(seats=[]).values_list('performance_schedule_id', 'seats')
+
+
+def _shortage(quantities):
+    """
+    Сообщение о расписании, в котором не хватило мест
+    """
+    schedules = PerformanceSchedule.objects.select_related('performance').in_bulk(quantities)
+    for pk, needed in quantities.items():
+        seats = inventory.seats(pk)
+        available = seats[0] if seats else schedules[pk].available_seats
+        if available < needed:
+            return (f"Недостаточно мест для '{schedules[pk].performance.name}'. "
+                    f"Доступно: {available}, требуется: {needed}")
+    return "Недостаточно мест"
+
+
+def _release(order_ids):
+    PerformanceSchedule.objects.release_many(_quantities(order_ids))
+    seatmap.free_item_seats(_seat_rows(order_ids))
+
+
+def _reserve(order_ids):
+    # Выбранные места заказов могли уже продать другим покупателям
+    try:
+        seatmap.take_item_seats(_seat_rows(order_ids))
+    except seatmap.SeatsUnavailable:
+        raise TransitionError("Места заказа уже заняты")
+    quantities = _quantities(order_ids)
+    if not PerformanceSchedule.objects.reserve_many(quantities):
+        raise TransitionError(_shortage(quantities))
+
+
+def transition(orders, status):
+    """
+    Переводит заказы из queryset orders в статус status. Заказы, которые
+    нельзя перевести (в том числе уже находящиеся в этом статусе), пропускаются.
+    Возвращает id переведенных заказов. Если для восстановления отмененных
+    заказов не хватает мест, бросает TransitionError и ничего не меняет.
+    """
+    status = OrderStatus(status)
+    sources = [current for current, targets in TRANSITIONS.items() if status in targets]
+    with inventory.compensating(), transaction.atomic():
+        # Блокируем заказы, чтобы параллельный переход не изменил места дважды
+        rows = list(orders.filter(status__in=sources).select_for_update().order_by('pk').values_list('pk', 'status'))
+        if not rows:
+            return []
+        order_ids = [pk for pk, _ in rows]
+        previous = {}
+        for pk, current in rows:
+            previous.setdefault(current, []).append(pk)
+
+        if status == OrderStatus.CANCELLED:
+            _release(order_ids)
+        elif OrderStatus.CANCELLED in previous:
+            _reserve(previous[OrderStatus.CANCELLED])
+        Order.objects.filter(pk__in=order_ids).update(status=status, updated_at=timezone.now())
+        # send_robust: ошибка получателя (уведомления, статистика) пишется в лог
+        # и не превращает уже сохраненный переход в ответ 500
+        transaction.on_commit(lambda: order_status_changed.send_robust(
+            sender=Order, status=status, order_ids=order_ids, previous=previous
+        ))
+    return order_ids
+
+
+def cancel_orders(orders):
+    """
+    Отменяет заказы из queryset orders и возвращает их места в расписания.
+    Возвращает id отмененных заказов.
+    """
+    return transition(orders, OrderStatus.CANCELLED)
@@ -0,0 +1,240 @@
+import base64
+import binascii
+import datetime
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) пагинация.
+
+    Курсор - непрозрачная base64-строка со значениями полей сортировки
+    последнего (или первого, при движении назад) элемента страницы.
+    Следующая страница выбирается условием WHERE по этим значениям,
+    а не OFFSET, поэтому страница N стоит столько же, сколько первая,
+    если сортировка покрыта составным индексом.
+
+    Сортировка берется из queryset (например, после OrderingFilter),
+    иначе из атрибута ordering, иначе из Meta.ordering модели.
+    Первичный ключ всегда добавляется последним полем для однозначности.
+    Поля сортировки не должны содержать NULL.
+
+    Пока фронтенд не перешел на новый формат, при PAGINATION_COMPAT_MODE = True
+    запросы без параметров cursor и page_size получают прежний список без пагинации.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering = None
+    # False - всегда отдавать страницы, даже при PAGINATION_COMPAT_MODE (для новых endpoint)
+    legacy_compatible = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if queryset.query.is_sliced or self.is_legacy_request(request):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.keyset_ordering = self.get_ordering(queryset)
+        self.fields = [self._get_field(queryset, name.lstrip('-')) for name in self.keyset_ordering]
+
+        values, reverse = self.decode_cursor(request)
+        ordering = self._invert(self.keyset_ordering) if reverse else self.keyset_ordering
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(ordering, values))
+
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = values is not None
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = values is not None
+
+        self.page = results
+        return results
+
+    def is_legacy_request(self, request):
+        """
+        Проверяет, нужно ли отдать ответ в старом формате (без пагинации)
+        """
+        if not self.legacy_compatible or not getattr(settings, 'PAGINATION_COMPAT_MODE', False):
+            return False
+        params = request.query_params
+        return self.cursor_query_param not in params and self.page_size_query_param not in params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """
+        Возвращает кортеж полей сортировки с первичным ключом в конце
+        """
+        ordering = list(queryset.query.order_by)
+        if not ordering or not all(isinstance(field, str) for field in ordering):
+            ordering = list(self.ordering or queryset.model._meta.ordering or [])
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            ordering.append('id')
+        return tuple(ordering)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._build_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._build_link(self.page[0], reverse=True)
+
+    def encode_cursor(self, values, reverse):
+        values = [self._serialize_value(value) for value in values]
+        payload = json.dumps({'v': values, 'r': int(reverse)})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request):
+        """
+        Возвращает (значения полей сортировки, направление) из параметра cursor
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            raw_values = payload['v']
+            if len(raw_values) != len(self.fields):
+                raise ValueError
+            values = [field.to_python(value) for field, value in zip(self.fields, raw_values)]
+            return values, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound('Неверный курсор пагинации')
+
+    def _build_link(self, obj, reverse):
+        values = [self._get_value(obj, name.lstrip('-')) for name in self.keyset_ordering]
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values, reverse))
+
+    def _keyset_filter(self, ordering, values):
+        """
+        Строит условие "строго после курсора" для составной сортировки:
+        (a > x) OR (a = x AND b > y) ..., плюс a >= x для range scan по индексу
+        """
+        first = ordering[0]
+        bound = 'lte' if first.startswith('-') else 'gte'
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
+
+    @staticmethod
+    def _invert(ordering):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+    @staticmethod
+    def _get_field(queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model = queryset.model
+        parts = name.split(LOOKUP_SEP)
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).related_model
+        if parts[-1] == 'pk':
+            return model._meta.pk
+        return model._meta.get_field(parts[-1])
+
+    @staticmethod
+    def _serialize_value(value):
+        # Даты сохраняются с микросекундами, иначе курсор будет пропускать строки
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+    @staticmethod
+    def _get_value(obj, name):
+        for part in name.split(LOOKUP_SEP):
+            obj = getattr(obj, part)
+        return obj
+
+
+class ScheduleKeysetPagination(KeysetPagination):
+    """
+    Пагинация расписаний по дате показа
+    """
+    ordering = ('date_time', 'id')
+
+
+class ScheduleSearchPagination(ScheduleKeysetPagination):
+    """
+    Пагинация поиска показов, у которого нет клиентов старого формата
+    """
+    legacy_compatible = False
+
+
+class ReviewPagination(KeysetPagination):
+    """
+    Пагинация отзывов спектакля: sort=recent - сначала новые,
+    sort=likes - по счетчику лайков (оба порядка покрыты индексами Review)
+    """
+    page_size = 10
+    legacy_compatible = False
+    orderings = {
+        'recent': ('-created_at', '-id'),
+        'likes': ('-likes_count', '-id'),
+    }
+    ordering = orderings['recent']
+
+    def get_next_link_after(self, request, url, obj):
+        """
+        Ссылка на следующие после obj новые отзывы по адресу url
+        (продолжение первой страницы, встроенной в ответ со спектаклем)
+        """
+        values = [self._get_value(obj, name.lstrip('-')) for name in self.orderings['recent']]
+        return replace_query_param(
+            request.build_absolute_uri(url), self.cursor_query_param, self.encode_cursor(values, reverse=False)
+        )
@@ -0,0 +1,282 @@
+"""
+Полнотекстовый поиск по спектаклям.
+
+SQLite: виртуальная таблица FTS5 (perfomance_performance_fts) с уже
+стеммированными названием и описанием, ранжирование по bm25.
+PostgreSQL: колонка search_vector (tsvector, конфигурация 'russian') с GIN-индексом,
+ранжирование по ts_rank.
+
+Индекс синхронизируется сигналами post_save/post_delete модели Performance
+(см. signals.py); массовые изменения через update()/bulk_create() требуют
+команды rebuild_search_index.
+"""
+import re
+
+from django.db import connection
+from django.db.models import F, Func, IntegerField
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'perfomance_performance_fts'
+
+# Вес названия относительно описания при ранжировании
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Сколько лучших результатов упорядочиваются по релевантности,
+# остальные найденные спектакли идут после них по id
+RANKED_RESULTS = 500
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_CYRILLIC_RE = re.compile(r'[а-яё]')
+
+_VOWELS = 'аеиоуыэюя'
+_PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+_ADJECTIVE = ((), (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'
+))
+_PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+_REFLEXIVE = ((), ('ся', 'сь'))
+_VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым',
+     'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю')
+)
+_NOUN = ((), (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой',
+    'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь',
+    'ию', 'ью', 'ю', 'ия', 'ья', 'я'
+))
+_DERIVATIONAL = ('ость', 'ост')
+_SUPERLATIVE = ('ейше', 'ейш')
+
+
+def _strip_ending(word, groups):
+    """
+    Отрезает самое длинное окончание из групп Snowball.
+    Окончания первой группы допустимы только после 'а' или 'я'.
+    Возвращает None, если окончание не найдено.
+    """
+    conditional, plain = groups
+    best = None
+    for ending in conditional + plain:
+        if word.endswith(ending) and (best is None or len(ending) > len(best[0])):
+            best = (ending, ending in conditional)
+    if best is None:
+        return None
+    ending, needs_a_ya = best
+    stem = word[:-len(ending)]
+    if needs_a_ya and not stem.endswith(('а', 'я')):
+        return None
+    return stem
+
+
+def stem_russian(word):
+    """
+    Стеммер русского языка (алгоритм Snowball Russian)
+    """
+    word = word.replace('ё', 'е')
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+    r1 = next((i + 1 for i in range(1, len(word)) if word[i] not in _VOWELS and word[i - 1] in _VOWELS), len(word))
+    r2 = next((i + 1 for i in range(r1 + 1, len(word)) if word[i] not in _VOWELS and word[i - 1] in _VOWELS), len(word))
+    prefix, rest = word[:rv], word[rv:]
+
+    # Шаг 1: деепричастие, либо возвратность + прилагательное/глагол/существительное
+    stripped = _strip_ending(rest, _PERFECTIVE_GERUND)
+    if stripped is None:
+        reflexive = _strip_ending(rest, _REFLEXIVE)
+        if reflexive is not None:
+            rest = reflexive
+        adjective = _strip_ending(rest, _ADJECTIVE)
+        if adjective is not None:
+            participle = _strip_ending(adjective, _PARTICIPLE)
+            stripped = participle if participle is not None else adjective
+        else:
+            stripped = _strip_ending(rest, _VERB)
+            if stripped is None:
+                stripped = _strip_ending(rest, _NOUN)
+    if stripped is not None:
+        rest = stripped
+
+    # Шаг 2
+    if rest.endswith('и'):
+        rest = rest[:-1]
+
+    # Шаг 3: словообразовательные суффиксы в R2
+    for ending in _DERIVATIONAL:
+        if rest.endswith(ending) and rv + len(rest) - len(ending) >= r2:
+            rest = rest[:-len(ending)]
+            break
+
+    # Шаг 4: превосходная степень, двойное 'н', мягкий знак
+    if rest.endswith('нн'):
+        rest = rest[:-1]
+    else:
+        for ending in _SUPERLATIVE:
+            if rest.endswith(ending):
+                rest = rest[:-len(ending)]
+                if rest.endswith('нн'):
+                    rest = rest[:-1]
+                break
+        else:
+            if rest.endswith('ь'):
+                rest = rest[:-1]
+
+    return prefix + rest
+
+
+def tokenize(text):
+    """
+    Разбивает текст на слова в нижнем регистре и стеммирует русские слова
+    """
+    tokens = []
+    for word in _WORD_RE.findall((text or '').lower()):
+        tokens.append(stem_russian(word) if _CYRILLIC_RE.search(word) else word)
+    return tokens
+
+
+def normalize(text):
+    return ' '.join(tokenize(text))
+
+
+class RankPosition(Func):
+    """
+    Позиция id в строке ',id1,id2,...,' (0, если id в строке нет).
+    CASE с сотнями веток долго компилируется, а instr по длинной строке для каждой
+    найденной строки медленный, поэтому instr вызывается только для id из списка.
+    """
+    output_field = IntegerField()
+
+    def __init__(self, ids, expression='pk'):
+        super().__init__(F(expression))
+        self.ids = [int(pk) for pk in ids]
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        placeholders = ', '.join(['%s'] * len(self.ids))
+        sql = (
+            f"CASE WHEN {column} IN ({placeholders}) "
+            f"THEN instr(%s, ',' || {column} || ',') ELSE 0 END"
+        )
+        ranking = ',' + ','.join(str(pk) for pk in self.ids) + ','
+        return sql, (*params, *self.ids, ranking, *params)
+
+
+class SQLiteSearchBackend:
+    """
+    Поиск через виртуальную таблицу FTS5. В таблице хранится стеммированный текст,
+    поэтому запрос стеммируется тем же стеммером, а слова ищутся по префиксу.
+    """
+
+    @staticmethod
+    def build_match(query):
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    def filter(self, queryset, query):
+        """
+        Отбирает спектакли подзапросом к FTS5. Релевантность считается одним запросом
+        к индексу с сортировкой по bm25: коррелированный подзапрос с MATCH повторял бы
+        полнотекстовый поиск для каждой найденной строки.
+        search_rank - целое число, чем больше, тем релевантнее.
+        """
+        match = self.build_match(query)
+        if not match:
+            return queryset
+        bm25 = f'bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT})'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY {bm25} LIMIT %s',
+                [match, RANKED_RESULTS]
+            )
+            ranked = [row[0] for row in cursor.fetchall()]
+        if not ranked:
+            return queryset.none()
+        # Самый релевантный id ставится в конец строки, чтобы получить наибольшую позицию
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+        ).annotate(search_rank=RankPosition(reversed(ranked))).order_by('-search_rank', 'id')
+
+    def index(self, performance):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [performance.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+                [performance.pk, normalize(performance.name), normalize(performance.description)]
+            )
+
+    def remove(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+    def rebuild(self, rows):
+        """
+        Перестраивает индекс по итератору кортежей (id, name, description)
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            batch = []
+            for pk, name, description in rows:
+                batch.append((pk, normalize(name), normalize(description)))
+                if len(batch) >= 1000:
+                    cursor.executemany(
+                        f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', batch
+                    )
+                    batch = []
+            if batch:
+                cursor.executemany(
+                    f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', batch
+                )
+
+
+class PostgresSearchBackend:
+    """
+    Поиск через колонку search_vector с GIN-индексом и русской конфигурацией tsvector
+    """
+    config = 'russian'
+
+    def _vector(self):
+        from django.contrib.postgres.search import SearchVector
+        return (
+            SearchVector('name', weight='A', config=self.config)
+            + SearchVector('description', weight='B', config=self.config)
+        )
+
+    def filter(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        if not tokenize(query):
+            return queryset
+        search_query = SearchQuery(query, config=self.config, search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-search_rank', 'id')
+
+    def index(self, performance):
+        type(performance)._base_manager.filter(pk=performance.pk).update(search_vector=self._vector())
+
+    def remove(self, pk):
+        # Строка удаляется вместе с колонкой search_vector
+        pass
+
+    def rebuild(self, rows):
+        from .models import Performance
+        Performance._base_manager.update(search_vector=self._vector())
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SQLiteSearchBackend()
+
+
+def full_text_search(queryset, query):
+    """
+    Фильтрует спектакли по полнотекстовому запросу и сортирует по релевантности
+    (аннотация search_rank)
+    """
+    return get_search_backend().filter(queryset, query)
+
+
+def rebuild_index():
+    from .models import Performance
+    rows = Performance._base_manager.values_list('id', 'name', 'description').iterator()
+    get_search_backend().rebuild(rows)
@@ -0,0 +1,345 @@
+"""
+Карта мест зала и занятость мест показа.
+
+Схема зала - ряды (HallRow) с зонами (SeatZone). Занятость мест показа
+хранится в PerformanceSchedule.seat_map битовой картой: бит на место
+в порядке рядов, 1 - место удержано в корзине или продано. Проверка,
+занятие и поиск мест - операции над целым числом из этих байтов,
+поэтому и память, и время - O(мест / 8), без строки на каждое место.
+
+Карта меняется оптимистично: запись проходит, только если seat_map_version
+не изменилась с момента чтения, иначе изменение повторяется на свежей карте.
+
+Счетчики available_seats и held_seats остаются главным ограничением продаж
+и меняются как при добавлении в корзину (см. holds.py), а карта гарантирует,
+что одно место не удержано и не продано дважды. Показы с картой мест
+продаются только выбранными местами.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from main.models import HallRow
+
+from . import inventory
+
+# Сколько раз повторять изменение карты, если ее параллельно изменили
+SEAT_MAP_ATTEMPTS = 5
+
+
+class SeatsUnavailable(Exception):
+    """
+    Места заняты другими покупателями или не удержаны пользователем
+    """
+    def __init__(self, seats):
+        super().__init__(seats)
+        self.seats = seats
+
+
+class SeatMapConflict(Exception):
+    """
+    Карту мест слишком часто меняют параллельно
+    """
+
+
+def _seat(row, seat):
+    return {'row': row, 'seat': seat}
+
+
+class SeatLayout:
+    """
+    Схема зала: ряды по порядку номеров и смещение первого места ряда в битовой карте
+    """
+    def __init__(self, rows):
+        self.rows = []
+        self._rows = {}
+        offset = 0
+        for row in rows:
+            self.rows.append((row, offset))
+            self._rows[row.number] = (row, offset)
+            offset += row.seats
+        self.capacity = offset
+
+    @classmethod
+    def for_halls(cls, hall_ids):
+        """
+        {id зала: схема} для залов, у которых есть ряды
+        """
+        rows = {}
+        for row in HallRow.objects.filter(hall_id__in=hall_ids).select_related('zone').order_by('hall_id', 'number'):
+            rows.setdefault(row.hall_id, []).append(row)
+        return {hall_id: cls(hall_rows) for hall_id, hall_rows in rows.items()}
+
+    def index(self, row, seat):
+        if row not in self._rows or not 1 <= seat <= self._rows[row][0].seats:
+            raise ValueError(f"В зале нет места {seat} в ряду {row}")
+        return self._rows[row][1] + seat - 1
+
+    def parse(self, seats):
+        """
+        Проверяет список мест [{"row": ряд, "seat": место}] из запроса
+        и возвращает его без повторов
+        """
+        try:
+            pairs = [(int(seat['row']), int(seat['seat'])) for seat in seats]
+        except (TypeError, KeyError, ValueError):
+            raise ValueError('Места задаются списком {"row": ряд, "seat": место}')
+        for row, seat in pairs:
+            self.index(row, seat)
+        return [_seat(row, seat) for row, seat in dict.fromkeys(pairs)]
+
+    def mask(self, seats):
+        value = 0
+        for seat in seats:
+            value |= 1 << self.index(seat['row'], seat['seat'])
+        return value
+
+    def _row_seats(self, value, row, offset):
+        """
+        Номера мест ряда, биты которых установлены в value
+        """
+        bits = (value >> offset) & ((1 << row.seats) - 1)
+        numbers = []
+        while bits:
+            low = bits & -bits
+            numbers.append(low.bit_length())
+            bits ^= low
+        return numbers
+
+    def seats_in(self, value):
+        """
+        Места, биты которых установлены в value
+        """
+        return [
+            _seat(row.number, number)
+            for row, offset in self.rows
+            for number in self._row_seats(value, row, offset)
+        ]
+
+    def price(self, row, base_price):
+        zone = self._rows[row][0].zone
+        factor = zone.price_factor if zone else 1
+        return (base_price * factor).quantize(Decimal('0.01'))
+
+    def describe(self, occupied, base_price):
+        """
+        Ряды зала с зоной, ценой и занятыми местами
+        """
+        return [
+            {
+                'row': row.number,
+                'zone': row.zone.name if row.zone else None,
+                'price': self.price(row.number, base_price),
+                'seats': row.seats,
+                'occupied': self._row_seats(occupied, row, offset),
+            }
+            for row, offset in self.rows
+        ]
+
+    def best_adjacent(self, occupied, count):
+        """
+        Лучшие count свободных мест подряд в одном ряду: ближе к среднему ряду,
+        затем ближе к центру ряда. Возвращает список мест или пустой список.
+        """
+        middle = (len(self.rows) - 1) / 2
+        best, best_score = None, None
+        for distance, row, offset in sorted(
+            ((abs(position - middle), row, offset) for position, (row, offset) in enumerate(self.rows)),
+            key=lambda candidate: candidate[0]
+        ):
+            if best_score is not None and distance > best_score[0]:
+                break
+            if row.seats < count:
+                continue
+            free = ~(occupied >> offset) & ((1 << row.seats) - 1)
+            # Бит j остается, если свободны все места с j-го по (j + count - 1)-е
+            starts = free
+            for shift in range(1, count):
+                starts &= free >> shift
+            while starts:
+                low = starts & -starts
+                start = low.bit_length() - 1
+                score = (distance, abs(start + (count - 1) / 2 - (row.seats - 1) / 2))
+                if best_score is None or score < best_score:
+                    best, best_score = (row.number, start), score
+                starts ^= low
+        if best is None:
+            return []
+        row, start = best
+        return [_seat(row, start + 1 + number) for number in range(count)]
+
+
+def layouts(schedules):
+    """
+    {id показа: схема зала} для показов с картой мест
+    """
+    schedules = [schedule for schedule in schedules if schedule.seat_map is not None]
+    by_hall = SeatLayout.for_halls({schedule.hall_id for schedule in schedules}) if schedules else {}
+    return {schedule.pk: by_hall[schedule.hall_id] for schedule in schedules if schedule.hall_id in by_hall}
+
+
+def ensure_seat_map(schedule):
+    """
+    Схема зала показа или None, если у зала нет схемы мест.
+    Создает пустую карту занятости, если ее еще нет.
+    """
+    from .models import PerformanceSchedule
+
+    if schedule.hall_id is None:
+        return None
+    layout = SeatLayout.for_halls([schedule.hall_id]).get(schedule.hall_id)
+    if layout is None:
+        return None
+    if schedule.seat_map is None:
+        PerformanceSchedule.objects.filter(pk=schedule.pk, seat_map__isnull=True).update(
+            seat_map=bytes((layout.capacity + 7) // 8)
+        )
+        schedule.refresh_from_db(fields=['seat_map', 'seat_map_version'])
+    return layout
+
+
+def occupancy(schedule):
+    """
+    Занятость мест показа целым числом (бит на место)
+    """
+    return int.from_bytes(schedule.seat_map or b'', 'little')
+
+
+def _change(schedule_id, change):
+    """
+    Меняет карту занятости: change получает занятость целым числом и возвращает
+    новую. Возвращает новую версию карты.
+    """
+    from .models import PerformanceSchedule
+
+    for _ in range(SEAT_MAP_ATTEMPTS):
+        bitmap, version = PerformanceSchedule.objects.values_list('seat_map', 'seat_map_version').get(pk=schedule_id)
+        occupied = change(int.from_bytes(bitmap, 'little'))
+        updated = PerformanceSchedule.objects.filter(pk=schedule_id, seat_map_version=version).update(
+            seat_map=occupied.to_bytes(len(bitmap), 'little'),
+            seat_map_version=F('seat_map_version') + 1
+        )
+        if updated:
+            return version + 1
+    raise SeatMapConflict
+
+
+def take_seats(schedule_id, layout, seats):
+    """
+    Отмечает места занятыми, все или ни одного.
+    Если часть мест занята, бросает SeatsUnavailable с этими местами.
+    """
+    mask = layout.mask(seats)
+
+    def take(occupied):
+        if occupied & mask:
+            raise SeatsUnavailable(layout.seats_in(occupied & mask))
+        return occupied | mask
+
+    return _change(schedule_id, take) if mask else None
+
+
+def free_seats(schedule_id, layout, seats):
+    mask = layout.mask(seats)
+    return _change(schedule_id, lambda occupied: occupied & ~mask) if mask else None
+
+
+def _by_schedule(rows):
+    seats = {}
+    for schedule_id, item_seats in rows:
+        if item_seats:
+            seats.setdefault(schedule_id, []).extend(item_seats)
+    return seats
+
+
+def _schedule_layouts(schedule_ids):
+    from .models import PerformanceSchedule
+
+    return layouts(
+        PerformanceSchedule.objects.filter(pk__in=schedule_ids, seat_map__isnull=False).only('id', 'hall_id', 'seat_map')
+    )
+
+
+def free_item_seats(rows):
+    """
+    Освобождает места элементов корзины или заказа: rows - пары (id показа, места)
+    """
+    seats = _by_schedule(rows)
+    if not seats:
+        return
+    schedule_layouts = _schedule_layouts(seats)
+    for schedule_id, schedule_seats in seats.items():
+        if schedule_id in schedule_layouts:
+            free_seats(schedule_id, schedule_layouts[schedule_id], schedule_seats)
+
+
+def take_item_seats(rows):
+    """
+    Снова занимает места элементов заказов: rows - пары (id показа, места).
+    Места, занятые другими покупателями или повторяющиеся в rows, - SeatsUnavailable.
+    Вызывается в транзакции: при ошибке уже занятые места откатываются вместе с ней.
+    """
+    seats = _by_schedule(rows)
+    if not seats:
+        return
+    schedule_layouts = _schedule_layouts(seats)
+    for schedule_id, schedule_seats in seats.items():
+        pairs = [(seat['row'], seat['seat']) for seat in schedule_seats]
+        if len(set(pairs)) != len(pairs):
+            raise SeatsUnavailable([_seat(*pair) for pair in pairs if pairs.count(pair) > 1])
+        if schedule_id in schedule_layouts:
+            take_seats(schedule_id, schedule_layouts[schedule_id], schedule_seats)
+
+
+def _locked_cart_item(user, schedule):
+    from .models import CartItem
+
+    cart_item = CartItem.objects.select_for_update().filter(user=user, performance_schedule=schedule).first()
+    return cart_item or CartItem(user=user, performance_schedule=schedule)
+
+
+def hold_seats(user, schedule, layout, seats):
+    """
+    Удерживает выбранные места показа за корзиной пользователя (все или ни одного)
+    и продлевает удержание уже выбранных. Возвращает элемент корзины или None,
+    если у показа не хватает свободных мест; занятые места - SeatsUnavailable.
+    """
+    from .holds import hold_for_cart_item
+
+    with inventory.compensating(), transaction.atomic():
+        cart_item = _locked_cart_item(user, schedule)
+        # После истечения удержания места уже возвращены в продажу
+        current = cart_item.seats if cart_item.held_quantity else []
+        new = [seat for seat in seats if seat not in current]
+        take_seats(schedule.pk, layout, new)
+        cart_item.seats = current + new
+        if not hold_for_cart_item(cart_item, len(cart_item.seats)):
+            transaction.set_rollback(True)
+            return None
+    return cart_item
+
+
+def release_held_seats(user, schedule, layout, seats):
+    """
+    Освобождает удержанные пользователем места показа. Возвращает элемент
+    корзины или None, если мест в нем не осталось и он удален.
+    Места, которые пользователь не удерживает, - SeatsUnavailable.
+    """
+    from .holds import delete_cart_items, hold_for_cart_item
+    from .models import CartItem
+
+    with inventory.compensating(), transaction.atomic():
+        cart_item = _locked_cart_item(user, schedule)
+        current = cart_item.seats if cart_item.held_quantity else []
+        foreign = [seat for seat in seats if seat not in current]
+        if foreign:
+            raise SeatsUnavailable(foreign)
+        remaining = [seat for seat in current if seat not in seats]
+        if not remaining:
+            delete_cart_items(CartItem.objects.filter(pk=cart_item.pk))
+            return None
+        free_seats(schedule.pk, layout, seats)
+        cart_item.seats = remaining
+        hold_for_cart_item(cart_item, len(remaining))
+    return cart_item
@@ -1,30 +1,30 @@
+from django.db import transaction
+from django.urls import reverse
 from rest_framework import serializers
 from .models import Performance, Review, PerformanceCategory, CartItem, PerformanceSchedule, Order, OrderItem
+from . import inventory, seatmap
+from .pagination import ReviewPagination
 
 class ReviewSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(default=None)
     is_liked_by_current_user = serializers.SerializerMethodField()
-    likes_count = serializers.SerializerMethodField()
+    likes_count = serializers.IntegerField(read_only=True)
     can_edit = serializers.SerializerMethodField()
     formatted_date = serializers.SerializerMethodField()
     
     class Meta:
         model = Review
-        fields = ['id', 'user', 'text', 'created_at', 'formatted_date', 
+        fields = ['id', 'user', 'text', 'rating', 'created_at', 'formatted_date', 
                  'likes_count', 'is_liked_by_current_user', 'can_edit']
         extra_kwargs = {'user': {'required': False, 'allow_null': True}}
     
-    def get_likes_count(self, obj):
-        """
-        Возвращает количество лайков отзыва
-        """
-        return obj.likes.count()
-    
     def get_is_liked_by_current_user(self, obj):
         """
         Проверяет, поставил ли текущий пользователь лайк этому отзыву
         Использует контекст для получения текущего пользователя
         """
+        if hasattr(obj, 'is_liked'):
+            return obj.is_liked
         request = self.context.get('request')
         if request and hasattr(request, 'user') and request.user.is_authenticated:
             return obj.likes.filter(user=request.user).exists()
@@ -60,12 +60,14 @@ class PerformanceSerializer(serializers.ModelSerializer):
         model = Performance
         fields = ['id', 'name', 'description', 'image', 'category', 'duration_time', 
                  'duration_formatted', 'reviews', 'upcoming_shows_count', 
-                 'average_price', 'is_popular', 'nearest_show']
+                 'average_price', 'is_popular', 'nearest_show', 'rating', 'rating_count']
     
     def get_upcoming_shows_count(self, obj):
         """
         Возвращает количество предстоящих показов спектакля
         """
+        if hasattr(obj, 'upcoming_shows_count'):
+            return obj.upcoming_shows_count
         from django.utils import timezone
         return obj.schedule.filter(date_time__gt=timezone.now()).count()
     
@@ -73,9 +75,12 @@ class PerformanceSerializer(serializers.ModelSerializer):
         """
         Возвращает среднюю цену билета на спектакль
         """
-        from django.db.models import Avg
-        result = obj.schedule.aggregate(avg_price=Avg('price'))
-        avg_price = result['avg_price']
+        if hasattr(obj, 'avg_price'):
+            avg_price = obj.avg_price
+        else:
+            from django.db.models import Avg
+            result = obj.schedule.aggregate(avg_price=Avg('price'))
+            avg_price = result['avg_price']
         if avg_price:
             return f"{float(avg_price):.2f} ₽"
         return "Цена не указана"
@@ -85,12 +90,10 @@ class PerformanceSerializer(serializers.ModelSerializer):
         Определяет, является ли спектакль популярным
         """
         # Спектакль считается популярным, если на него есть более 3 отзывов
-        # или более 5 предстоящих показов
-        reviews_count = obj.reviews.count()
-        from django.utils import timezone
-        upcoming_shows = obj.schedule.filter(date_time__gt=timezone.now()).count()
+        # или более 5 предстоящих показов (отзывы - из счетчика спектакля)
+        upcoming_shows = self.get_upcoming_shows_count(obj)
         
-        is_popular = reviews_count > 3 or upcoming_shows > 5
+        is_popular = obj.review_count > 3 or upcoming_shows > 5
         return is_popular
     
     def get_duration_formatted(self, obj):
@@ -112,6 +115,16 @@ class PerformanceSerializer(serializers.ModelSerializer):
         """
         Возвращает информацию о ближайшем показе
         """
+        if hasattr(obj, 'nearest_show_id'):
+            if obj.nearest_show_id is None:
+                return None
+            return {
+                'id': obj.nearest_show_id,
+                'date_time': obj.nearest_show_date_time.strftime("%d.%m.%Y %H:%M"),
+                'theater': obj.nearest_show_theater or "Не указан",
+                'price': f"{float(obj.nearest_show_price):.2f} ₽"
+            }
+        
         from django.utils import timezone
         
         nearest = obj.schedule.filter(date_time__gt=timezone.now()).order_by('date_time').first()
@@ -125,6 +138,29 @@ class PerformanceSerializer(serializers.ModelSerializer):
             }
         return None
 
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get('reviews_limit'):
+            fields['reviews'] = ReviewSerializer(many=True, read_only=True, source='first_reviews')
+        return fields
+
+    def to_representation(self, obj):
+        """
+        С reviews_limit в контексте (with_catalog_stats(reviews_limit=...)) в reviews
+        только первая страница новых отзывов, а reviews_count и reviews_next - общее
+        количество отзывов и ссылка на следующую страницу /performances/<pk>/reviews/
+        """
+        data = super().to_representation(obj)
+        if self.context.get('reviews_limit'):
+            reviews = obj.first_reviews
+            data['reviews_count'] = obj.review_count
+            data['reviews_next'] = None
+            if reviews and obj.review_count > len(reviews):
+                data['reviews_next'] = ReviewPagination().get_next_link_after(
+                    self.context['request'], reverse('performance-reviews', args=[obj.pk]), reviews[-1]
+                )
+        return data
+
 class PerformanceBriefSerializer(serializers.ModelSerializer):
     """
     Упрощенный сериализатор для спектакля с основной информацией для каталога
@@ -136,7 +172,7 @@ class PerformanceBriefSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Performance
-        fields = ['id', 'name', 'image', 'category', 'duration_formatted', 'nearest_date', 'min_price']
+        fields = ['id', 'name', 'image', 'category', 'duration_formatted', 'nearest_date', 'min_price', 'rating']
     
     def get_duration_formatted(self, obj):
         """
@@ -157,6 +193,10 @@ class PerformanceBriefSerializer(serializers.ModelSerializer):
         """
         Возвращает ближайшую дату спектакля
         """
+        if hasattr(obj, 'nearest_show_date_time'):
+            if obj.nearest_show_date_time is None:
+                return None
+            return obj.nearest_show_date_time.strftime("%d.%m.%Y %H:%M")
         from django.utils import timezone
         nearest = obj.schedule.filter(date_time__gt=timezone.now()).order_by('date_time').first()
         if nearest:
@@ -167,9 +207,12 @@ class PerformanceBriefSerializer(serializers.ModelSerializer):
         """
         Возвращает минимальную цену билета
         """
-        from django.db.models import Min
-        result = obj.schedule.aggregate(min_price=Min('price'))
-        min_price = result['min_price']
+        if hasattr(obj, 'min_price'):
+            min_price = obj.min_price
+        else:
+            from django.db.models import Min
+            result = obj.schedule.aggregate(min_price=Min('price'))
+            min_price = result['min_price']
         if min_price:
             return f"{float(min_price):.2f} ₽"
         return "Не указана"
@@ -189,6 +232,8 @@ class CategoryWithPerformancesSerializer(serializers.ModelSerializer):
         """
         Возвращает количество спектаклей в категории
         """
+        if hasattr(obj, 'performances_count'):
+            return obj.performances_count
         return obj.performances.count()
 
 class CategoryBriefSerializer(serializers.ModelSerializer):
@@ -205,6 +250,8 @@ class CategoryBriefSerializer(serializers.ModelSerializer):
         """
         Возвращает количество спектаклей в категории
         """
+        if hasattr(obj, 'performances_count'):
+            return obj.performances_count
         return obj.performances.count()
 
 class PerformanceScheduleSerializer(serializers.ModelSerializer):
@@ -216,6 +263,18 @@ class PerformanceScheduleSerializer(serializers.ModelSerializer):
         model = PerformanceSchedule
         fields = ['id', 'performance_name', 'theater_name', 'hall_number', 'date_time', 'available_seats', 'price']
 
+class ScheduleSearchSerializer(PerformanceScheduleSerializer):
+    """
+    Показ в результатах поиска: данные спектакля и театра берутся из select_related
+    """
+    category_name = serializers.CharField(source='performance.category.name', read_only=True, default=None)
+
+    class Meta(PerformanceScheduleSerializer.Meta):
+        fields = [
+            'id', 'performance_id', 'performance_name', 'category_name', 'theater_id', 'theater_name',
+            'hall_number', 'date_time', 'available_seats', 'price'
+        ]
+
 class CartItemSerializer(serializers.ModelSerializer):
     performance_schedule = PerformanceScheduleSerializer(read_only=True)
     performance_schedule_id = serializers.PrimaryKeyRelatedField(
@@ -227,8 +286,42 @@ class CartItemSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = CartItem
-        fields = ['id', 'performance_schedule', 'performance_schedule_id', 'quantity', 'added_at', 'total_price']
-        read_only_fields = ['added_at']
+        fields = ['id', 'performance_schedule', 'performance_schedule_id', 'quantity', 'added_at', 'total_price',
+                  'held_quantity', 'hold_expires_at', 'seats']
+        read_only_fields = ['added_at', 'held_quantity', 'hold_expires_at', 'seats']
+
+class CartSummarySerializer(serializers.Serializer):
+    """
+    Итоги корзины и предупреждения о нехватке мест
+    """
+    items_count = serializers.IntegerField()
+    seats_count = serializers.IntegerField()
+    total_amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    warnings = serializers.ListField(child=serializers.DictField())
+
+    @classmethod
+    def for_items(cls, cart_items):
+        """
+        Итоги из элементов корзины с аннотациями CartItemQuerySet.with_summary
+        """
+        first = cart_items[0] if cart_items else None
+        return cls({
+            'items_count': first.cart_items if first else 0,
+            'seats_count': first.cart_seats if first else 0,
+            'total_amount': first.cart_total if first else 0,
+            'warnings': [
+                {
+                    'cart_item_id': item.pk,
+                    'performance_schedule_id': item.performance_schedule_id,
+                    'available_seats': item.performance_schedule.available_seats,
+                    'missing_seats': item.missing_seats,
+                    'message': f"Недостаточно мест для '{item.performance_schedule.performance.name}'. "
+                               f"Доступно: {item.performance_schedule.available_seats}, "
+                               f"не хватает: {item.missing_seats}",
+                }
+                for item in cart_items if item.missing_seats > 0
+            ],
+        })
 
 class OrderItemSerializer(serializers.ModelSerializer):
     performance_name = serializers.CharField(source='performance_schedule.performance.name', read_only=True)
@@ -239,8 +332,19 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['id', 'performance_name', 'performance_schedule', 'theater_name', 
-                 'date_time', 'quantity', 'price_per_unit', 'subtotal']
-        read_only_fields = ['price_per_unit']
+                 'date_time', 'quantity', 'price_per_unit', 'subtotal', 'seats']
+        read_only_fields = ['price_per_unit', 'seats']
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """
+    Заказ в списке без элементов: количество элементов из аннотации items_count
+    """
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    items_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'status_display', 'total_amount', 'created_at', 'items_count']
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
@@ -302,6 +406,16 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             
         return value
     
+    def _load_cart(self, user):
+        """
+        Корзина пользователя одним запросом вместе с расписаниями и спектаклями
+        """
+        return list(
+            CartItem.objects.filter(user=user)
+            .select_related('performance_schedule__performance')
+            .order_by('performance_schedule_id')
+        )
+
     def validate(self, attrs):
         """
         Валидация заказа: проверка минимальной и максимальной суммы заказа.
@@ -309,29 +423,35 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         # Получаем пользователя из контекста
         user = self.context['request'].user
         
-        # Получаем элементы корзины пользователя
-        from .models import CartItem
-        cart_items = CartItem.objects.filter(user=user)
+        # Получаем элементы корзины пользователя (используются и в create)
+        cart_items = self._cart_items = self._load_cart(user)
         
         # Проверяем наличие элементов в корзине
-        if not cart_items.exists():
+        if not cart_items:
             raise serializers.ValidationError({
                 "non_field_errors": ["Корзина пуста"]
             })
         
-        # Проверяем доступность мест для каждого элемента корзины
+        # Проверяем доступность мест для каждого элемента корзины (с учетом удержанных под него)
         for cart_item in cart_items:
-            if cart_item.quantity > cart_item.performance_schedule.available_seats:
+            available = cart_item.performance_schedule.available_seats + cart_item.held_quantity
+            if cart_item.quantity > available:
                 raise serializers.ValidationError({
                     "non_field_errors": [
                         f"Недостаточно мест для '{cart_item.performance_schedule.performance.name}'. "
-                        f"Доступно: {cart_item.performance_schedule.available_seats}, "
+                        f"Доступно: {available}, "
                         f"запрошено: {cart_item.quantity}"
                     ]
                 })
         
-        # Рассчитываем общую сумму заказа
-        total_amount = sum(item.performance_schedule.price * item.quantity for item in cart_items)
+        # Рассчитываем общую сумму заказа так же, как она будет списана в create (с ценами зон)
+        layouts = self._layouts = seatmap.layouts(item.performance_schedule for item in cart_items)
+        total_amount = self._total(self._order_lines(
+            {item.performance_schedule_id: item.quantity for item in cart_items},
+            {item.performance_schedule_id: item.performance_schedule.price for item in cart_items},
+            layouts,
+            {item.performance_schedule_id: item.seats or [] for item in cart_items},
+        ))
         
         # Проверка минимальной суммы заказа (500 рублей)
         if total_amount < 500:
@@ -352,48 +472,121 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         return attrs
         
     def create(self, validated_data):
-        # Получаем пользователя из контекста
+        """
+        Оформляет заказ из корзины в одной транзакции: блокирует расписания,
+        продает удержанные под корзину места и бронирует недостающие условными
+        UPDATE, создает элементы заказа одним INSERT и очищает корзину одним DELETE.
+        При нехватке мест откатывается все.
+        """
         user = self.context['request'].user
-        
-        # Получаем элементы корзины пользователя
-        from .models import CartItem
-        cart_items = CartItem.objects.filter(user=user)
-        
-        # Рассчитываем общую сумму заказа
-        total_amount = sum(item.performance_schedule.price * item.quantity for item in cart_items)
-        
-        # Создаем заказ
-        order = Order.objects.create(
-            user=user,
-            total_amount=total_amount,
-            **validated_data
-        )
-        
-        try:
-            # Создаем элементы заказа на основе элементов корзины
+        cart_items = getattr(self, '_cart_items', None)
+        if cart_items is None:
+            cart_items = self._load_cart(user)
+        quantities = {item.performance_schedule_id: item.quantity for item in cart_items}
+
+        with inventory.compensating(), transaction.atomic():
+            # Блокируем расписания в порядке id, чтобы встречные заказы не взаимоблокировались.
+            # Остатки "горячих" расписаний ведутся в Redis, их строки не блокируем
+            schedules = {
+                item.performance_schedule_id: item.performance_schedule
+                for item in cart_items if item.performance_schedule.hot_inventory
+            }
+            cold = [pk for pk in quantities if pk not in schedules]
+            if cold:
+                schedules.update(
+                    (schedule.pk, schedule)
+                    for schedule in PerformanceSchedule.objects.select_for_update()
+                    .filter(pk__in=cold).order_by('pk').only('id', 'price', 'available_seats')
+                )
+            # Удержания перечитываем под блокировкой: истекшие могли уже вернуть в продажу
+            locked = list(
+                CartItem.objects.select_for_update().filter(pk__in=[item.pk for item in cart_items])
+                .values_list('performance_schedule_id', 'held_quantity', 'seats')
+            )
+            held = {pk: quantity for pk, quantity, _ in locked}
+            held_seats = {pk: item_seats or [] for pk, _, item_seats in locked}
+            # Показы с картой зала продаются только удержанными местами
+            layouts = getattr(self, '_layouts', None)
+            if layouts is None:
+                layouts = seatmap.layouts(item.performance_schedule for item in cart_items)
             for cart_item in cart_items:
-                # Резервируем места
-                if not cart_item.performance_schedule.reserve_seats(cart_item.quantity):
-                    # Если не удалось зарезервировать места, отменяем заказ
+                if cart_item.performance_schedule_id in layouts and len(held_seats.get(cart_item.performance_schedule_id, [])) < cart_item.quantity:
                     raise serializers.ValidationError(
-                        f"Недостаточно мест для '{cart_item.performance_schedule.performance.name}'. "
-                        f"Доступно: {cart_item.performance_schedule.available_seats}"
+                        f"Удержание мест на '{cart_item.performance_schedule.performance.name}' истекло, "
+                        f"выберите места заново"
                     )
-                
-                # Создаем элемент заказа
-                OrderItem.objects.create(
-                    order=order,
-                    performance_schedule=cart_item.performance_schedule,
-                    quantity=cart_item.quantity,
-                    price_per_unit=cart_item.performance_schedule.price
-                )
-            
-            # Очищаем корзину пользователя только если все места успешно зарезервированы
-            cart_items.delete()
-            
-            return order
-            
-        except Exception as e:
-            # В случае ошибки отменяем заказ и пробрасываем исключение
-            order.delete()
-            raise serializers.ValidationError(str(e))
\ No newline at end of file
+            from_holds = {pk: min(held.get(pk, 0), quantity) for pk, quantity in quantities.items()}
+            from_free = {pk: quantity - from_holds[pk] for pk, quantity in quantities.items()}
+            if (
+                len(schedules) != len(quantities)
+                or not PerformanceSchedule.objects.sell_holds(from_holds)
+                or not PerformanceSchedule.objects.reserve_many(from_free)
+            ):
+                available = dict(PerformanceSchedule.objects.filter(pk__in=quantities).values_list('pk', 'available_seats'))
+                for pk in available:
+                    hot = inventory.seats(pk)
+                    if hot is not None:
+                        available[pk] = hot[0]
+                for cart_item in cart_items:
+                    free = available.get(cart_item.performance_schedule_id, 0) + from_holds[cart_item.performance_schedule_id]
+                    if free < cart_item.quantity:
+                        raise serializers.ValidationError(
+                            f"Недостаточно мест для '{cart_item.performance_schedule.performance.name}'. "
+                            f"Доступно: {free}"
+                        )
+                raise serializers.ValidationError("Недостаточно мест")
+
+            # Цены берем из заблокированных строк расписания и зон выбранных мест
+            lines = self._order_lines(
+                quantities, {pk: schedule.price for pk, schedule in schedules.items()}, layouts, held_seats
+            )
+            order_items = [
+                OrderItem(performance_schedule_id=pk, quantity=quantity, price_per_unit=price, seats=group)
+                for pk, quantity, price, group in lines
+            ]
+            order = Order.objects.create(
+                user=user,
+                total_amount=self._total(lines),
+                **validated_data
+            )
+            for item in order_items:
+                item.order = order
+            OrderItem.objects.bulk_create(order_items)
+            # Удержанные сверх заказанного места возвращаем в продажу
+            PerformanceSchedule.objects.release_holds({
+                pk: held[pk] - quantity for pk, quantity in quantities.items() if held.get(pk, 0) > quantity
+            })
+            # Удаляем только оформленные элементы: добавленные после загрузки корзины остаются
+            CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+
+        return order
+
+    @classmethod
+    def _order_lines(cls, quantities, prices, layouts, seats):
+        """
+        Строки заказа (id показа, количество, цена билета, места) с учетом цен зон выбранных мест
+        """
+        return [
+            (pk, len(group) or quantity, price, group)
+            for pk, quantity in quantities.items()
+            for price, group in cls._price_groups(prices[pk], layouts.get(pk), seats.get(pk, []))
+        ]
+
+    @staticmethod
+    def _total(lines):
+        """
+        Сумма заказа по строкам _order_lines
+        """
+        return sum(price * quantity for _, quantity, price, _ in lines)
+
+    @staticmethod
+    def _price_groups(price, layout, seats):
+        """
+        Пары (цена билета, места): выбранные места группируются по цене их зоны
+        """
+        if layout is None or not seats:
+            return [(price, [])]
+        groups = {}
+        for seat in seats:
+            groups.setdefault(layout.price(seat['row'], price), []).append(seat)
+        return list(groups.items())
\ No newline at end of file
@@ -0,0 +1,185 @@
+import logging
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from main.models import Theater
+
+from .cache import CATALOG_VERSION, bump_version
+from .fuzzy import invalidate_index
+from .models import Counter, Like, Performance, PerformanceCategory, PerformanceSchedule, Review
+from .orders import order_status_changed
+from .search import get_search_backend
+from .seatmap import ensure_seat_map
+from . import waiting_room
+from .suggest import update_entry
+from .tasks import send_order_status_emails
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_KINDS = {Performance: 'performance', PerformanceCategory: 'category', Theater: 'theater'}
+
+
+@receiver(post_save, sender=Performance)
+def index_performance(sender, instance, raw=False, **kwargs):
+    """
+    Обновляет полнотекстовый индекс после сохранения спектакля
+    """
+    if raw:
+        return
+    get_search_backend().index(instance)
+
+
+@receiver(post_delete, sender=Performance)
+def remove_performance_from_index(sender, instance, **kwargs):
+    """
+    Удаляет спектакль из полнотекстового индекса
+    """
+    get_search_backend().remove(instance.pk)
+
+
+@receiver(post_save, sender=Performance)
+@receiver(post_delete, sender=Performance)
+@receiver(post_save, sender=PerformanceCategory)
+@receiver(post_delete, sender=PerformanceCategory)
+@receiver(post_save, sender=Theater)
+@receiver(post_delete, sender=Theater)
+def invalidate_fuzzy_index(sender, **kwargs):
+    """
+    Сбрасывает триграммный индекс названий, он перестроится при следующем запросе
+    """
+    invalidate_index()
+
+
+@receiver(post_save, sender=Performance)
+@receiver(post_save, sender=PerformanceCategory)
+@receiver(post_save, sender=Theater)
+def update_suggest_index(sender, instance, raw=False, **kwargs):
+    """
+    Обновляет индекс автодополнения после коммита транзакции
+    """
+    if raw:
+        return
+    kind, pk, name = SUGGEST_KINDS[sender], instance.pk, instance.name
+    transaction.on_commit(lambda: update_entry(kind, pk, name))
+
+
+@receiver(post_delete, sender=Performance)
+@receiver(post_delete, sender=PerformanceCategory)
+@receiver(post_delete, sender=Theater)
+def remove_from_suggest_index(sender, instance, **kwargs):
+    kind, pk = SUGGEST_KINDS[sender], instance.pk
+    transaction.on_commit(lambda: update_entry(kind, pk))
+
+
+@receiver(pre_save, sender=Review)
+def read_counted_review(sender, instance, raw=False, **kwargs):
+    """
+    Читает из базы спектакль и оценку, с которыми сохраняемый отзыв сейчас учтен
+    в счетчиках спектакля. В транзакции строка блокируется до коммита, чтобы
+    параллельные правки одного отзыва не считали разницу от одного значения.
+    """
+    if raw:
+        return
+    instance._counted_before_save = None
+    if instance.pk:
+        reviews = Review.objects.filter(pk=instance.pk)
+        if transaction.get_connection().in_atomic_block:
+            reviews = reviews.select_for_update()
+        instance._counted_before_save = reviews.values_list('performance_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, raw=False, **kwargs):
+    """
+    Поправляет счетчики отзывов и оценок спектакля в той же транзакции
+    на разницу между прежними и новыми спектаклем и оценкой отзыва
+    """
+    if raw:
+        return
+    counted = instance.__dict__.pop('_counted_before_save', None)
+    if counted == (instance.performance_id, instance.rating):
+        return
+    if counted:
+        Performance.objects.count_review(*counted, sign=-1)
+    Performance.objects.count_review(instance.performance_id, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, **kwargs):
+    Performance.objects.count_review(instance.performance_id, instance.rating, sign=-1)
+
+
+@receiver(post_save, sender=Like)
+def count_like(sender, instance, created, raw=False, **kwargs):
+    """
+    Увеличивает счетчик лайков отзыва и общий счетчик лайков в той же транзакции
+    """
+    if created and not raw:
+        Review.objects.filter(pk=instance.review_id).update(likes_count=F('likes_count') + 1)
+        Counter.objects.add(Counter.LIKES, 1)
+
+
+@receiver(post_delete, sender=Like)
+def uncount_like(sender, instance, **kwargs):
+    """
+    Уменьшает счетчики, в том числе при удалении лайков вместе с отзывом
+    """
+    Review.objects.filter(pk=instance.review_id, likes_count__gt=0).update(likes_count=F('likes_count') - 1)
+    Counter.objects.add(Counter.LIKES, -1)
+
+
+@receiver(post_save, sender=Performance)
+@receiver(post_delete, sender=Performance)
+@receiver(post_save, sender=PerformanceSchedule)
+@receiver(post_delete, sender=PerformanceSchedule)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=PerformanceCategory)
+@receiver(post_delete, sender=PerformanceCategory)
+def bump_catalog_version(sender, raw=False, **kwargs):
+    """
+    Увеличивает версию каталога после коммита, чтобы закешированные ответы
+    каталога больше не использовались. До коммита нельзя: параллельный запрос
+    успел бы закешировать старые данные под новой версией.
+    """
+    if raw:
+        return
+    transaction.on_commit(lambda: bump_version(CATALOG_VERSION))
+
+
+@receiver(post_save, sender=PerformanceSchedule)
+def create_seat_map(sender, instance, created, raw=False, **kwargs):
+    """
+    Создает пустую карту занятости для нового показа в зале со схемой мест
+    """
+    if created and not raw:
+        ensure_seat_map(instance)
+
+
+@receiver(post_save, sender=PerformanceSchedule)
+def sync_admission_limit(sender, instance, raw=False, **kwargs):
+    """
+    Копирует лимит очереди показа в Redis после коммита транзакции
+    """
+    if raw or not waiting_room.enabled():
+        return
+    pk, limit = instance.pk, instance.admission_limit
+    transaction.on_commit(lambda: waiting_room.set_limit(pk, limit))
+
+
+@receiver(order_status_changed)
+def notify_order_status(sender, status, order_ids, **kwargs):
+    """
+    Ставит одну задачу уведомлений на всю пачку заказов. Статусы к этому
+    моменту уже сохранены, поэтому недоступный брокер не должен ломать запрос:
+    задача ставится без повторных попыток, ошибка только пишется в лог.
+    """
+    try:
+        send_order_status_emails.apply_async((order_ids, status), retry=False)
+    except Exception:
+        logger.exception("Не удалось поставить уведомления об изменении статуса заказов %s", order_ids)
@@ -0,0 +1,270 @@
+"""
+Автодополнение по названиям спектаклей, категорий и театров.
+
+Индекс - отсортированный список ключей, в котором префикс ищется через bisect.
+Ключи - название начиная с каждого слова ('вишневый сад', 'сад'), поэтому
+подсказка находится и по началу любого слова. Записи пронумерованы по убыванию
+популярности, так что лучшие k записей диапазона - k наименьших номеров.
+Для префиксов с широким диапазоном ключей лучшие k номеров посчитаны заранее.
+
+Индекс живет в памяти процесса. Изменения названий после коммита транзакции
+(см. signals.py) копятся и применяются перед следующим запросом подсказок:
+несколько - точечно (каждое O(n) из-за вставки в отсортированные списки),
+больше POINT_UPDATE_LIMIT - одной перестройкой индекса из его же записей
+за O(n log n), поэтому массовое пересохранение каталога не квадратично.
+Изменения увеличивают версию в кеше, по которой остальные процессы
+перестраивают свой индекс.
+"""
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from .cache import bump_version, get_version
+from .fuzzy import words
+
+SUGGEST_LIMIT = 10
+# Диапазоны ключей не шире этого значения просматриваются при запросе
+SCAN_LIMIT = 256
+# Как часто процесс сверяет версию индекса с кешем, секунд
+VERSION_CHECK_INTERVAL = 1.0
+VERSION_NAME = 'catalog-suggest'
+# Больше стольких накопленных изменений применяются перестройкой индекса
+POINT_UPDATE_LIMIT = 64
+
+_MAX_CHAR = '\uffff'
+
+
+def normalize(text):
+    return ' '.join(words(text))
+
+
+def index_keys(name):
+    """
+    Ключи названия: текст начиная с каждого слова
+    """
+    name_words = words(name)
+    return {' '.join(name_words[i:]) for i in range(len(name_words))}
+
+
+class PrefixIndex:
+    """
+    Записи - кортежи (тип, id, название, популярность)
+    """
+
+    def __init__(self, entries, limit=SUGGEST_LIMIT):
+        self.limit = limit
+        self.entries = sorted(entries, key=lambda entry: (-entry[3], entry[0], entry[1]))
+        self.numbers = {(entry[0], entry[1]): number for number, entry in enumerate(self.entries)}
+        pairs = sorted(
+            (key, number)
+            for number, entry in enumerate(self.entries)
+            for key in index_keys(entry[2])
+        )
+        self.keys = [key for key, _ in pairs]
+        self.owners = array('I', (number for _, number in pairs))
+        self.top = {}
+        self._precompute(0, len(self.keys), 0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _precompute(self, lo, hi, depth):
+        """
+        Возвращает лучшие номера для ключей [lo, hi) с общим префиксом длины depth.
+        Для широких диапазонов результат собирается из результатов дочерних
+        префиксов и сохраняется в self.top.
+        """
+        if hi - lo <= SCAN_LIMIT:
+            return heapq.nsmallest(self.limit, set(self.owners[lo:hi]))
+        keys = self.keys
+        prefix = keys[lo][:depth]
+        candidates = set()
+        position = lo
+        # Ключи, совпадающие с префиксом целиком, идут первыми
+        while position < hi and len(keys[position]) == depth:
+            candidates.add(self.owners[position])
+            position += 1
+        while position < hi:
+            child = keys[position][:depth + 1]
+            end = bisect_left(keys, child + _MAX_CHAR, position, hi)
+            candidates.update(self._precompute(position, end, depth + 1))
+            position = end
+        best = heapq.nsmallest(self.limit, candidates)
+        self.top[prefix] = best
+        return best
+
+    def _range(self, prefix):
+        lo = bisect_left(self.keys, prefix)
+        return lo, bisect_left(self.keys, prefix + _MAX_CHAR, lo)
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        best = self.top.get(prefix)
+        if best is None:
+            lo, hi = self._range(prefix)
+            best = heapq.nsmallest(self.limit, set(self.owners[lo:hi]))
+            if hi - lo > SCAN_LIMIT:
+                self.top[prefix] = best
+        return [
+            {'type': entry[0], 'id': entry[1], 'name': entry[2]}
+            for entry in (self.entries[number] for number in best[:limit])
+        ]
+
+    def remove(self, kind, pk):
+        number = self.numbers.get((kind, pk))
+        if number is None or self.entries[number] is None:
+            return
+        for key in index_keys(self.entries[number][2]):
+            lo, hi = self._range(key)
+            for position in range(lo, hi):
+                if self.keys[position] == key and self.owners[position] == number:
+                    del self.keys[position]
+                    del self.owners[position]
+                    break
+            # Сохраненные результаты с этой записью будут пересчитаны при запросе
+            for length in range(1, len(key) + 1):
+                best = self.top.get(key[:length])
+                if best is not None and number in best:
+                    del self.top[key[:length]]
+        self.entries[number] = None
+
+    def upsert(self, kind, pk, name):
+        """
+        Добавляет или переименовывает запись. Новая запись получает
+        наименьшую популярность до следующей полной перестройки.
+        """
+        number = self.numbers.get((kind, pk))
+        if number is None:
+            number = len(self.entries)
+            self.entries.append(None)
+            self.numbers[(kind, pk)] = number
+            popularity = 0
+        else:
+            popularity = self.entries[number][3] if self.entries[number] else 0
+            self.remove(kind, pk)
+        self.entries[number] = (kind, pk, name, popularity)
+        for key in index_keys(name):
+            position = bisect_left(self.keys, key)
+            self.keys.insert(position, key)
+            self.owners.insert(position, number)
+            for length in range(1, len(key) + 1):
+                best = self.top.get(key[:length])
+                if best is not None and number not in best:
+                    self.top[key[:length]] = heapq.nsmallest(self.limit, best + [number])
+
+    def apply(self, changes):
+        """
+        Применяет изменения {(тип, id): название или None для удаления}.
+        Возвращает этот же индекс или, если изменений много, новый,
+        построенный из текущих записей без обращения к базе.
+        """
+        if len(changes) <= POINT_UPDATE_LIMIT:
+            for (kind, pk), name in changes.items():
+                if name is None:
+                    self.remove(kind, pk)
+                else:
+                    self.upsert(kind, pk, name)
+            return self
+        entries = {(entry[0], entry[1]): entry for entry in self.entries if entry is not None}
+        for (kind, pk), name in changes.items():
+            if name is None:
+                entries.pop((kind, pk), None)
+            else:
+                previous = entries.get((kind, pk))
+                entries[(kind, pk)] = (kind, pk, name, previous[3] if previous else 0)
+        return PrefixIndex(entries.values(), limit=self.limit)
+
+
+def load_entries():
+    """
+    Записи для индекса. Популярность спектакля и театра - число проданных
+    билетов (без отмененных заказов), категории - сумма по ее спектаклям.
+    """
+    from django.db.models import Sum
+    from main.models import Theater
+    from .models import OrderItem, OrderStatus, Performance, PerformanceCategory
+
+    sold = OrderItem.objects.exclude(order__status=OrderStatus.CANCELLED)
+    performance_sold = dict(
+        sold.values_list('performance_schedule__performance').annotate(total=Sum('quantity')).order_by()
+    )
+    theater_sold = dict(
+        sold.values_list('performance_schedule__theater').annotate(total=Sum('quantity')).order_by()
+    )
+
+    category_sold = {}
+    for pk, name, category_id in Performance._base_manager.values_list('id', 'name', 'category_id').iterator():
+        popularity = performance_sold.get(pk, 0)
+        if category_id is not None:
+            category_sold[category_id] = category_sold.get(category_id, 0) + popularity
+        yield 'performance', pk, name, popularity
+    for pk, name in PerformanceCategory._base_manager.values_list('id', 'name'):
+        yield 'category', pk, name, category_sold.get(pk, 0)
+    for pk, name in Theater._base_manager.values_list('id', 'name'):
+        yield 'theater', pk, name, theater_sold.get(pk, 0)
+
+
+_index = None
+_version = None
+_checked_at = 0.0
+# Изменения, еще не примененные к индексу процесса: (тип, id) -> название или None
+_pending = {}
+_lock = threading.RLock()
+
+
+def get_index():
+    """
+    Возвращает индекс процесса, перестраивая его, если версия в кеше изменилась,
+    и применяя накопленные изменения
+    """
+    global _index, _version, _checked_at
+    now = time.monotonic()
+    if _index is not None and not _pending and now - _checked_at < VERSION_CHECK_INTERVAL:
+        return _index
+    check = _index is None or now - _checked_at >= VERSION_CHECK_INTERVAL
+    version = get_version(VERSION_NAME) if check else _version
+    with _lock:
+        if _index is None or version != _version:
+            # Перестроенный из базы индекс уже содержит закоммиченные изменения
+            _index = PrefixIndex(load_entries())
+            _version = version
+            _pending.clear()
+        elif _pending:
+            _index = _index.apply(_pending)
+            _pending.clear()
+        if check:
+            _checked_at = now
+        return _index
+
+
+def invalidate_index():
+    global _index
+    with _lock:
+        _index = None
+        _pending.clear()
+
+
+def suggest(query, limit=SUGGEST_LIMIT):
+    index = get_index()
+    with _lock:
+        return index.suggest(query, limit=limit)
+
+
+def update_entry(kind, pk, name=None):
+    """
+    Запоминает изменение для индекса процесса (name=None - удаление)
+    и сообщает остальным процессам о новой версии
+    """
+    global _version
+    with _lock:
+        if _index is not None:
+            _pending[(kind, pk)] = name
+    version = bump_version(VERSION_NAME)
+    with _lock:
+        # Если версию успели увеличить другие процессы, индекс перестроится при проверке
+        if _version is not None and version == _version + 1:
+            _version = version
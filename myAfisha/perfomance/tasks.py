@@ -1,7 +1,10 @@
 from celery import shared_task
+from celery.signals import worker_ready
 from django.utils import timezone
-from .models import PerformanceSchedule, Performance
-from django.db.models import Count, Sum, Avg
+from .models import Order, OrderStatus, PerformanceSchedule, Performance
+from .idempotency import purge_expired_keys
+from .holds import reclaim_expired_holds
+from . import inventory, waiting_room
 import logging
 
 logger = logging.getLogger(__name__)
@@ -31,17 +34,89 @@ def update_performance_stats():
         # Здесь можно имплементировать реальное обновление статистики,
         # например, подсчет количества просмотров, лайков, отзывов и т.д.
         
-        # Пример агрегирования данных
-        top_performances = Performance.objects.annotate(
-            review_count=Count('reviews'),
-            avg_rating=Avg('reviews__rating', default=0)
-        ).order_by('-avg_rating')[:5]
+        # Количество отзывов и средняя оценка хранятся в счетчиках спектакля,
+        # лучшие спектакли читаются по индексу без агрегирования отзывов
+        top_performances = Performance.objects.filter(rating_count__gt=0).order_by('-average_rating', 'id')[:5]
         
         for perf in top_performances:
-            logger.info(f"Спектакль '{perf.name}': {perf.review_count} отзывов, рейтинг {perf.avg_rating}")
+            logger.info(f"Спектакль '{perf.name}': {perf.review_count} отзывов, рейтинг {perf.rating}")
             
         return f"Обновлена статистика для {total_count} спектаклей"
     
     except Exception as e:
         logger.error(f"Ошибка при обновлении статистики: {str(e)}")
-        raise 
\ No newline at end of file
+        raise 
+
+@shared_task
+def purge_idempotency_keys():
+    """
+    Удаляет истекшие ключи идемпотентности
+    """
+    deleted = purge_expired_keys()
+    logger.info(f"Удалено {deleted} истекших ключей идемпотентности")
+    return f"Удалено {deleted} ключей"
+
+
+@shared_task
+def reclaim_seat_holds():
+    """
+    Возвращает в продажу места, удержание которых в корзинах истекло
+    """
+    reclaimed = reclaim_expired_holds()
+    logger.info(f"Возвращено в продажу {reclaimed} мест из истекших удержаний")
+    return f"Возвращено {reclaimed} мест"
+
+
+@shared_task
+def flush_inventory():
+    """
+    Переносит в базу изменения остатков "горячих" расписаний, накопленные в Redis
+    """
+    flushed = inventory.flush()
+    logger.info(f"Перенесены остатки {flushed} расписаний из Redis")
+    return f"Перенесено {flushed} расписаний"
+
+
+@shared_task
+def reconcile_inventory():
+    """
+    Сверяет остатки "горячих" расписаний в Redis с базой
+    """
+    loaded, dropped = inventory.reconcile()
+    logger.info(f"Сверка остатков: загружено в Redis {loaded}, убрано из Redis {dropped} расписаний")
+    return f"Загружено {loaded}, убрано {dropped} расписаний"
+
+
+@shared_task
+def send_order_status_emails(order_ids, status):
+    """
+    Уведомляет покупателей об изменении статуса заказов: одна задача на пачку заказов
+    """
+    label = OrderStatus(status).label
+    sent = 0
+    for order_id, email in Order.objects.filter(pk__in=order_ids).values_list('pk', 'customer_email'):
+        # В реальном приложении здесь будет отправка email, как в users/tasks.py
+        logger.info(f"[EMAIL] To: {email}, Subject: Заказ #{order_id}: {label}")
+        sent += 1
+    return f"Отправлено {sent} уведомлений"
+
+@shared_task
+def sync_waiting_room_limits():
+    """
+    Копирует лимиты очередей ожидания из базы в Redis
+    """
+    synced = waiting_room.sync_limits()
+    logger.info(f"Очереди ожидания: лимиты {synced} показов скопированы в Redis")
+    return f"Очередь у {synced} показов"
+
+
+@worker_ready.connect
+def reconcile_inventory_on_startup(**kwargs):
+    """
+    После перезапуска Redis или воркеров остатки сверяются с базой,
+    а лимиты очередей ожидания заново копируются в Redis
+    """
+    if inventory.enabled():
+        reconcile_inventory.delay()
+    if waiting_room.enabled():
+        sync_waiting_room_limits.delay()
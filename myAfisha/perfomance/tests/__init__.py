@@ -1 +1,14 @@
- 
\ No newline at end of file
+from django.test import override_settings
+
+# Тесты не зависят от Redis в окружении: кеш в памяти процесса, остатки и очередь
+# ожидания выключены (тесты режимов с Redis подставляют fakeredis через using_client)
+local_services = override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'afisha-tests',
+        }
+    },
+    INVENTORY_REDIS_URL=None,
+    WAITING_ROOM_REDIS_URL=None,
+)
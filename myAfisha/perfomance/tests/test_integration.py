@@ -1,4 +1,11 @@
-from django.test import TestCase, Client
+import random
+import threading
+import time
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework.test import APIClient
@@ -10,10 +17,20 @@ from perfomance.models import (
     Performance, PerformanceCategory, PerformanceSchedule,
     Review, Order, OrderStatus, OrderItem, CartItem
 )
+from perfomance import inventory
+from perfomance.cache import HIT, MISS, STALE, single_flight
+from perfomance.tests import local_services
 from main.models import Theater, Hall
 from users.models import User
 
+try:
+    import fakeredis
+    import lupa  # noqa: F401
+except ImportError:
+    fakeredis = None
+
 
+@local_services
 class TicketOrderFlowTest(TestCase):
     """
     Test the entire flow from browsing performances to completing an order
@@ -198,6 +215,7 @@ class TicketOrderFlowTest(TestCase):
         self.assertEqual(self.schedule2.available_seats, 60)  # Back to 60
 
 
+@local_services
 class ReviewIntegrationTest(TestCase):
     """
     Test the integration between performances and reviews
@@ -269,4 +287,159 @@ class ReviewIntegrationTest(TestCase):
         # Check if review was deleted
         detail_url = reverse('performance_detail', kwargs={'pk': self.performance.id})
         response = self.client.get(detail_url)
-        self.assertEqual(len(response.data['reviews']), 0) 
\ No newline at end of file
+        self.assertEqual(len(response.data['reviews']), 0) 
+
+
+@local_services
+class SingleFlightCacheTest(SimpleTestCase):
+    """
+    Only one caller recomputes a key, the rest get a cached or stale value
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _compute(self, value='fresh', delay=0.0):
+        def compute():
+            with self.lock:
+                self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+
+    def test_concurrent_misses_compute_once(self):
+        results = []
+
+        def worker():
+            results.append(single_flight('payload', self._compute(delay=0.2), timeout=60, version=1))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual({value for value, _ in results}, {'fresh'})
+        self.assertEqual(sorted(state for _, state in results), [HIT] * 7 + [MISS])
+
+    def test_stale_value_served_while_another_worker_recomputes(self):
+        single_flight('payload', self._compute('old'), timeout=60, version=1)
+        cache.add('lock:payload', 'other-worker', 10)
+
+        value, state = single_flight('payload', self._compute('new'), timeout=60, version=2)
+        self.assertEqual((value, state), ('old', STALE))
+        self.assertEqual(self.calls, 1)
+
+        cache.delete('lock:payload')
+        self.assertEqual(single_flight('payload', self._compute('new'), timeout=60, version=2), ('new', MISS))
+
+    def test_expensive_value_refreshed_before_expiry(self):
+        """XFetch recomputes early when the recompute is long compared to the time left"""
+        single_flight('payload', self._compute('old'), timeout=60, version=1)
+        entry = cache.get('payload')
+        entry['delta'] = 3600.0
+        cache.set('payload', entry)
+
+        # -ln(1 - 0.5) * 3600 секунд заведомо больше оставшейся минуты
+        with mock.patch('perfomance.cache.random.random', return_value=0.5):
+            self.assertEqual(single_flight('payload', self._compute('new'), timeout=60, version=1), ('new', MISS))
+        # Дешевое значение до истечения срока не пересчитывается
+        self.assertEqual(single_flight('payload', self._compute('newer'), timeout=60, version=1), ('new', HIT))
+
+
+@local_services
+class ConcurrentSeatReservationTest(TransactionTestCase):
+    """
+    Concurrent buyers never sell more seats than the schedule has
+    """
+    # Покупателям нужно вдвое больше мест, чем есть. Тестовая база SQLite в памяти
+    # пропускает их по одному; прогон на сотни покупателей - команда benchmark_concurrency
+    BUYERS = 40
+    SEATS = 40
+
+    def setUp(self):
+        theater = Theater.objects.create(name="Театр", address="Москва", description="")
+        performance = Performance.objects.create(
+            name="Гамлет",
+            description="Трагедия",
+            duration_time=timedelta(hours=3)
+        )
+        self.schedule = PerformanceSchedule.objects.create(
+            performance=performance,
+            theater=theater,
+            date_time=timezone.now() + timedelta(days=1),
+            available_seats=self.SEATS,
+            price=Decimal('1000.00')
+        )
+
+    def _run_buyers(self, buy):
+        # Все покупатели загрузили расписание до начала продаж и видят SEATS свободных мест
+        schedules = [PerformanceSchedule.objects.get(pk=self.schedule.pk) for _ in range(self.BUYERS)]
+        barrier = threading.Barrier(self.BUYERS)
+        sold = []
+        errors = []
+
+        def buyer(number):
+            try:
+                barrier.wait()
+                quantity = 1 + number % 3
+                # SQLite блокирует таблицу целиком - повторяем, как повторил бы клиент.
+                # Срока нет: под нагрузкой повторы только дольше ждут своей очереди
+                while True:
+                    try:
+                        if buy(schedules[number], quantity):
+                            sold.append(quantity)
+                        return
+                    except OperationalError:
+                        time.sleep(random.uniform(0.001, 0.02))
+            except Exception:
+                errors.append(number)
+                raise
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer, args=(number,)) for number in range(self.BUYERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.schedule.refresh_from_db()
+        return sold
+
+    def test_no_oversell_with_concurrent_buyers(self):
+        sold = self._run_buyers(lambda schedule, quantity: schedule.reserve_seats(quantity))
+
+        self.assertGreaterEqual(self.schedule.available_seats, 0)
+        self.assertEqual(sum(sold) + self.schedule.available_seats, self.SEATS)
+        # Места заканчиваются раньше, чем покупатели: остаток меньше самой крупной покупки
+        self.assertLess(self.schedule.available_seats, 3)
+
+    def test_no_oversell_with_concurrent_batched_buyers(self):
+        sold = self._run_buyers(
+            lambda schedule, quantity: PerformanceSchedule.objects.reserve_many({schedule.pk: quantity})
+        )
+
+        self.assertGreaterEqual(self.schedule.available_seats, 0)
+        self.assertEqual(sum(sold) + self.schedule.available_seats, self.SEATS)
+        self.assertLess(self.schedule.available_seats, 3)
+
+    @skipUnless(fakeredis, 'fakeredis and lupa are required')
+    def test_no_oversell_with_hot_inventory(self):
+        with inventory.using_client(fakeredis.FakeRedis()):
+            inventory.enable([self.schedule.pk])
+            sold = self._run_buyers(
+                lambda schedule, quantity: PerformanceSchedule.objects.reserve_many({schedule.pk: quantity})
+            )
+            available, _ = inventory.seats(self.schedule.pk)
+            inventory.flush()
+
+        self.assertEqual(sum(sold) + available, self.SEATS)
+        self.assertLess(available, 3)
+        # После переноса база совпадает с Redis
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.available_seats, available)
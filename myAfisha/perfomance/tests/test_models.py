@@ -1,4 +1,10 @@
+from unittest import mock, skipUnless
+
+from kombu.exceptions import OperationalError
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from datetime import timedelta
 from decimal import Decimal
@@ -7,10 +13,20 @@ from perfomance.models import (
     Performance, PerformanceCategory, PerformanceSchedule,
     Review, CartItem, Order, OrderStatus, OrderItem
 )
+from perfomance import inventory
+from perfomance.orders import TransitionError, cancel_orders, check_transition, order_status_changed, transition
+from perfomance.tests import local_services
 from main.models import Theater, Hall
 from users.models import User
 
+try:
+    import fakeredis
+    import lupa  # noqa: F401 - fakeredis выполняет Lua-скрипты через lupa
+except ImportError:
+    fakeredis = None
+
 
+@local_services
 class PerformanceModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -39,6 +55,82 @@ class PerformanceModelTest(TestCase):
         self.assertEqual(self.performance.category, self.category)
 
 
+@local_services
+class PerformanceRatingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='critic',
+            email='critic@example.com',
+            password='criticpass123'
+        )
+        cls.performance = Performance.objects.create(
+            name="Вишневый сад",
+            description="Комедия А.П. Чехова",
+            duration_time=timedelta(hours=3)
+        )
+        cls.other_performance = Performance.objects.create(
+            name="Дядя Ваня",
+            description="Пьеса А.П. Чехова",
+            duration_time=timedelta(hours=2, minutes=40)
+        )
+
+    def _stats(self, performance):
+        performance.refresh_from_db()
+        return performance.review_count, performance.rating_sum, performance.rating_count, performance.rating
+
+    def test_counters_follow_review_changes(self):
+        """Creating, re-rating, moving and deleting reviews keeps the performance counters exact"""
+        first = Review.objects.create(user=self.user, performance=self.performance, text="Отлично", rating=5)
+        Review.objects.create(user=self.user, performance=self.performance, text="Хорошо", rating=4)
+        Review.objects.create(user=self.user, performance=self.performance, text="Без оценки")
+        self.assertEqual(self._stats(self.performance), (3, 9, 2, 4.5))
+
+        review = Review.objects.get(pk=first.pk)
+        review.rating = 2
+        with CaptureQueriesContext(connection) as queries:
+            review.save()
+        # Прежняя оценка читается из базы одним SELECT, затем UPDATE отзыва
+        # и два UPDATE счетчиков на старую и новую оценку
+        selects = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(self._stats(self.performance), (3, 6, 2, 3.0))
+
+        review.performance = self.other_performance
+        review.save()
+        self.assertEqual(self._stats(self.performance), (2, 4, 1, 4.0))
+        self.assertEqual(self._stats(self.other_performance), (1, 2, 1, 2.0))
+
+        # Экземпляр, созданный без загрузки из базы, тоже учитывает прежнюю оценку
+        Review(pk=review.pk, user=self.user, performance=self.other_performance, text="Изменен", rating=3).save()
+        self.assertEqual(self._stats(self.other_performance), (1, 3, 1, 3.0))
+
+        Review.objects.filter(performance=self.performance).delete()
+        self.assertEqual(self._stats(self.performance), (0, 0, 0, None))
+
+    def test_stale_instance_counts_from_stored_rating(self):
+        """A review changed elsewhere after loading is re-counted from the stored rating"""
+        review = Review.objects.create(user=self.user, performance=self.performance, text="Отлично", rating=5)
+        stale = Review.objects.get(pk=review.pk)
+        review.rating = 3
+        review.save()
+
+        stale.rating = 4
+        stale.save()
+        self.assertEqual(self._stats(self.performance), (1, 4, 1, 4.0))
+
+    def test_rebuild_review_stats(self):
+        """Counters are rebuilt from the reviews table"""
+        Review.objects.create(user=self.user, performance=self.performance, text="Отлично", rating=5)
+        Review.objects.create(user=self.user, performance=self.performance, text="Средне", rating=3)
+        Performance.objects.update(review_count=10, rating_sum=0, rating_count=0, average_rating=0)
+
+        self.assertEqual(Performance.objects.rebuild_review_stats(), 2)
+        self.assertEqual(self._stats(self.performance), (2, 8, 2, 4.0))
+        self.assertEqual(self._stats(self.other_performance), (0, 0, 0, None))
+
+
+@local_services
 class PerformanceScheduleModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -121,7 +213,45 @@ class PerformanceScheduleModelTest(TestCase):
         # Check available seats
         self.assertEqual(self.schedule.available_seats, initial_seats + seats_to_release)
 
+    def test_reserve_seats_ignores_stale_instance(self):
+        # Another request sold seats after this instance was loaded
+        stale = PerformanceSchedule.objects.get(pk=self.schedule.pk)
+        PerformanceSchedule.objects.filter(pk=self.schedule.pk).update(available_seats=2)
 
+        self.assertFalse(stale.reserve_seats(5))
+        self.assertEqual(stale.available_seats, 2)
+        self.assertTrue(stale.reserve_seats(2))
+        self.assertEqual(stale.available_seats, 0)
+
+    def test_reserve_many_is_all_or_nothing(self):
+        other = PerformanceSchedule.objects.create(
+            performance=self.performance,
+            theater=self.theater,
+            hall=self.hall,
+            date_time=timezone.now() + timedelta(days=2),
+            available_seats=3,
+            price=Decimal('1000.00')
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(PerformanceSchedule.objects.reserve_many({self.schedule.pk: 10, other.pk: 3}))
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(PerformanceSchedule.objects.reserve_many({self.schedule.pk: 10, other.pk: 1}))
+
+        self.schedule.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.schedule.available_seats, 90)
+        self.assertEqual(other.available_seats, 0)
+
+        PerformanceSchedule.objects.release_many({self.schedule.pk: 10, other.pk: 3})
+        self.schedule.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.schedule.available_seats, 100)
+        self.assertEqual(other.available_seats, 3)
+
+
+@local_services
 class OrderModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -217,6 +347,145 @@ class OrderModelTest(TestCase):
         self.assertFalse(result)
 
 
+@local_services
+class OrderTransitionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='bulkcancel',
+            email='bulkcancel@example.com',
+            password='bulkcancelpass123'
+        )
+        cls.performance = Performance.objects.create(
+            name="Дядя Ваня",
+            description="Пьеса А.П. Чехова",
+            duration_time=timedelta(hours=3)
+        )
+        cls.schedules = [
+            PerformanceSchedule.objects.create(
+                performance=cls.performance,
+                date_time=timezone.now() + timedelta(days=days),
+                available_seats=100,
+                price=Decimal('1000.00')
+            )
+            for days in (1, 2)
+        ]
+
+    def create_orders(self, count, status=OrderStatus.PENDING):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.user,
+                status=status,
+                total_amount=Decimal('3000.00'),
+                customer_name='Соня Серебрякова',
+                customer_email='sonya@example.com'
+            )
+            # По два билета на первый показ и один на второй
+            OrderItem.objects.create(order=order, performance_schedule=self.schedules[0], quantity=2,
+                                     price_per_unit=Decimal('1000.00'))
+            OrderItem.objects.create(order=order, performance_schedule=self.schedules[1], quantity=1,
+                                     price_per_unit=Decimal('1000.00'))
+            orders.append(order)
+        return orders
+
+    def available_seats(self):
+        return [
+            schedule.available_seats
+            for schedule in PerformanceSchedule.objects.filter(pk__in=[s.pk for s in self.schedules]).order_by('pk')
+        ]
+
+    def test_cancels_orders_and_returns_seats_once(self):
+        pending = self.create_orders(3)
+        self.create_orders(2, status=OrderStatus.CANCELLED)
+        cancelled = cancel_orders(Order.objects.all())
+        self.assertEqual(sorted(cancelled), [order.pk for order in pending])
+        self.assertEqual(self.available_seats(), [106, 103])
+        self.assertFalse(Order.objects.exclude(status=OrderStatus.CANCELLED).exists())
+        # Повторная отмена ничего не возвращает
+        self.assertEqual(cancel_orders(Order.objects.all()), [])
+        self.assertEqual(self.available_seats(), [106, 103])
+
+    def test_query_count_does_not_grow_with_orders(self):
+        counts = []
+        for count in (2, 20):
+            self.create_orders(count)
+            with CaptureQueriesContext(connection) as queries:
+                cancel_orders(Order.objects.exclude(status=OrderStatus.CANCELLED))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(self.available_seats(), [144, 122])
+
+    def test_failure_rolls_back_seats_and_statuses(self):
+        self.create_orders(3)
+        with mock.patch('perfomance.orders.seatmap.free_item_seats', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                cancel_orders(Order.objects.all())
+        self.assertEqual(self.available_seats(), [100, 100])
+        self.assertFalse(Order.objects.filter(status=OrderStatus.CANCELLED).exists())
+
+    def test_restore_reserves_seats_with_fixed_query_count(self):
+        counts = []
+        for count in (2, 20):
+            self.create_orders(count, status=OrderStatus.CANCELLED)
+            with CaptureQueriesContext(connection) as queries:
+                restored = transition(Order.objects.filter(status=OrderStatus.CANCELLED), OrderStatus.CONFIRMED)
+            self.assertEqual(len(restored), count)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(self.available_seats(), [56, 78])
+
+    def test_restore_without_seats_changes_nothing(self):
+        self.create_orders(60, status=OrderStatus.CANCELLED)
+        with self.assertRaisesMessage(TransitionError, "Доступно: 100, требуется: 120"):
+            transition(Order.objects.all(), OrderStatus.PENDING)
+        self.assertEqual(self.available_seats(), [100, 100])
+        self.assertEqual(Order.objects.filter(status=OrderStatus.CANCELLED).count(), 60)
+
+    def test_forbidden_transitions_are_skipped(self):
+        completed = self.create_orders(2, status=OrderStatus.COMPLETED)
+        pending = self.create_orders(1)
+        self.assertEqual(cancel_orders(Order.objects.all()), [pending[0].pk])
+        self.assertEqual(Order.objects.filter(status=OrderStatus.COMPLETED).count(), len(completed))
+        self.assertEqual(self.available_seats(), [102, 101])
+        with self.assertRaises(TransitionError):
+            check_transition(OrderStatus.COMPLETED, OrderStatus.CANCELLED)
+        check_transition(OrderStatus.CANCELLED, OrderStatus.CONFIRMED)
+
+    def test_one_event_per_batch(self):
+        confirmed = self.create_orders(2, status=OrderStatus.CONFIRMED)
+        pending = self.create_orders(3)
+        events = []
+
+        def receiver(sender, **kwargs):
+            events.append(kwargs)
+
+        order_status_changed.connect(receiver)
+        self.addCleanup(order_status_changed.disconnect, receiver)
+        with mock.patch('perfomance.signals.send_order_status_emails.apply_async') as send_emails:
+            with self.captureOnCommitCallbacks(execute=True):
+                cancel_orders(Order.objects.all())
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['status'], OrderStatus.CANCELLED)
+        self.assertEqual(events[0]['previous'], {
+            OrderStatus.CONFIRMED: [order.pk for order in confirmed],
+            OrderStatus.PENDING: [order.pk for order in pending],
+        })
+        send_emails.assert_called_once_with((events[0]['order_ids'], OrderStatus.CANCELLED), retry=False)
+
+    def test_unreachable_broker_does_not_fail_transition(self):
+        """A broker error while queueing notifications is logged, the saved transition stands"""
+        orders = self.create_orders(2)
+        error = OperationalError('Error 111 connecting to redis:6379. Connection refused.')
+        with mock.patch('perfomance.signals.send_order_status_emails.apply_async', side_effect=error), \
+                self.assertLogs('perfomance.signals', level='ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                cancelled = cancel_orders(Order.objects.all())
+        self.assertEqual(cancelled, [order.pk for order in orders])
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {OrderStatus.CANCELLED})
+
+
+@local_services
 class CartItemModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -259,4 +528,110 @@ class CartItemModelTest(TestCase):
 
     def test_cart_item_total_price(self):
         expected_total = Decimal('3600.00')  # 2 tickets * 1800
-        self.assertEqual(self.cart_item.total_price, expected_total) 
\ No newline at end of file
+        self.assertEqual(self.cart_item.total_price, expected_total) 
+
+
+@local_services
+@skipUnless(fakeredis, 'fakeredis and lupa are required')
+class HotInventoryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.performance = Performance.objects.create(
+            name="Щелкунчик",
+            description="Балет П.И. Чайковского",
+            duration_time=timedelta(hours=2)
+        )
+        cls.hot = PerformanceSchedule.objects.create(
+            performance=cls.performance,
+            date_time=timezone.now() + timedelta(days=1),
+            available_seats=10,
+            price=Decimal('3000.00')
+        )
+        cls.cold = PerformanceSchedule.objects.create(
+            performance=cls.performance,
+            date_time=timezone.now() + timedelta(days=2),
+            available_seats=5,
+            price=Decimal('2000.00')
+        )
+
+    def setUp(self):
+        self.client_context = inventory.using_client(fakeredis.FakeRedis())
+        self.redis = self.client_context.__enter__()
+        self.addCleanup(self.client_context.__exit__, None, None, None)
+        self.assertEqual(inventory.enable([self.hot.pk]), 1)
+
+    def db_seats(self, schedule):
+        schedule.refresh_from_db()
+        return schedule.available_seats, schedule.held_seats
+
+    def test_hot_schedule_is_reserved_in_redis(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(PerformanceSchedule.objects.reserve_many({self.hot.pk: 4}))
+            self.assertTrue(PerformanceSchedule.objects.hold_many({self.hot.pk: 6}))
+            self.assertFalse(PerformanceSchedule.objects.reserve_many({self.hot.pk: 1}))
+        # Hot schedules never touch the database row
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual(inventory.seats(self.hot.pk), (0, 6))
+        self.assertEqual(self.db_seats(self.hot), (10, 0))
+
+        self.assertEqual(inventory.flush(), 1)
+        self.assertEqual(self.db_seats(self.hot), (0, 6))
+        self.assertEqual(inventory.flush(), 0)
+        self.assertEqual(self.db_seats(self.hot), (0, 6))
+
+    def test_reserve_seats_reports_redis_count(self):
+        self.assertTrue(self.hot.reserve_seats(7))
+        self.assertEqual(self.hot.available_seats, 3)
+        self.assertFalse(self.hot.reserve_seats(4))
+
+    def test_mixed_reservation_is_all_or_nothing(self):
+        # Не хватает мест в "холодном" расписании - списание в Redis отменяется
+        self.assertFalse(PerformanceSchedule.objects.reserve_many({self.hot.pk: 2, self.cold.pk: 6}))
+        self.assertEqual(inventory.seats(self.hot.pk), (10, 0))
+        self.assertEqual(self.db_seats(self.cold), (5, 0))
+
+        self.assertTrue(PerformanceSchedule.objects.reserve_many({self.hot.pk: 2, self.cold.pk: 5}))
+        self.assertEqual(inventory.seats(self.hot.pk), (8, 0))
+        self.assertEqual(self.db_seats(self.cold), (0, 0))
+
+    def test_compensating_reverts_redis_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with inventory.compensating():
+                PerformanceSchedule.objects.reserve_many({self.hot.pk: 3})
+                raise RuntimeError
+        self.assertEqual(inventory.seats(self.hot.pk), (10, 0))
+
+    def test_flush_applies_changes_once_after_crash(self):
+        PerformanceSchedule.objects.reserve_many({self.hot.pk: 3})
+        # Процесс упал после записи в базу, но до подтверждения в Redis
+        with mock.patch.object(inventory, 'ACK_FLUSH_SCRIPT', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                inventory.flush()
+        self.assertEqual(self.db_seats(self.hot), (7, 0))
+
+        PerformanceSchedule.objects.reserve_many({self.hot.pk: 2})
+        self.assertEqual(inventory.flush(), 1)
+        self.assertEqual(self.db_seats(self.hot), (7, 0))
+        self.assertEqual(inventory.flush(), 1)
+        self.assertEqual(self.db_seats(self.hot), (5, 0))
+        self.assertEqual(self.redis.scard(inventory.DIRTY_KEY), 0)
+
+    def test_reconcile_reloads_lost_redis_state(self):
+        PerformanceSchedule.objects.reserve_many({self.hot.pk: 4})
+        inventory.flush()
+        self.redis.flushall()
+
+        self.assertEqual(inventory.reconcile(), (1, 0))
+        self.assertEqual(inventory.seats(self.hot.pk), (6, 0))
+        self.assertTrue(PerformanceSchedule.objects.reserve_many({self.hot.pk: 6}))
+        self.assertFalse(PerformanceSchedule.objects.reserve_many({self.hot.pk: 1}))
+
+    def test_disable_returns_counts_to_database(self):
+        PerformanceSchedule.objects.reserve_many({self.hot.pk: 4})
+        self.assertEqual(inventory.disable([self.hot.pk]), [])
+        self.assertIsNone(inventory.seats(self.hot.pk))
+        self.assertEqual(self.db_seats(self.hot), (6, 0))
+        self.assertFalse(self.hot.hot_inventory)
+
+        self.assertTrue(PerformanceSchedule.objects.reserve_many({self.hot.pk: 6}))
+        self.assertEqual(self.db_seats(self.hot), (0, 0))
@@ -1,3 +1,5 @@
+from unittest import skipUnless
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
@@ -8,21 +10,33 @@ from rest_framework import serializers
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from perfomance.models import (
     Performance, PerformanceCategory, PerformanceSchedule, 
-    Review, CartItem, Order, OrderStatus, OrderItem
+    Review, Like, CartItem, Order, OrderStatus, OrderItem
 )
 from perfomance.serializers import (
     PerformanceSerializer, PerformanceBriefSerializer, ReviewSerializer,
     PerformanceScheduleSerializer, CartItemSerializer, OrderSerializer,
     OrderCreateSerializer, CategoryWithPerformancesSerializer
 )
+from perfomance import inventory
+from perfomance.holds import hold_for_cart_item
+from perfomance.tests import local_services
 from main.models import Theater, Hall
 from users.models import User
 
+try:
+    import fakeredis
+    import lupa  # noqa: F401
+except ImportError:
+    fakeredis = None
+
 User = get_user_model()
 
+@local_services
 class OrderCreateSerializerTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -116,6 +130,89 @@ class OrderCreateSerializerTest(TestCase):
         self.assertFalse(serializer.is_valid())
         self.assertIn('customer_phone', serializer.errors)
 
+    def _checkout_serializer(self, user):
+        request = APIRequestFactory().post('/')
+        request.user = user
+        return OrderCreateSerializer(data={
+            'customer_name': 'Анна Иванова',
+            'customer_email': 'anna@example.com',
+            'customer_phone': '+7-999-123-45-67',
+            'payment_method': 'Банковская карта'
+        }, context={'request': request})
+
+    def _add_schedules(self, user, count, seats=10):
+        schedules = []
+        for day in range(count):
+            schedule = PerformanceSchedule.objects.create(
+                performance=self.performance,
+                theater=self.theater,
+                hall=self.hall,
+                date_time=timezone.now() + timedelta(days=10 + day),
+                available_seats=seats,
+                price=Decimal('1000.00')
+            )
+            CartItem.objects.create(user=user, performance_schedule=schedule, quantity=2)
+            schedules.append(schedule)
+        return schedules
+
+    def test_order_create_queries_do_not_grow_with_cart(self):
+        """Checkout runs the same number of queries for one or many cart items"""
+        counts = []
+        for size in (1, 5):
+            user = User.objects.create_user(username=f'bulk{size}', email=f'bulk{size}@example.com', password='pass12345')
+            self._add_schedules(user, size)
+            serializer = self._checkout_serializer(user)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(serializer.is_valid(), serializer.errors)
+                order = serializer.save()
+            counts.append(len(queries))
+            self.assertEqual(order.items.count(), size)
+            self.assertEqual(order.total_amount, Decimal('2000.00') * size)
+            self.assertFalse(CartItem.objects.filter(user=user).exists())
+        self.assertEqual(counts[0], counts[1])
+
+    def test_order_create_rolls_back_when_seats_run_out(self):
+        """Seats sold after validation abort the whole checkout"""
+        user = User.objects.create_user(username='latebuyer', email='late@example.com', password='pass12345')
+        first, second = self._add_schedules(user, 2)
+        serializer = self._checkout_serializer(user)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        # Другой покупатель успел выкупить места второго показа
+        PerformanceSchedule.objects.filter(pk=second.pk).update(available_seats=1)
+
+        with self.assertRaises(serializers.ValidationError):
+            serializer.save()
+
+        first.refresh_from_db()
+        self.assertEqual(first.available_seats, 10)
+        self.assertFalse(Order.objects.filter(user=user).exists())
+        self.assertEqual(CartItem.objects.filter(user=user).count(), 2)
+
+    @skipUnless(fakeredis, 'fakeredis and lupa are required')
+    def test_order_create_reverts_redis_inventory_on_rollback(self):
+        """Seats taken from Redis are returned when checkout is rolled back"""
+        user = User.objects.create_user(username='hotbuyer', email='hot@example.com', password='pass12345')
+        hot, cold = self._add_schedules(user, 2)
+        with inventory.using_client(fakeredis.FakeRedis()):
+            inventory.enable([hot.pk])
+            # Места "горячего" показа удержаны в корзине и продаются первыми
+            self.assertTrue(hold_for_cart_item(CartItem.objects.get(user=user, performance_schedule=hot), 2))
+            serializer = self._checkout_serializer(user)
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            PerformanceSchedule.objects.filter(pk=cold.pk).update(available_seats=1)
+
+            with self.assertRaises(serializers.ValidationError):
+                serializer.save()
+            self.assertEqual(inventory.seats(hot.pk), (8, 2))
+
+            PerformanceSchedule.objects.filter(pk=cold.pk).update(available_seats=10)
+            serializer = self._checkout_serializer(user)
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            serializer.save()
+            self.assertEqual(inventory.seats(hot.pk), (8, 0))
+
+@local_services
 class PerformanceSerializerTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -212,6 +309,99 @@ class PerformanceSerializerTest(TestCase):
         # Check formatting
         self.assertEqual(data['min_price'], "3000.00 ₽")
 
+@local_services
+class PerformanceReadModelTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = PerformanceCategory.objects.create(name="Драма")
+        cls.theater = Theater.objects.create(name="Малый театр", address="Москва", description="")
+        cls.hall = Hall.objects.create(number_hall=1, theater=cls.theater)
+        cls.user = User.objects.create_user(
+            username='liker',
+            email='liker@example.com',
+            password='likerpass123'
+        )
+        cls.other_user = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            password='authorpass123'
+        )
+
+    def _create_performances(self, count):
+        for index in range(count):
+            performance = Performance.objects.create(
+                name=f"Спектакль {index}",
+                description="Описание",
+                duration_time=timedelta(hours=2),
+                category=self.category
+            )
+            for days, price in ((-1, '500.00'), (2, '1000.00'), (5, '2000.00')):
+                PerformanceSchedule.objects.create(
+                    performance=performance,
+                    theater=self.theater,
+                    hall=self.hall,
+                    date_time=timezone.now() + timedelta(days=days),
+                    available_seats=50,
+                    price=Decimal(price)
+                )
+            for offset, author in enumerate((self.user, self.other_user)):
+                review = Review.objects.create(
+                    user=author,
+                    performance=performance,
+                    text="Отзыв",
+                    created_at=timezone.now() - timedelta(minutes=offset)
+                )
+                Like.objects.create(user=self.user, review=review)
+
+    def _serialize(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        performances = Performance.objects.with_catalog_stats(self.user)
+        return PerformanceSerializer(performances, many=True, context={'request': request}).data
+
+    def _count_queries(self, func):
+        # silk добавляет EXPLAIN к каждому запросу, их не учитываем
+        with CaptureQueriesContext(connection) as context:
+            result = func()
+        queries = [q for q in context.captured_queries if not q['sql'].startswith('EXPLAIN')]
+        return len(queries), result
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        """Performance list serialization runs a constant number of queries"""
+        self._create_performances(2)
+        queries, _ = self._count_queries(self._serialize)
+        self.assertEqual(queries, 2)
+
+        self._create_performances(10)
+        queries, data = self._count_queries(self._serialize)
+        self.assertEqual(queries, 2)
+        self.assertEqual(len(data), 12)
+
+    def test_annotated_output_matches_per_row_output(self):
+        """Read model produces the same JSON as the per-row serializer methods"""
+        self._create_performances(1)
+        performance = Performance.objects.get()
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+
+        expected = PerformanceSerializer(performance, context={'request': request}).data
+        annotated = self._serialize()[0]
+
+        self.assertEqual(annotated, expected)
+        self.assertEqual(annotated['upcoming_shows_count'], 2)
+        self.assertEqual(annotated['average_price'], "1166.67 ₽")
+        self.assertEqual(annotated['nearest_show']['price'], "1000.00 ₽")
+        self.assertEqual(annotated['nearest_show']['theater'], "Малый театр")
+        self.assertEqual(annotated['reviews'][0]['likes_count'], 1)
+        self.assertTrue(annotated['reviews'][0]['is_liked_by_current_user'])
+
+        brief = PerformanceBriefSerializer(
+            Performance.objects.with_catalog_stats(with_reviews=False).get()
+        ).data
+        self.assertEqual(brief, PerformanceBriefSerializer(performance).data)
+
+
+@local_services
 class ReviewSerializerTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -280,6 +470,7 @@ class ReviewSerializerTest(TestCase):
         serializer = ReviewSerializer(instance=self.review, context={'request': request})
         self.assertFalse(serializer.data['can_edit'])
 
+@local_services
 class CartItemSerializerTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -1,20 +1,46 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.forms.models import inlineformset_factory
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from decimal import Decimal
 import json
+from urllib.parse import unquote
+from io import StringIO
+from unittest import mock, skipUnless
 
 from perfomance.models import (
     Performance, PerformanceCategory, PerformanceSchedule,
-    Review, Order, OrderStatus, CartItem
+    Review, Like, Counter, Order, OrderStatus, CartItem, OrderItem, IdempotencyKey
 )
-from main.models import Theater, Hall
+from perfomance import holds, seatmap, suggest as suggest_index, waiting_room
+from perfomance.cache import bump_version
+from perfomance.pagination import ReviewPagination
+from perfomance.serializers import OrderCreateSerializer
+from perfomance.idempotency import request_fingerprint
+from perfomance.tasks import purge_idempotency_keys, reclaim_seat_holds, update_performance_stats
+from perfomance.tests import local_services
+from main.admin import HallRowFormSet
+from main.models import Theater, Hall, HallRow, SeatZone
 from users.models import User
 
+try:
+    import fakeredis
+    import lupa  # noqa: F401 - fakeredis выполняет Lua-скрипты через lupa
+except ImportError:
+    fakeredis = None
 
+
+@local_services
 class PerformanceAPITest(APITestCase):
     @classmethod
     def setUpTestData(cls):
@@ -103,6 +129,862 @@ class PerformanceAPITest(APITestCase):
         self.assertEqual(response.data[0]['name'], self.performance1.name)
 
 
+@local_services
+class ReviewAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reviewer',
+            email='reviewer@example.com',
+            password='reviewerpass123'
+        )
+        cls.other_user = User.objects.create_user(
+            username='reader',
+            email='reader@example.com',
+            password='readerpass123'
+        )
+        cls.performance = Performance.objects.create(
+            name="Чайка",
+            description="Комедия А.П. Чехова",
+            duration_time=timedelta(hours=2, minutes=40)
+        )
+        cls.detail_url = reverse('performance_detail', kwargs={'pk': cls.performance.id})
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _create_reviews(self, count):
+        for number in range(count):
+            review = Review.objects.create(
+                user=self.other_user, performance=self.performance, text=f"Отзыв {number}"
+            )
+            Like.objects.create(user=self.user, review=review)
+            Like.objects.create(user=self.other_user, review=review)
+
+    def _selects(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        # silk добавляет EXPLAIN и записывает каждый запрос в свои таблицы
+        selects = [
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('SELECT') and 'silk_' not in q['sql']
+        ]
+        return response, len(selects)
+
+    def test_detail_query_count_does_not_depend_on_reviews(self):
+        """Performance detail serializes reviews with their likes in a constant number of queries"""
+        self._create_reviews(2)
+        response, few = self._selects('get', self.detail_url)
+        self.assertEqual(len(response.data['reviews']), 2)
+
+        self._create_reviews(20)
+        response, many = self._selects('get', self.detail_url)
+        self.assertEqual(len(response.data['reviews']), 22)
+        self.assertEqual(many, few)
+        review = response.data['reviews'][0]
+        self.assertEqual(review['user'], str(self.other_user))
+        self.assertEqual(review['likes_count'], 2)
+        self.assertTrue(review['is_liked_by_current_user'])
+
+    def test_add_review_returns_annotated_review(self):
+        """Creating a review answers with its author and likes without per-field queries"""
+        url = reverse('add_review', kwargs={'pk': self.performance.id})
+        response, selects = self._selects('post', url, {'text': "Прекрасная постановка"})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['user'], str(self.user))
+        self.assertEqual(response.data['likes_count'], 0)
+        self.assertFalse(response.data['is_liked_by_current_user'])
+        self.assertTrue(response.data['can_edit'])
+        # Спектакль и созданный отзыв с аннотациями
+        self.assertEqual(selects, 2)
+
+    def test_update_review_returns_annotated_review(self):
+        """Updating a review loads the author and likes together with the review"""
+        review = Review.objects.create(user=self.user, performance=self.performance, text="Черновик")
+        Like.objects.create(user=self.other_user, review=review)
+        url = reverse('update_review', kwargs={'pk': review.id})
+
+        response, selects = self._selects('patch', url, {'text': "Исправленный отзыв"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['text'], "Исправленный отзыв")
+        self.assertEqual(response.data['likes_count'], 1)
+        self.assertFalse(response.data['is_liked_by_current_user'])
+        # Отзыв с автором и лайками и прежняя оценка для счетчиков спектакля
+        self.assertEqual(selects, 2)
+
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.patch(url, {'text': "Чужая правка"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_reviews_endpoint_paginates_by_recency_and_likes(self):
+        """Reviews endpoint pages through reviews newest first or by the likes counter"""
+        reviews = [
+            Review.objects.create(
+                user=self.other_user, performance=self.performance, text=f"Отзыв {number}",
+                created_at=timezone.now() - timedelta(hours=number)
+            )
+            for number in range(5)
+        ]
+        for review, likers in ((reviews[3], (self.user, self.other_user)), (reviews[1], (self.user,))):
+            for liker in likers:
+                Like.objects.create(user=liker, review=review)
+        url = reverse('performance-reviews', kwargs={'pk': self.performance.id})
+
+        seen = []
+        response, selects = self._selects('get', url, {'page_size': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [review['id'] for review in response.data['results']]
+            if not response.data['next']:
+                break
+            response, next_selects = self._selects('get', response.data['next'])
+            self.assertEqual(next_selects, selects)
+        self.assertEqual(seen, [review.id for review in reviews])
+
+        response = self.client.get(url, {'sort': 'likes', 'page_size': 2})
+        self.assertEqual([review['id'] for review in response.data['results']], [reviews[3].id, reviews[1].id])
+        self.assertEqual(response.data['results'][0]['likes_count'], 2)
+        self.assertTrue(response.data['results'][0]['is_liked_by_current_user'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([review['id'] for review in response.data['results']], [reviews[4].id, reviews[2].id])
+
+        response = self.client.get(url, {'sort': 'rating'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('performance-reviews', kwargs={'pk': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_likes_counter_follows_likes(self):
+        """Review.likes_count changes with likes and can be recounted from the likes table"""
+        review = Review.objects.create(user=self.other_user, performance=self.performance, text="Отзыв")
+        like = Like.objects.create(user=self.user, review=review)
+        Like.objects.create(user=self.other_user, review=review)
+        review.refresh_from_db()
+        self.assertEqual(review.likes_count, 2)
+
+        like.delete()
+        review.refresh_from_db()
+        self.assertEqual(review.likes_count, 1)
+
+        Review.objects.filter(pk=review.pk).update(likes_count=7)
+        Review.objects.filter(pk=review.pk).recount_likes()
+        review.refresh_from_db()
+        self.assertEqual(review.likes_count, 1)
+
+    def test_like_endpoint_is_idempotent(self):
+        """Liking twice keeps one like, unliking twice removes it once, counters follow"""
+        review = Review.objects.create(user=self.other_user, performance=self.performance, text="Отзыв")
+        url = reverse('review-like', kwargs={'pk': review.id})
+
+        for _ in range(2):
+            response = self.client.post(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data, {'liked': True, 'likes_count': 1})
+        self.assertEqual(Like.objects.filter(review=review).count(), 1)
+        self.assertEqual(Counter.objects.value(Counter.LIKES), 1)
+
+        self.client.force_authenticate(user=self.other_user)
+        self.assertEqual(self.client.post(url).data['likes_count'], 2)
+        self.assertEqual(Counter.objects.value(Counter.LIKES), 2)
+
+        for _ in range(2):
+            response = self.client.delete(url)
+            self.assertEqual(response.data, {'liked': False, 'likes_count': 1})
+        self.assertEqual(Counter.objects.value(Counter.LIKES), 1)
+
+        # Лайки удаленного отзыва уходят из общего счетчика
+        review.delete()
+        self.assertEqual(Counter.objects.value(Counter.LIKES), 0)
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_duplicate_like_is_rejected_by_database(self):
+        """The (user, review) unique constraint rejects a second like"""
+        review = Review.objects.create(user=self.other_user, performance=self.performance, text="Отзыв")
+        Like.objects.create(user=self.user, review=review)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Like.objects.create(user=self.user, review=review)
+        review.refresh_from_db()
+        self.assertEqual(review.likes_count, 1)
+
+    def test_catalog_stats_read_likes_from_counter(self):
+        """Catalog stats count reviews once and take likes from the global counter"""
+        cache.clear()
+        self._create_reviews(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('catalog-stats'))
+        self.assertEqual(response.data['reviews_stats'], {'total': 3, 'likes': 6})
+        self.assertFalse(any('"perfomance_like"' in q['sql'] for q in queries.captured_queries))
+
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(Counter.objects.value(Counter.LIKES), 6)
+
+    def test_rating_is_read_from_performance_counters(self):
+        """Review ratings feed the performance rating, sorting and the featured top list"""
+        url = reverse('add_review', kwargs={'pk': self.performance.id})
+        response = self.client.post(url, {'text': "Оценка вне шкалы", 'rating': 6}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for rating in (5, 4):
+            response = self.client.post(url, {'text': "Отзыв с оценкой", 'rating': rating}, format='json')
+            self.assertEqual(response.data['rating'], rating)
+        self.client.post(url, {'text': "Отзыв без оценки"}, format='json')
+        unrated = Performance.objects.create(
+            name="Иванов", description="Драма А.П. Чехова", duration_time=timedelta(hours=3)
+        )
+
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['rating'], 4.5)
+        self.assertEqual(response.data['rating_count'], 2)
+
+        response = self.client.get(reverse('performance-filter'), {'ordering': '-average_rating'})
+        self.assertEqual([item['id'] for item in response.data], [self.performance.id, unrated.id])
+        self.assertIsNone(response.data[1]['rating'])
+
+        cache.clear()
+        response = self.client.get(reverse('catalog-featured'))
+        self.assertEqual([item['id'] for item in response.data['top_rated_performances']], [self.performance.id])
+        self.assertEqual(response.data['popular_performances'][0]['id'], self.performance.id)
+
+        self.assertEqual(update_performance_stats(), "Обновлена статистика для 2 спектаклей")
+
+    def test_detail_embeds_first_page_of_reviews(self):
+        """With reviews_page=1 the performance carries the first page, the total and the next page link"""
+        self._create_reviews(ReviewPagination.page_size + 3)
+        response = self.client.get(self.detail_url)
+        self.assertEqual(len(response.data['reviews']), ReviewPagination.page_size + 3)
+        self.assertNotIn('reviews_next', response.data)
+
+        response, selects = self._selects('get', self.detail_url, {'reviews_page': 1})
+        self.assertEqual(len(response.data['reviews']), ReviewPagination.page_size)
+        self.assertEqual(response.data['reviews_count'], ReviewPagination.page_size + 3)
+        embedded = [review['id'] for review in response.data['reviews']]
+
+        response = self.client.get(response.data['reviews_next'])
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNone(response.data['next'])
+        rest = [review['id'] for review in response.data['results']]
+        expected = list(Review.objects.filter(performance=self.performance).order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(embedded + rest, expected)
+
+        # Первая страница для списка спектаклей - тем же числом запросов
+        response, list_selects = self._selects('get', reverse('performance-list'), {'reviews_page': 1})
+        self.assertEqual(len(response.data[0]['reviews']), ReviewPagination.page_size)
+        self.assertEqual(list_selects, selects)
+
+
+@local_services
+class KeysetPaginationAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = PerformanceCategory.objects.create(name="Мюзикл")
+        cls.theater = Theater.objects.create(name="Театр Оперетты", address="Москва")
+        cls.hall = Hall.objects.create(number_hall=1, theater=cls.theater)
+        created_at = timezone.now()
+        cls.performances = []
+        for index in range(7):
+            # Две пары спектаклей с одинаковой датой создания проверяют сортировку по id
+            performance = Performance.objects.create(
+                name=f"Мюзикл {index % 3}",
+                description="Описание",
+                duration_time=timedelta(hours=2),
+                category=cls.category,
+                created_at=created_at - timedelta(days=index // 2)
+            )
+            cls.performances.append(performance)
+            PerformanceSchedule.objects.create(
+                performance=performance,
+                theater=cls.theater,
+                hall=cls.hall,
+                date_time=created_at + timedelta(days=index % 2),
+                available_seats=10,
+                price=Decimal('1000.00')
+            )
+
+    def _collect(self, url):
+        ids = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_legacy_list_without_pagination_params(self):
+        """Compatibility mode keeps the old unpaginated list"""
+        response = self.client.get(reverse('performance-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 7)
+
+    def test_cursor_pages_cover_list_in_order(self):
+        """Following next links returns every performance exactly once"""
+        ids, pages = self._collect(f"{reverse('performance-list')}?page_size=3")
+        expected = list(
+            Performance.objects.order_by('-created_at', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_cursor_pagination_uses_view_ordering(self):
+        """Filtered list is paginated by its (name, id) ordering"""
+        ids, _ = self._collect(f"{reverse('performance-filter')}?page_size=2")
+        expected = list(Performance.objects.order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_returns_previous_page(self):
+        """Previous cursor walks back to the same page"""
+        url = f"{reverse('catalog-search')}?page_size=3"
+        first = self.client.get(url).data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(
+            [item['id'] for item in back['results']],
+            [item['id'] for item in first['results']]
+        )
+        self.assertIsNone(first['previous'])
+
+    def test_schedules_paginated_by_date(self):
+        """Performance schedules are paginated by (date_time, id)"""
+        url = reverse('performance-schedules', kwargs={'pk': self.performances[0].id})
+        response = self.client.get(f"{url}?page_size=1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    @override_settings(PAGINATION_COMPAT_MODE=False)
+    def test_other_lists_are_not_paginated(self):
+        """Views without a pagination class keep returning plain lists"""
+        response = self.client.get(reverse('performance-last'), {'page_size': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+
+    def test_invalid_cursor(self):
+        """Malformed cursor is rejected"""
+        response = self.client.get(f"{reverse('performance-list')}?cursor=broken")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(PAGINATION_COMPAT_MODE=False)
+    def test_paginated_by_default_without_compat_mode(self):
+        """With compatibility mode off every request is paginated"""
+        response = self.client.get(reverse('performance-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIsNone(response.data['next'])
+
+
+@local_services
+class FullTextSearchAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chekhov = Performance.objects.create(
+            name="Вишнёвый сад",
+            description="Комедия о продаже имения",
+            duration_time=timedelta(hours=3)
+        )
+        cls.mention = Performance.objects.create(
+            name="Вечер одноактных пьес",
+            description="В программе отрывки из пьесы о вишневом саде и другие сцены",
+            duration_time=timedelta(hours=2)
+        )
+        cls.other = Performance.objects.create(
+            name="Ревизор",
+            description="Комедия Н.В. Гоголя",
+            duration_time=timedelta(hours=2, minutes=40)
+        )
+
+    def test_search_matches_word_forms_and_ranks_by_relevance(self):
+        """Russian word forms match and name matches rank first"""
+        response = self.client.get(reverse('performance-search'), {'q': 'вишневого сада'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in response.data],
+            [self.chekhov.id, self.mention.id]
+        )
+
+    def test_catalog_search_keyword_uses_index(self):
+        """Catalog keyword search is case-insensitive for Cyrillic"""
+        response = self.client.get(reverse('catalog-search'), {'keyword': 'КОМЕДИЯ'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {item['id'] for item in response.data},
+            {self.chekhov.id, self.other.id}
+        )
+
+    def test_index_follows_save_and_delete(self):
+        """Index is kept in sync on Performance save and delete"""
+        self.other.name = "Женитьба"
+        self.other.save()
+        response = self.client.get(reverse('performance-search'), {'q': 'женитьба'})
+        self.assertEqual([item['id'] for item in response.data], [self.other.id])
+
+        self.other.delete()
+        response = self.client.get(reverse('performance-search'), {'q': 'женитьба'})
+        self.assertEqual(response.data, [])
+
+
+@local_services
+class FuzzySearchAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = PerformanceCategory.objects.create(name="Балет", description="Балетные постановки")
+        cls.theater = Theater.objects.create(name="Мариинский театр", address="СПб", description="")
+        cls.nutcracker = Performance.objects.create(
+            name="Щелкунчик",
+            description="Балет Чайковского",
+            duration_time=timedelta(hours=2),
+            category=cls.category
+        )
+        cls.hamlet = Performance.objects.create(
+            name="Гамлет",
+            description="Трагедия Шекспира",
+            duration_time=timedelta(hours=3)
+        )
+        cls.hamlet_long = Performance.objects.create(
+            name="Гамлет, принц датский",
+            description="Трагедия Шекспира",
+            duration_time=timedelta(hours=3, minutes=30)
+        )
+
+    def test_fuzzy_endpoint_tolerates_typos(self):
+        """Misspelled titles are matched and the closest title is suggested"""
+        response = self.client.get(reverse('catalog-fuzzy'), {'q': 'гамлт'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['did_you_mean'], "Гамлет")
+        self.assertEqual(
+            [(item['type'], item['id']) for item in response.data['matches']],
+            [('performance', self.hamlet.id), ('performance', self.hamlet_long.id)]
+        )
+
+    def test_fuzzy_endpoint_covers_categories_and_theaters(self):
+        response = self.client.get(reverse('catalog-fuzzy'), {'q': 'марийнский'})
+        self.assertEqual(response.data['matches'][0]['type'], 'theater')
+        self.assertEqual(response.data['matches'][0]['id'], self.theater.id)
+
+        response = self.client.get(reverse('catalog-fuzzy'), {'q': 'Балед'})
+        self.assertEqual(response.data['matches'][0]['type'], 'category')
+
+    def test_fuzzy_endpoint_requires_query(self):
+        response = self.client.get(reverse('catalog-fuzzy'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('error', response.data)
+
+    def test_index_follows_renames(self):
+        self.client.get(reverse('catalog-fuzzy'), {'q': 'гамлет'})
+        self.hamlet.name = "Отелло"
+        self.hamlet.save()
+        response = self.client.get(reverse('catalog-fuzzy'), {'q': 'отело'})
+        self.assertEqual(response.data['matches'][0]['id'], self.hamlet.id)
+
+    def test_catalog_search_suggests_when_empty(self):
+        """Empty keyword search adds did_you_mean to the paginated response"""
+        response = self.client.get(reverse('catalog-search'), {'keyword': 'щелкунчек', 'page_size': 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['did_you_mean'], "Щелкунчик")
+        self.assertEqual(response.data['fuzzy_matches'][0]['id'], self.nutcracker.id)
+
+    def test_catalog_search_legacy_list_gets_header(self):
+        response = self.client.get(reverse('catalog-search'), {'keyword': 'щелкунчек'})
+        self.assertEqual(response.data, [])
+        self.assertEqual(unquote(response['X-Did-You-Mean']), "Щелкунчик")
+
+
+@local_services
+class SuggestAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='suggestuser', email='suggest@example.com', password='pass12345')
+        cls.theater = Theater.objects.create(name="Гоголь-центр", address="Москва")
+        cls.quiet = Performance.objects.create(name="Гамлет", description="", duration_time=timedelta(hours=3))
+        cls.popular = Performance.objects.create(
+            name="Гамлет. Коллаж", description="", duration_time=timedelta(hours=2)
+        )
+        cls.garden = Performance.objects.create(name="Вишнёвый сад", description="", duration_time=timedelta(hours=3))
+        schedule = PerformanceSchedule.objects.create(
+            performance=cls.popular,
+            theater=cls.theater,
+            date_time=timezone.now() + timedelta(days=3),
+            available_seats=50,
+            price=Decimal('1000.00')
+        )
+        order = Order.objects.create(
+            user=cls.user,
+            total_amount=Decimal('3000.00'),
+            customer_name='Иван',
+            customer_email='ivan@example.com'
+        )
+        OrderItem.objects.create(
+            order=order, performance_schedule=schedule, quantity=3, price_per_unit=Decimal('1000.00')
+        )
+
+    def setUp(self):
+        suggest_index.invalidate_index()
+
+    def _suggest(self, query):
+        response = self.client.get(reverse('catalog-suggest'), {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item['type'], item['id']) for item in response.data['suggestions']]
+
+    def test_prefix_ranked_by_popularity(self):
+        """Titles starting with the prefix are ordered by tickets sold"""
+        self.assertEqual(
+            self._suggest('Га'),
+            [('performance', self.popular.id), ('performance', self.quiet.id)]
+        )
+
+    def test_prefix_matches_any_word(self):
+        self.assertEqual(self._suggest('сад'), [('performance', self.garden.id)])
+        self.assertEqual(self._suggest('цен'), [('theater', self.theater.id)])
+        self.assertEqual(self._suggest(''), [])
+
+    def test_index_updated_incrementally_after_commit(self):
+        self._suggest('г')
+        with self.captureOnCommitCallbacks(execute=True):
+            created = Performance.objects.create(name="Гроза", description="", duration_time=timedelta(hours=2))
+            self.quiet.name = "Отелло"
+            self.quiet.save()
+            self.garden.delete()
+        self.assertEqual(
+            self._suggest('г'),
+            [('performance', self.popular.id), ('theater', self.theater.id), ('performance', created.id)]
+        )
+        self.assertEqual(self._suggest('отел'), [('performance', self.quiet.id)])
+        self.assertEqual(self._suggest('вишн'), [])
+
+    def test_bulk_changes_rebuild_index_from_its_entries(self):
+        """Many pending changes are applied by one rebuild instead of point inserts"""
+        self._suggest('г')
+        with mock.patch('perfomance.suggest.POINT_UPDATE_LIMIT', 1), \
+                mock.patch.object(suggest_index.PrefixIndex, 'upsert') as upsert, \
+                mock.patch('perfomance.suggest.load_entries') as load_entries:
+            with self.captureOnCommitCallbacks(execute=True):
+                created = Performance.objects.create(name="Гроза", description="", duration_time=timedelta(hours=2))
+                self.quiet.name = "Отелло"
+                self.quiet.save()
+                self.garden.delete()
+            self.assertEqual(
+                self._suggest('г'),
+                [('performance', self.popular.id), ('theater', self.theater.id), ('performance', created.id)]
+            )
+            self.assertEqual(self._suggest('отел'), [('performance', self.quiet.id)])
+            self.assertEqual(self._suggest('вишн'), [])
+        upsert.assert_not_called()
+        load_entries.assert_not_called()
+
+    def test_version_bump_rebuilds_index(self):
+        """Another worker bumping the cache version forces a rebuild"""
+        index = suggest_index.get_index()
+        bump_version(suggest_index.VERSION_NAME)
+        suggest_index._checked_at = 0.0
+        self.assertIsNot(suggest_index.get_index(), index)
+
+
+@local_services
+class CatalogFacetsAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.drama = PerformanceCategory.objects.create(name="Драма")
+        cls.opera = PerformanceCategory.objects.create(name="Опера")
+        cls.big = Theater.objects.create(name="Большой театр", address="Москва")
+        cls.small = Theater.objects.create(name="Театр.doc", address="Москва")
+        now = timezone.now()
+        cls.seagull = Performance.objects.create(
+            name="Чайка", description="", duration_time=timedelta(hours=2), category=cls.drama
+        )
+        cls.storm = Performance.objects.create(
+            name="Гроза", description="", duration_time=timedelta(hours=2), category=cls.drama
+        )
+        cls.carmen = Performance.objects.create(
+            name="Кармен", description="", duration_time=timedelta(hours=3), category=cls.opera
+        )
+        shows = [
+            (cls.seagull, cls.small, Decimal('800.00'), timedelta(hours=30)),
+            (cls.seagull, cls.small, Decimal('900.00'), timedelta(days=4)),
+            (cls.storm, cls.small, Decimal('2500.00'), timedelta(days=20)),
+            (cls.carmen, cls.big, Decimal('6000.00'), timedelta(days=60)),
+            # Прошедший показ не попадает в фасеты театров, цен и дат
+            (cls.storm, cls.big, Decimal('4000.00'), -timedelta(days=1)),
+        ]
+        for performance, theater, price, offset in shows:
+            PerformanceSchedule.objects.create(
+                performance=performance, theater=theater, date_time=now + offset,
+                available_seats=10, price=price
+            )
+
+    def _facets(self, **params):
+        response = self.client.get(reverse('catalog-search'), {'facets': 1, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_facet_counts(self):
+        data = self._facets()
+        self.assertEqual(len(data['results']), 3)
+        facets = data['facets']
+        self.assertEqual(
+            [(item['name'], item['count']) for item in facets['categories']],
+            [("Драма", 2), ("Опера", 1)]
+        )
+        self.assertEqual(
+            [(item['name'], item['count']) for item in facets['theaters']],
+            [("Театр.doc", 2), ("Большой театр", 1)]
+        )
+        self.assertEqual(
+            {item['key']: item['count'] for item in facets['prices']},
+            {'0-1000': 1, '1000-3000': 1, '3000-5000': 0, '5000+': 1}
+        )
+        self.assertEqual(sum(item['count'] for item in facets['dates']), 3)
+        self.assertEqual({item['key']: item['count'] for item in facets['dates']}['later'], 1)
+
+    def test_facets_follow_current_filter(self):
+        data = self._facets(category=self.drama.id, page_size=10)
+        self.assertIn('next', data)
+        self.assertEqual([item['count'] for item in data['facets']['categories']], [2])
+        self.assertEqual([item['name'] for item in data['facets']['theaters']], ["Театр.doc"])
+
+    def test_facets_are_opt_in(self):
+        response = self.client.get(reverse('catalog-search'))
+        self.assertIsInstance(response.data, list)
+
+    def test_facets_follow_schedule_filters(self):
+        """Theater, price and date facets count only shows matching the schedule filters"""
+        data = self._facets(max_price=1000)
+        self.assertEqual([item['name'] for item in data['results']], ["Чайка"])
+        facets = data['facets']
+        self.assertEqual([(item['name'], item['count']) for item in facets['theaters']], [("Театр.doc", 1)])
+        self.assertEqual(
+            {item['key']: item['count'] for item in facets['prices']},
+            {'0-1000': 1, '1000-3000': 0, '3000-5000': 0, '5000+': 0}
+        )
+        self.assertEqual({item['key']: item['count'] for item in facets['dates']}['month'], 0)
+
+        # Прошедший показ Грозы в Большом театре не учитывается в фасетах
+        data = self._facets(theater="Большой")
+        self.assertEqual([(item['name'], item['count']) for item in data['facets']['theaters']], [("Большой театр", 1)])
+        self.assertEqual({item['key']: item['count'] for item in data['facets']['prices']}['5000+'], 1)
+
+    def test_facets_cost_does_not_depend_on_catalog_size(self):
+        """Facets are counted in SQL by a fixed number of grouped queries"""
+        def count(params):
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(reverse('catalog-search'), params)
+            # silk добавляет EXPLAIN и записывает каждый запрос в свои таблицы
+            return len([
+                q for q in context.captured_queries
+                if not q['sql'].startswith('EXPLAIN') and 'silk_' not in q['sql']
+            ])
+
+        # Категории, театры и один запрос с условными агрегатами по ценам и датам
+        self.assertEqual(count({'facets': 1}), count({}) + 3)
+        # Поиск по keyword для фасетов не повторяется
+        self.assertEqual(count({'facets': 1, 'keyword': "Чайка"}), count({'keyword': "Чайка"}) + 3)
+        for number in range(10):
+            performance = Performance.objects.create(
+                name=f"Спектакль {number}", description="", duration_time=timedelta(hours=1), category=self.opera
+            )
+            PerformanceSchedule.objects.create(
+                performance=performance, theater=self.big, date_time=timezone.now() + timedelta(days=number + 1),
+                available_seats=10, price=Decimal('1500.00')
+            )
+        self.assertEqual(count({'facets': 1}), count({}) + 3)
+        self.assertEqual(self._facets()['facets']['categories'][0], {'id': self.opera.id, 'name': "Опера", 'count': 11})
+
+
+@local_services
+class ScheduleFilterAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.theater = Theater.objects.create(name="Театр Вахтангова", address="Москва")
+        cls.day = timezone.localdate() + timedelta(days=10)
+        evening = timezone.make_aware(datetime.combine(cls.day, time(19, 0)))
+        cls.split = Performance.objects.create(name="Турандот", description="", duration_time=timedelta(hours=2))
+        cls.single = Performance.objects.create(name="Дядя Ваня", description="", duration_time=timedelta(hours=2))
+        # У split дешевый показ без театра и дорогой в театре: ни один показ не подходит целиком
+        PerformanceSchedule.objects.create(
+            performance=cls.split, date_time=evening, available_seats=10, price=Decimal('500.00')
+        )
+        PerformanceSchedule.objects.create(
+            performance=cls.split, theater=cls.theater, date_time=evening,
+            available_seats=10, price=Decimal('5000.00')
+        )
+        PerformanceSchedule.objects.create(
+            performance=cls.single, theater=cls.theater, date_time=evening,
+            available_seats=10, price=Decimal('1500.00')
+        )
+
+    def _ids(self, **params):
+        response = self.client.get(reverse('performance-filter'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data]
+
+    def test_all_conditions_apply_to_one_schedule(self):
+        """Price bounds and theater must be met by the same show"""
+        self.assertEqual(self._ids(min_price=1000, max_price=2000), [self.single.id])
+        self.assertEqual(self._ids(max_price=1000, theater="Вахтангова"), [])
+
+    def test_date_before_includes_whole_day(self):
+        self.assertEqual(
+            sorted(self._ids(date_after=self.day.isoformat(), date_before=self.day.isoformat())),
+            sorted([self.split.id, self.single.id])
+        )
+
+    def test_catalog_search_has_no_duplicates(self):
+        response = self.client.get(reverse('catalog-search'), {'min_seats': 5, 'min_price': 100})
+        self.assertEqual(len(response.data), 2)
+
+
+@local_services
+class ScheduleSearchAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = PerformanceCategory.objects.create(name="Опера и балет")
+        cls.theater = Theater.objects.create(name="Новая опера", address="Москва")
+        cls.other_theater = Theater.objects.create(name="Геликон-опера", address="Москва")
+        cls.hall = Hall.objects.create(number_hall=2, theater=cls.theater)
+        cls.now = timezone.now()
+        cls.tosca = Performance.objects.create(
+            name="Тоска", description="", duration_time=timedelta(hours=3), category=cls.category
+        )
+        cls.aida = Performance.objects.create(name="Аида", description="", duration_time=timedelta(hours=3))
+        cls.shows = []
+        for performance, days, theater, price in [
+            (cls.tosca, 1, cls.theater, '1500.00'),
+            (cls.aida, 2, cls.theater, '2500.00'),
+            (cls.tosca, 3, cls.other_theater, '1800.00'),
+            (cls.aida, 4, cls.theater, '900.00'),
+            (cls.tosca, -1, cls.theater, '1500.00'),
+        ]:
+            cls.shows.append(PerformanceSchedule.objects.create(
+                performance=performance, theater=theater, hall=cls.hall,
+                date_time=cls.now + timedelta(days=days), available_seats=20, price=Decimal(price)
+            ))
+
+    def _collect(self, params):
+        url, ids = reverse('schedule-search'), []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_upcoming_shows_in_date_order(self):
+        """Without date_after only upcoming shows are returned, always paginated"""
+        response = self.client.get(reverse('schedule-search'))
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [show.id for show in self.shows[:4]]
+        )
+        self.assertEqual(response.data['results'][0]['category_name'], "Опера и балет")
+        self.assertIsNone(response.data['results'][1]['category_name'])
+
+    def test_conditions_apply_to_show(self):
+        ids = self._collect({'theater': self.theater.id, 'max_price': 2000, 'page_size': 1})
+        self.assertEqual(ids, [self.shows[0].id, self.shows[3].id])
+
+    def test_group_by_performance_keeps_nearest_show(self):
+        """Grouped pages contain each performance once, even across cursors"""
+        ids = self._collect({'group': 'performance', 'page_size': 1})
+        self.assertEqual(ids, [self.shows[0].id, self.shows[1].id])
+        ids = self._collect({'group': 'performance', 'min_price': 1600, 'page_size': 1})
+        self.assertEqual(ids, [self.shows[1].id, self.shows[2].id])
+
+    def test_single_query_per_page(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('schedule-search'), {'page_size': 10})
+        # silk добавляет EXPLAIN, точки сохранения и запись в свои таблицы
+        selects = [
+            q for q in context.captured_queries
+            if q['sql'].startswith('SELECT') and 'silk_' not in q['sql']
+        ]
+        self.assertEqual(len(selects), 1)
+
+
+@local_services
+class CatalogResponseCacheAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username='cacheadmin', email='cacheadmin@example.com', password='pass12345', is_staff=True
+        )
+        cls.category = PerformanceCategory.objects.create(name="Кукольный театр")
+        cls.theater = Theater.objects.create(name="Театр Образцова", address="Москва")
+        cls.performances = []
+        for index in range(3):
+            performance = Performance.objects.create(
+                name=f"Сказка {index}", description="", duration_time=timedelta(hours=1), category=cls.category
+            )
+            PerformanceSchedule.objects.create(
+                performance=performance, theater=cls.theater,
+                date_time=timezone.now() + timedelta(days=index + 1),
+                available_seats=30, price=Decimal(500 + index * 100)
+            )
+            cls.performances.append(performance)
+
+    def setUp(self):
+        cache.clear()
+
+    def _count_selects(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        selects = [
+            q for q in context.captured_queries
+            if q['sql'].startswith('SELECT') and 'silk_' not in q['sql']
+        ]
+        return response, len(selects)
+
+    def test_second_request_is_served_from_cache(self):
+        for name in ('catalog-featured', 'catalog-stats'):
+            first = self.client.get(reverse(name))
+            self.assertEqual(first['X-Cache'], 'MISS')
+            second, selects = self._count_selects(reverse(name))
+            self.assertEqual(second['X-Cache'], 'HIT')
+            self.assertEqual(selects, 0)
+            self.assertEqual(second.data, first.data)
+
+    def test_catalog_change_bumps_version(self):
+        self.assertEqual(self.client.get(reverse('catalog-stats')).data['total_performances'], 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Performance.objects.create(name="Репка", description="", duration_time=timedelta(hours=1))
+        response = self.client.get(reverse('catalog-stats'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['total_performances'], 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(performance=self.performances[2], user=self.admin, text="Отлично")
+        response = self.client.get(reverse('catalog-featured'))
+        self.assertEqual(response.data['popular_performances'][0]['id'], self.performances[2].id)
+
+    def test_featured_query_count_does_not_depend_on_catalog_size(self):
+        _, selects = self._count_selects(reverse('catalog-featured'))
+        for index in range(5):
+            Performance.objects.create(name=f"Новинка {index}", description="", duration_time=timedelta(hours=1))
+        cache.clear()
+        _, more_selects = self._count_selects(reverse('catalog-featured'))
+        self.assertEqual(selects, more_selects)
+
+    def test_metrics_for_admin(self):
+        self.client.get(reverse('catalog-stats'))
+        self.client.get(reverse('catalog-stats'))
+        self.assertIn(
+            self.client.get(reverse('catalog-cache-stats')).status_code,
+            (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+        )
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('catalog-cache-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data['catalog-stats'], {'hits': 1, 'misses': 1, 'stale': 0, 'hit_ratio': 0.5}
+        )
+
+
+@local_services
 class CartAPITest(APITestCase):
     @classmethod
     def setUpTestData(cls):
@@ -241,7 +1123,55 @@ class CartAPITest(APITestCase):
         # Check cart is now empty
         self.assertEqual(CartItem.objects.count(), 0)
 
+    def _cart_selects(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.cart_list_url, params or {})
+        # silk добавляет EXPLAIN и записывает каждый запрос в свои таблицы
+        selects = [
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('SELECT') and 'silk_' not in q['sql']
+        ]
+        return response, len(selects)
+
+    def test_cart_summary_in_one_query(self):
+        """Items, their schedules and the cart summary come from one SELECT"""
+        for days, price in ((2, Decimal('1500.00')), (3, Decimal('900.00')), (4, Decimal('700.00'))):
+            schedule = PerformanceSchedule.objects.create(
+                performance=self.performance,
+                theater=self.theater,
+                hall=self.hall,
+                date_time=timezone.now() + timedelta(days=days),
+                available_seats=1,
+                price=price
+            )
+            CartItem.objects.create(user=self.user, performance_schedule=schedule, quantity=2)
+        CartItem.objects.create(user=self.user, performance_schedule=self.schedule, quantity=1, held_quantity=1)
 
+        response, selects = self._cart_selects({'summary': '1'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(selects, 1)
+        self.assertEqual(len(response.data['items']), 4)
+        self.assertEqual(response.data['items'][0]['performance_schedule']['theater_name'], "Театр Сатиры")
+        summary = response.data['summary']
+        self.assertEqual((summary['items_count'], summary['seats_count']), (4, 7))
+        self.assertEqual(summary['total_amount'], '7400.00')
+        # Непроданных мест по одному, удержаний нет - в трех показах не хватает по месту
+        self.assertEqual([warning['missing_seats'] for warning in summary['warnings']], [1, 1, 1])
+
+        # Без summary - прежний список элементов тем же одним запросом
+        response, selects = self._cart_selects()
+        self.assertEqual(selects, 1)
+        self.assertEqual(len(response.data), 4)
+
+    def test_empty_cart_summary(self):
+        response = self.client.get(self.cart_list_url, {'summary': '1'})
+        self.assertEqual(response.data, {
+            'items': [],
+            'summary': {'items_count': 0, 'seats_count': 0, 'total_amount': '0.00', 'warnings': []},
+        })
+
+
+@local_services
 class OrderAPITest(APITestCase):
     @classmethod
     def setUpTestData(cls):
@@ -318,7 +1248,30 @@ class OrderAPITest(APITestCase):
         self.assertEqual(order_item.performance_schedule, self.schedule)
         self.assertEqual(order_item.quantity, 2)
         self.assertEqual(order_item.price_per_unit, Decimal('2000.00'))
-    
+
+    def test_create_order_seats_sold_out_during_checkout(self):
+        """Seats sold between validation and reservation return 400 and keep the cart"""
+        data = {
+            'customer_name': 'Иван Петров',
+            'customer_email': 'ivan@example.com',
+            'customer_phone': '+7-999-888-77-66',
+            'payment_method': 'Банковская карта'
+        }
+        validate = OrderCreateSerializer.validate
+
+        def validate_then_sell_out(serializer, attrs):
+            attrs = validate(serializer, attrs)
+            PerformanceSchedule.objects.filter(pk=self.schedule.pk).update(available_seats=1)
+            return attrs
+
+        with mock.patch.object(OrderCreateSerializer, 'validate', validate_then_sell_out):
+            response = self.client.post(self.create_order_url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Недостаточно мест", response.data['error'])
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(CartItem.objects.count(), 1)
+
     def test_cancel_order(self):
         """Test cancelling an order"""
         # Create an order
@@ -357,4 +1310,787 @@ class OrderAPITest(APITestCase):
         
         # Verify seats were released
         self.schedule.refresh_from_db()
-        self.assertEqual(self.schedule.available_seats, 100)  # Back to original 100 
\ No newline at end of file
+        self.assertEqual(self.schedule.available_seats, 100)  # Back to original 100 
+
+    def _selects(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        # silk добавляет EXPLAIN и записывает каждый запрос в свои таблицы
+        selects = [
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('SELECT') and 'silk_' not in q['sql']
+        ]
+        return response, len(selects)
+
+    def _create_orders(self, count):
+        second = PerformanceSchedule.objects.create(
+            performance=self.performance,
+            theater=self.theater,
+            hall=self.hall,
+            date_time=timezone.now() + timedelta(days=4),
+            available_seats=100,
+            price=Decimal('1000.00')
+        )
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.user,
+                total_amount=Decimal('3000.00'),
+                customer_name='Маша Прозорова',
+                customer_email='masha@example.com'
+            )
+            OrderItem.objects.create(order=order, performance_schedule=self.schedule, quantity=1,
+                                     price_per_unit=Decimal('2000.00'))
+            OrderItem.objects.create(order=order, performance_schedule=second, quantity=1,
+                                     price_per_unit=Decimal('1000.00'))
+            orders.append(order)
+        return orders
+
+    def test_order_history_query_count_does_not_grow(self):
+        """Orders, items, schedules and theaters are loaded with two SELECTs per page"""
+        self._create_orders(25)
+        response, selects = self._selects(self.order_list_url, {'page_size': 20})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(selects, 2)
+        self.assertEqual(len(response.data['results']), 20)
+        item = response.data['results'][0]['items'][0]
+        self.assertEqual((item['performance_name'], item['theater_name']), ("Три сестры", "Театр на Малой Бронной"))
+
+        response, selects = self._selects(response.data['next'])
+        self.assertEqual(selects, 2)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_order_history_summary_skips_items(self):
+        orders = self._create_orders(3)
+        response, selects = self._selects(self.order_list_url, {'page_size': 20, 'summary': '1'})
+        self.assertEqual(selects, 1)
+        self.assertEqual(response.data['results'][0], {
+            'id': orders[-1].id,
+            'status': OrderStatus.PENDING,
+            'status_display': 'В обработке',
+            'total_amount': '3000.00',
+            'created_at': response.data['results'][0]['created_at'],
+            'items_count': 2,
+        })
+
+    def test_order_detail_prefetches_items(self):
+        order = self._create_orders(1)[0]
+        response, selects = self._selects(reverse('order-detail', kwargs={'order_id': order.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(selects, 2)
+        self.assertEqual(len(response.data['items']), 2)
+
+    def test_update_order_status_follows_transitions(self):
+        """Restoring a cancelled order reserves seats again; completed orders cannot be cancelled"""
+        staff = User.objects.create_user(
+            username='orderadmin',
+            email='orderadmin@example.com',
+            password='orderadminpass123',
+            is_staff=True
+        )
+        self.client.force_authenticate(user=staff)
+        order = Order.objects.create(
+            user=self.user,
+            status=OrderStatus.CANCELLED,
+            total_amount=Decimal('4000.00'),
+            customer_name='Петр Иванов',
+            customer_email='petr@example.com'
+        )
+        OrderItem.objects.create(
+            order=order,
+            performance_schedule=self.schedule,
+            quantity=2,
+            price_per_unit=Decimal('2000.00')
+        )
+        url = reverse('order-update-status', kwargs={'order_id': order.id})
+
+        response = self.client.post(url, {'status': OrderStatus.CONFIRMED}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], OrderStatus.CONFIRMED)
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.available_seats, 98)
+
+        self.client.post(url, {'status': OrderStatus.COMPLETED}, format='json')
+        response = self.client.post(url, {'status': OrderStatus.CANCELLED}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Нельзя перевести заказ", response.data['error'])
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.available_seats, 98)
+
+
+@local_services
+class IdempotencyKeyAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='retryuser',
+            email='retry@example.com',
+            password='retrypass123'
+        )
+        cls.other_user = User.objects.create_user(
+            username='otheruser',
+            email='other@example.com',
+            password='otherpass123'
+        )
+        theater = Theater.objects.create(name="Театр Ленсовета", address="Санкт-Петербург")
+        performance = Performance.objects.create(
+            name="Мастер и Маргарита",
+            description="По роману М.А. Булгакова",
+            duration_time=timedelta(hours=3)
+        )
+        cls.schedule = PerformanceSchedule.objects.create(
+            performance=performance,
+            theater=theater,
+            date_time=timezone.now() + timedelta(days=5),
+            available_seats=50,
+            price=Decimal('1500.00')
+        )
+        cls.order_data = {
+            'customer_name': 'Мария Смирнова',
+            'customer_email': 'maria@example.com',
+            'customer_phone': '+7-999-555-44-33',
+            'payment_method': 'Банковская карта'
+        }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        CartItem.objects.create(user=self.user, performance_schedule=self.schedule, quantity=2)
+
+    def _create_order(self, key, data=None):
+        return self.client.post(
+            reverse('order-create'), data or self.order_data, format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_replayed_checkout_returns_original_order(self):
+        """A retried checkout returns the stored response and reserves seats once"""
+        first = self._create_order('checkout-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        replay = self._create_order('checkout-1')
+        self.assertEqual(replay.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json()['id'], first.data['id'])
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.available_seats, 48)
+
+    def test_key_reused_for_different_request(self):
+        """The same key with another payload is rejected"""
+        self._create_order('checkout-2')
+        response = self._create_order('checkout-2', dict(self.order_data, customer_name='Другое имя'))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_keys_are_scoped_per_user(self):
+        """Another user's key with the same value runs the request"""
+        other_schedule = PerformanceSchedule.objects.create(
+            performance=self.schedule.performance,
+            theater=self.schedule.theater,
+            date_time=timezone.now() + timedelta(days=6),
+            available_seats=10,
+            price=Decimal('900.00')
+        )
+        data = {'performance_schedule_id': other_schedule.id, 'quantity': 1}
+        url = reverse('cart-add')
+        self.assertEqual(self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='cart-1').status_code, 201)
+
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='cart-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(CartItem.objects.filter(performance_schedule=other_schedule).count(), 2)
+
+    def test_duplicate_waits_for_in_flight_request(self):
+        """A duplicate arriving mid-checkout waits and gets the first response"""
+        record = IdempotencyKey.objects.create(
+            user=self.user,
+            key='checkout-3',
+            endpoint='order-create',
+            request_hash=request_fingerprint('order-create', mock.Mock(data=self.order_data), {}),
+            expires_at=timezone.now() + timedelta(hours=1)
+        )
+
+        def first_request_finishes(seconds):
+            IdempotencyKey.objects.filter(pk=record.pk).update(status_code=201, response_body={'id': 777})
+
+        with mock.patch('perfomance.idempotency.time.sleep', side_effect=first_request_finishes) as sleep:
+            response = self._create_order('checkout-3')
+
+        sleep.assert_called_once()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json(), {'id': 777})
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_slow_in_flight_request_is_not_run_twice(self):
+        """A retry of a checkout still running after a minute gets 409 until the lease expires"""
+        record = IdempotencyKey.objects.create(
+            user=self.user,
+            key='checkout-7',
+            endpoint='order-create',
+            request_hash=request_fingerprint('order-create', mock.Mock(data=self.order_data), {}),
+            expires_at=timezone.now() + timedelta(hours=1)
+        )
+        IdempotencyKey.objects.filter(pk=record.pk).update(created_at=timezone.now() - timedelta(minutes=2))
+
+        # Ожидание ответа первого запроса сразу упирается в срок
+        with mock.patch('perfomance.idempotency.time.monotonic', side_effect=[0, 100]):
+            response = self._create_order('checkout-7')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Order.objects.count(), 0)
+
+        # После аренды первый запрос заведомо прерван - ключ занимается заново
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LEASE + 1)
+        )
+        self.assertEqual(self._create_order('checkout-7').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_request_is_not_stored(self):
+        """Validation errors are replayed, server errors free the key"""
+        CartItem.objects.all().delete()
+        self.assertEqual(self._create_order('checkout-4').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(IdempotencyKey.objects.get(key='checkout-4').status_code, 400)
+
+        with mock.patch('perfomance.views.OrderCreateSerializer.save', side_effect=RuntimeError):
+            CartItem.objects.create(user=self.user, performance_schedule=self.schedule, quantity=2)
+            with self.assertRaises(RuntimeError):
+                self._create_order('checkout-5')
+        self.assertFalse(IdempotencyKey.objects.filter(key='checkout-5').exists())
+        self.assertEqual(self._create_order('checkout-5').status_code, status.HTTP_201_CREATED)
+
+    def test_expired_keys_are_purged(self):
+        self._create_order('checkout-6')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(purge_idempotency_keys(), "Удалено 1 ключей")
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@local_services
+class SeatHoldAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='holder',
+            email='holder@example.com',
+            password='holderpass123'
+        )
+        cls.other_user = User.objects.create_user(
+            username='latecomer',
+            email='latecomer@example.com',
+            password='latecomerpass123'
+        )
+        cls.theater = Theater.objects.create(name="Театр Вахтангова", address="Москва")
+        cls.performance = Performance.objects.create(
+            name="Евгений Онегин",
+            description="По роману А.С. Пушкина",
+            duration_time=timedelta(hours=3)
+        )
+        cls.cart_add_url = reverse('cart-add')
+
+    def setUp(self):
+        self.schedule = PerformanceSchedule.objects.create(
+            performance=self.performance,
+            theater=self.theater,
+            date_time=timezone.now() + timedelta(days=3),
+            available_seats=5,
+            price=Decimal('1000.00')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _add(self, quantity, user=None):
+        if user is not None:
+            self.client.force_authenticate(user=user)
+        return self.client.post(
+            self.cart_add_url,
+            {'performance_schedule_id': self.schedule.id, 'quantity': quantity},
+            format='json'
+        )
+
+    def _seats(self):
+        self.schedule.refresh_from_db()
+        return self.schedule.available_seats, self.schedule.held_seats
+
+    def test_cart_add_holds_seats(self):
+        """Held seats are taken out of availability until the hold ends"""
+        response = self._add(3)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['held_quantity'], 3)
+        self.assertIsNotNone(response.data['hold_expires_at'])
+        self.assertEqual(response.data['performance_schedule']['available_seats'], 2)
+        self.assertEqual(self._seats(), (2, 3))
+
+        # Другой покупатель не может занять удержанные места
+        response = self._add(3, user=self.other_user)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._seats(), (2, 3))
+
+    def test_changing_cart_adjusts_hold(self):
+        self._add(3)
+        item = CartItem.objects.get(user=self.user)
+
+        update_url = reverse('cart-update-quantity', kwargs={'item_id': item.id})
+        self.assertEqual(self.client.post(update_url, {'quantity': 1}, format='json').status_code, 200)
+        self.assertEqual(self._seats(), (4, 1))
+        self.assertEqual(self.client.post(update_url, {'quantity': 6}, format='json').status_code, 400)
+        self.assertEqual(self._seats(), (4, 1))
+
+        response = self.client.delete(reverse('cart-remove', kwargs={'item_id': item.id}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self._seats(), (5, 0))
+
+        self._add(2)
+        self.client.post(reverse('cart-clear'))
+        self.assertEqual(self._seats(), (5, 0))
+
+    def test_checkout_sells_held_seats(self):
+        self._add(2)
+        response = self.client.post(reverse('order-create'), {
+            'customer_name': 'Ольга Ларина',
+            'customer_email': 'olga@example.com',
+            'customer_phone': '+7-999-000-11-22',
+            'payment_method': 'Банковская карта'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._seats(), (3, 0))
+
+    def test_expired_hold_reclaimed_lazily_on_cart_add(self):
+        self._add(5)
+        CartItem.objects.update(hold_expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self._add(4, user=self.other_user)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._seats(), (1, 4))
+        self.assertEqual(CartItem.objects.get(user=self.user).held_quantity, 0)
+
+    def test_expired_holds_reclaimed_in_bulk(self):
+        """The beat task releases expired holds with one UPDATE per table"""
+        schedules = [self.schedule] + [
+            PerformanceSchedule.objects.create(
+                performance=self.performance,
+                theater=self.theater,
+                date_time=timezone.now() + timedelta(days=4 + index),
+                available_seats=5,
+                price=Decimal('1000.00')
+            )
+            for index in range(3)
+        ]
+        for user in (self.user, self.other_user):
+            self.client.force_authenticate(user=user)
+            for schedule in schedules:
+                self.client.post(self.cart_add_url, {'performance_schedule_id': schedule.id, 'quantity': 2}, format='json')
+        CartItem.objects.filter(user=self.user).update(hold_expires_at=timezone.now() - timedelta(seconds=1))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(reclaim_seat_holds(), "Возвращено 8 мест")
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+
+        for schedule in schedules:
+            schedule.refresh_from_db()
+            self.assertEqual((schedule.available_seats, schedule.held_seats), (3, 2))
+
+    def test_reclaim_skips_holds_changed_concurrently(self):
+        """A hold extended mid-batch is skipped, the rest of the batch is still released"""
+        schedules = [self.schedule] + [
+            PerformanceSchedule.objects.create(
+                performance=self.performance,
+                theater=self.theater,
+                date_time=timezone.now() + timedelta(days=4 + index),
+                available_seats=5,
+                price=Decimal('1000.00')
+            )
+            for index in range(2)
+        ]
+        for schedule in schedules:
+            self.client.post(self.cart_add_url, {'performance_schedule_id': schedule.id, 'quantity': 2}, format='json')
+        CartItem.objects.update(hold_expires_at=timezone.now() - timedelta(seconds=1))
+        extended = CartItem.objects.get(performance_schedule=schedules[1])
+        reset_holds = holds._reset_holds
+
+        def extend_then_reset(pks, now):
+            # Владелец продлил удержание между выбором пачки и ее сбросом
+            CartItem.objects.filter(pk=extended.pk).update(hold_expires_at=timezone.now() + timedelta(minutes=5))
+            return reset_holds(pks, now)
+
+        with mock.patch('perfomance.holds._reset_holds', side_effect=extend_then_reset):
+            self.assertEqual(holds.reclaim_expired_holds(batch_size=2), 4)
+
+        for schedule in schedules:
+            schedule.refresh_from_db()
+        self.assertEqual([schedule.available_seats for schedule in schedules], [5, 3, 5])
+        self.assertEqual(CartItem.objects.get(pk=extended.pk).held_quantity, 2)
+
+
+@local_services
+class SeatMapAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='seatpicker',
+            email='seatpicker@example.com',
+            password='seatpickerpass123'
+        )
+        cls.other_user = User.objects.create_user(
+            username='neighbour',
+            email='neighbour@example.com',
+            password='neighbourpass123'
+        )
+        cls.theater = Theater.objects.create(name="Малый театр", address="Москва")
+        cls.hall = Hall.objects.create(number_hall=1, theater=cls.theater)
+        stalls = SeatZone.objects.create(hall=cls.hall, name="Партер", price_factor=Decimal('1.50'))
+        balcony = SeatZone.objects.create(hall=cls.hall, name="Балкон", price_factor=Decimal('1.00'))
+        # Три ряда по 10 мест: два ряда партера и балкон
+        for number, zone in ((1, stalls), (2, stalls), (3, balcony)):
+            HallRow.objects.create(hall=cls.hall, zone=zone, number=number, seats=10)
+        cls.performance = Performance.objects.create(
+            name="Ревизор",
+            description="Комедия Н.В. Гоголя",
+            duration_time=timedelta(hours=2)
+        )
+
+    def setUp(self):
+        self.schedule = PerformanceSchedule.objects.create(
+            performance=self.performance,
+            theater=self.theater,
+            hall=self.hall,
+            date_time=timezone.now() + timedelta(days=3),
+            available_seats=30,
+            price=Decimal('1000.00')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _url(self, name):
+        return reverse(name, kwargs={'pk': self.schedule.pk})
+
+    def _hold(self, seats, user=None):
+        if user is not None:
+            self.client.force_authenticate(user=user)
+        return self.client.post(
+            self._url('schedule-seat-hold'),
+            {'seats': [{'row': row, 'seat': seat} for row, seat in seats]},
+            format='json'
+        )
+
+    def _occupied(self):
+        rows = self.client.get(self._url('schedule-seat-map')).data['rows']
+        return {row['row']: row['occupied'] for row in rows if row['occupied']}
+
+    def test_new_schedule_gets_empty_bitmap(self):
+        # 30 мест - 4 байта
+        self.assertEqual(bytes(self.schedule.seat_map), bytes(4))
+        response = self.client.get(self._url('schedule-seat-map'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['capacity'], 30)
+        self.assertEqual(response.data['free'], 30)
+        self.assertEqual(response.data['rows'][0]['price'], Decimal('1500.00'))
+        self.assertEqual(response.data['rows'][2]['zone'], "Балкон")
+
+    def test_hold_is_all_or_nothing(self):
+        response = self._hold([(2, 5), (2, 6)])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cart_item']['quantity'], 2)
+        self.assertEqual(response.data['cart_item']['held_quantity'], 2)
+        self.assertEqual(self._occupied(), {2: [5, 6]})
+
+        # Одно из мест занято - не удерживается ни одно
+        response = self._hold([(2, 6), (2, 7)], user=self.other_user)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['seats'], [{'row': 2, 'seat': 6}])
+        self.assertEqual(self._occupied(), {2: [5, 6]})
+        self.schedule.refresh_from_db()
+        self.assertEqual((self.schedule.available_seats, self.schedule.held_seats), (28, 2))
+
+    def test_hold_rejects_unknown_seat(self):
+        response = self._hold([(4, 1)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._occupied(), {})
+
+    def test_release_frees_seats(self):
+        self._hold([(1, 1), (1, 2), (1, 3)])
+        response = self.client.post(self._url('schedule-seat-release'), {'seats': [{'row': 1, 'seat': 2}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cart_item']['seats'], [{'row': 1, 'seat': 1}, {'row': 1, 'seat': 3}])
+        self.assertEqual(self._occupied(), {1: [1, 3]})
+
+        # Чужие места освободить нельзя
+        response = self.client.post(self._url('schedule-seat-release'), {'seats': [{'row': 3, 'seat': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            self._url('schedule-seat-release'),
+            {'seats': [{'row': 1, 'seat': 1}, {'row': 1, 'seat': 3}]},
+            format='json'
+        )
+        self.assertIsNone(response.data['cart_item'])
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+        self.assertEqual(self._occupied(), {})
+        self.schedule.refresh_from_db()
+        self.assertEqual((self.schedule.available_seats, self.schedule.held_seats), (30, 0))
+
+    def test_best_seats_prefer_middle_row_center(self):
+        response = self.client.get(self._url('schedule-best-seats'), {'count': 4})
+        self.assertEqual(response.data['seats'], [{'row': 2, 'seat': seat} for seat in (4, 5, 6, 7)])
+
+        # Середина среднего ряда занята - ищем в том же ряду, затем в соседних
+        self._hold([(2, 5)])
+        response = self.client.get(self._url('schedule-best-seats'), {'count': 4})
+        self.assertEqual(response.data['seats'], [{'row': 2, 'seat': seat} for seat in (6, 7, 8, 9)])
+        response = self.client.get(self._url('schedule-best-seats'), {'count': 6})
+        self.assertEqual(response.data['seats'], [{'row': 1, 'seat': seat} for seat in range(3, 9)])
+        response = self.client.get(self._url('schedule-best-seats'), {'count': 11})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cart_add_requires_seat_selection(self):
+        response = self.client.post(
+            reverse('cart-add'), {'performance_schedule_id': self.schedule.id, 'quantity': 2}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_checkout_prices_seats_by_zone_and_cancel_frees_them(self):
+        self._hold([(1, 5), (3, 5)])
+        response = self.client.post(reverse('order-create'), {
+            'customer_name': 'Иван Петров',
+            'customer_email': 'ivan@example.com',
+            'customer_phone': '+7-999-123-45-67',
+            'payment_method': 'Банковская карта'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.total_amount, Decimal('2500.00'))
+        self.assertEqual(
+            sorted((item.price_per_unit, item.seats[0]['row']) for item in order.items.all()),
+            [(Decimal('1000.00'), 3), (Decimal('1500.00'), 1)]
+        )
+        # Проданные места остаются занятыми
+        self.assertEqual(self._occupied(), {1: [5], 3: [5]})
+
+        order.cancel()
+        self.assertEqual(self._occupied(), {})
+
+    def test_checkout_limits_use_zone_prices(self):
+        PerformanceSchedule.objects.filter(pk=self.schedule.pk).update(price=Decimal('5000.00'))
+        # 14 мест партера: 70 000 по базовой цене, но 105 000 по цене зоны
+        self._hold([(1, seat) for seat in range(1, 11)] + [(2, seat) for seat in range(1, 5)])
+        response = self.client.post(reverse('order-create'), {
+            'customer_name': 'Иван Петров',
+            'customer_email': 'ivan@example.com',
+            'customer_phone': '+7-999-123-45-67',
+            'payment_method': 'Банковская карта'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('105000', str(response.data['non_field_errors'][0]))
+        self.assertFalse(Order.objects.exists())
+
+    def test_expired_hold_frees_seats(self):
+        self._hold([(1, 1), (1, 2)])
+        CartItem.objects.filter(user=self.user).update(hold_expires_at=timezone.now() - timedelta(seconds=1))
+        reclaim_seat_holds()
+
+        self.assertEqual(self._occupied(), {})
+        self.assertEqual(CartItem.objects.get(user=self.user).seats, [])
+        # Другой покупатель может выбрать освободившиеся места
+        self.assertEqual(self._hold([(1, 1)], user=self.other_user).status_code, status.HTTP_200_OK)
+
+    def test_hall_layout_locked_once_shows_have_seat_maps(self):
+        """Rows of a hall with seat maps cannot be added, resized or deleted"""
+        row = HallRow.objects.get(hall=self.hall, number=3)
+        with self.assertRaises(ValidationError):
+            HallRow(hall=self.hall, number=4, seats=10).full_clean()
+        row.seats = 12
+        with self.assertRaises(ValidationError):
+            row.full_clean()
+        # Зона на смещения мест не влияет
+        row.seats = 10
+        row.zone = SeatZone.objects.get(hall=self.hall, name="Партер")
+        row.full_clean()
+
+        formset_class = inlineformset_factory(
+            Hall, HallRow, formset=HallRowFormSet, fields=('zone', 'number', 'seats'), extra=0
+        )
+        rows = list(self.hall.rows.all())
+        data = {'rows-TOTAL_FORMS': len(rows), 'rows-INITIAL_FORMS': len(rows)}
+        for index, hall_row in enumerate(rows):
+            data.update({
+                f'rows-{index}-id': hall_row.pk, f'rows-{index}-hall': self.hall.pk,
+                f'rows-{index}-zone': hall_row.zone_id, f'rows-{index}-number': hall_row.number,
+                f'rows-{index}-seats': hall_row.seats,
+            })
+        self.assertTrue(formset_class(data, instance=self.hall, prefix='rows').is_valid())
+        data['rows-2-DELETE'] = 'on'
+        self.assertFalse(formset_class(data, instance=self.hall, prefix='rows').is_valid())
+
+    def test_concurrent_map_change_is_retried(self):
+        calls = []
+
+        def take_first_seat(occupied):
+            if not calls:
+                # Другой запрос успел изменить карту после нашего чтения
+                PerformanceSchedule.objects.filter(pk=self.schedule.pk).update(
+                    seat_map=(1 << 29).to_bytes(4, 'little'), seat_map_version=F('seat_map_version') + 1
+                )
+            calls.append(occupied)
+            return occupied | 1
+
+        self.assertEqual(seatmap._change(self.schedule.pk, take_first_seat), 2)
+        self.assertEqual(calls, [0, 1 << 29])
+        self.assertEqual(self._occupied(), {1: [1], 3: [10]})
+
+
+
+@local_services
+@skipUnless(fakeredis, 'fakeredis and lupa are required')
+class WaitingRoomAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'buyer{number}',
+                email=f'buyer{number}@example.com',
+                password='buyerpass123'
+            )
+            for number in range(3)
+        ]
+        cls.performance = Performance.objects.create(
+            name="Три сестры",
+            description="Драма А.П. Чехова",
+            duration_time=timedelta(hours=3)
+        )
+
+    def setUp(self):
+        self.redis_context = waiting_room.using_client(fakeredis.FakeRedis())
+        self.redis_context.__enter__()
+        self.addCleanup(self.redis_context.__exit__, None, None, None)
+        self.schedule = PerformanceSchedule.objects.create(
+            performance=self.performance,
+            date_time=timezone.now() + timedelta(days=5),
+            available_seats=10,
+            price=Decimal('1500.00')
+        )
+        # Лимит попадает в Redis после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule.admission_limit = 1
+            self.schedule.save()
+        self.now = 1_000_000
+        clock = mock.patch('perfomance.waiting_room.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def _join(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(reverse('schedule-queue-join', kwargs={'pk': self.schedule.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def _poll(self, token):
+        client = APIClient()
+        return client.get(reverse('schedule-queue-poll', kwargs={'pk': self.schedule.pk, 'token': token}))
+
+    def _cart_add(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('cart-add'), {
+            'performance_schedule_id': self.schedule.pk,
+            'quantity': 1
+        }, format='json')
+
+    def test_join_admits_up_to_limit_and_queues_the_rest(self):
+        first, second, third = (self._join(user) for user in self.users)
+        self.assertEqual(first['status'], 'admitted')
+        self.assertEqual(first['expires_at'], self.now + settings.WAITING_ROOM_ADMISSION_TTL)
+        self.assertEqual((second['status'], second['position']), ('waiting', 1))
+        self.assertEqual((third['status'], third['position']), ('waiting', 2))
+        # Повторный вход не меняет ни токен, ни место в очереди
+        again = self._join(self.users[2])
+        self.assertEqual((again['token'], again['position']), (third['token'], 2))
+
+    def test_poll_does_not_touch_database(self):
+        self._join(self.users[0])
+        token = self._join(self.users[1])['token']
+        with CaptureQueriesContext(connection) as queries:
+            response = self._poll(token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['status'], response.data['position']), ('waiting', 1))
+        self.assertEqual(len(queries), 0)
+
+    def test_unknown_token_is_not_found(self):
+        response = self._poll('missing')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cart_requires_admission(self):
+        self._join(self.users[0])
+        self._join(self.users[1])
+        response = self._cart_add(self.users[1])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.data['schedules'], [self.schedule.pk])
+        self.assertEqual(self._cart_add(self.users[0]).status_code, status.HTTP_201_CREATED)
+        self.assertFalse(CartItem.objects.filter(user=self.users[1]).exists())
+
+    def test_checkout_releases_admission_to_next_buyer(self):
+        self._join(self.users[0])
+        token = self._join(self.users[1])['token']
+        self._cart_add(self.users[0])
+        response = self.client.post(reverse('order-create'), {
+            'customer_name': 'Ирина Прозорова',
+            'customer_email': 'irina@example.com',
+            'customer_phone': '+7-999-000-33-44',
+            'payment_method': 'Банковская карта'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._poll(token).data['status'], 'admitted')
+        self.assertEqual(self._cart_add(self.users[1]).status_code, status.HTTP_201_CREATED)
+
+    def test_expired_admission_lets_next_buyer_in(self):
+        self._join(self.users[0])
+        token = self._join(self.users[1])['token']
+        self.now += settings.WAITING_ROOM_ADMISSION_TTL
+        self.assertEqual(self._poll(token).data['status'], 'admitted')
+        self.assertEqual(self._cart_add(self.users[0]).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_buyer_who_stops_polling_leaves_queue(self):
+        self._join(self.users[0])
+        idle = self._join(self.users[1])['token']
+        self.now += settings.WAITING_ROOM_HEARTBEAT // 2
+        active = self._join(self.users[2])['token']
+        self.now += settings.WAITING_ROOM_HEARTBEAT // 2 + 1
+        # Второй покупатель не опрашивал очередь дольше WAITING_ROOM_HEARTBEAT
+        self.assertEqual(self._poll(active).data['position'], 1)
+        # Токен выбывшего удален: он встает в очередь заново
+        self.assertEqual(self._poll(idle).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotEqual(self._join(self.users[1])['token'], idle)
+
+    def _token_owners(self):
+        client = waiting_room.get_client()
+        tokens, users = waiting_room._keys(self.schedule.pk)[4:6]
+        return sorted(int(user) for user in client.hvals(tokens)), client.hlen(users)
+
+    def test_tokens_are_removed_with_their_buyers(self):
+        second = [self._join(user) for user in self.users][1]['token']
+        self.assertEqual(self._token_owners(), ([user.pk for user in self.users], 3))
+
+        # Первый оформил заказ, второй пропущен вслед за ним, третий перестал опрашивать очередь
+        waiting_room.release(self.users[0], [self.schedule.pk])
+        self.assertEqual(self._poll(second).data['status'], 'admitted')
+        self.now += settings.WAITING_ROOM_HEARTBEAT + 1
+        self._poll(second)
+        self.assertEqual(self._token_owners(), ([self.users[1].pk], 1))
+
+        # Истекший пропуск снимается вместе с токеном
+        self.now += settings.WAITING_ROOM_ADMISSION_TTL
+        self.assertEqual(self._poll(second).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self._token_owners(), ([], 0))
+
+        # Вход после истекшего пропуска выдает новый действующий токен
+        self._join(self.users[2])
+        self.now += settings.WAITING_ROOM_ADMISSION_TTL
+        token = self._join(self.users[2])['token']
+        self.assertEqual(self._poll(token).data['status'], 'admitted')
+
+    def test_schedule_without_limit_is_open(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule.admission_limit = None
+            self.schedule.save()
+        self.assertEqual(self._join(self.users[1]), {'token': None, 'status': 'admitted', 'expires_at': None})
+        self.assertEqual(self._cart_add(self.users[1]).status_code, status.HTTP_201_CREATED)
@@ -8,7 +8,8 @@ from .views import (
     order_list, order_detail, create_order, cancel_order, update_order_status,
     performance_schedules, FilteredPerformanceListView,
     CatalogCategoryListView, CatalogCategoryDetailView, CatalogFeaturedView,
-    CatalogSearchView, CatalogStatsView
+    CatalogSearchView, CatalogStatsView, CatalogFuzzySearchView,
+    CatalogSuggestView, ScheduleSearchView, CatalogCacheStatsView
 )
 
 urlpatterns = [
@@ -21,12 +22,21 @@ urlpatterns = [
     path('performances/values/', views.get_performance_values, name='performance_values'),
     path('performances/values_list/', views.get_performance_values_list, name='performance_values_list'),
     path('performances/search/', views.search_performances, name='performance-search'),
+    path('performances/<int:pk>/reviews/', views.performance_reviews, name='performance-reviews'),
     path('performances/<int:pk>/add_review/', views.add_review, name='add_review'),
     path('reviews/<int:pk>/update/', update_review, name='update_review'),
+    path('reviews/<int:pk>/like/', views.review_like, name='review-like'),
     path('reviews/<int:pk>/delete/', delete_review, name='delete_review'),
     path('reviews/<int:pk>/admin_delete/', views.admin_delete_review, name='admin_delete_review'),
     path('performances/<int:pk>/admin_delete/', views.admin_delete_performance, name='admin_delete_performance'),
     path('performances/<int:pk>/schedules/', performance_schedules, name='performance-schedules'),
+    path('schedules/search/', ScheduleSearchView.as_view(), name='schedule-search'),
+    path('schedules/<int:pk>/seats/', views.schedule_seat_map, name='schedule-seat-map'),
+    path('schedules/<int:pk>/seats/best/', views.schedule_best_seats, name='schedule-best-seats'),
+    path('schedules/<int:pk>/seats/hold/', views.schedule_seat_hold, name='schedule-seat-hold'),
+    path('schedules/<int:pk>/seats/release/', views.schedule_seat_release, name='schedule-seat-release'),
+    path('schedules/<int:pk>/queue/', views.schedule_queue_join, name='schedule-queue-join'),
+    path('schedules/<int:pk>/queue/<str:token>/', views.schedule_queue_poll, name='schedule-queue-poll'),
     path('cart/', cart_list, name='cart-list'),
     path('cart/add/', cart_add, name='cart-add'),
     path('cart/update/<int:item_id>/', cart_update_quantity, name='cart-update-quantity'),
@@ -41,5 +51,8 @@ urlpatterns = [
     path('catalog/categories/', CatalogCategoryListView.as_view(), name='catalog-categories'),
     path('catalog/categories/<int:pk>/', CatalogCategoryDetailView.as_view(), name='catalog-category-detail'),
     path('catalog/search/', CatalogSearchView.as_view(), name='catalog-search'),
+    path('catalog/fuzzy/', CatalogFuzzySearchView.as_view(), name='catalog-fuzzy'),
+    path('catalog/suggest/', CatalogSuggestView.as_view(), name='catalog-suggest'),
     path('catalog/stats/', CatalogStatsView.as_view(), name='catalog-stats'),
+    path('catalog/cache-stats/', CatalogCacheStatsView.as_view(), name='catalog-cache-stats'),
 ]
\ No newline at end of file
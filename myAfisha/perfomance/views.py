@@ -1,27 +1,40 @@
 # views.py
 from django.http import JsonResponse, HttpRequest
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from main.models import Hall
-from .models import Performance, PerformanceCategory, Promotion, Review, CartItem, PerformanceSchedule, Order, OrderStatus
+from .models import Counter, Like, Performance, PerformanceCategory, Promotion, Review, CartItem, PerformanceSchedule, Order, OrderStatus
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from .serializers import PerformanceSerializer
 from django.db.models import Count, Avg, Sum
 from rest_framework.generics import RetrieveAPIView, ListAPIView, ListCreateAPIView
 from .promotion_serializers import PromotionSerializer
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
 from .models import Review
 from .serializers import ReviewSerializer
 from .models import CartItem, PerformanceSchedule
 from .serializers import CartItemSerializer
 from django.db import IntegrityError
-from django.db.models import F, Q, Min, Max
-from .serializers import PerformanceScheduleSerializer, CartItemSerializer, ReviewSerializer, OrderSerializer, OrderCreateSerializer, PerformanceBriefSerializer, CategoryWithPerformancesSerializer, CategoryBriefSerializer
+from django.db.models import F, Q, Min, Max, Window
+from django.db.models.functions import RowNumber
+from .serializers import PerformanceScheduleSerializer, CartItemSerializer, ReviewSerializer, OrderSerializer, OrderSummarySerializer, OrderCreateSerializer, CartSummarySerializer, PerformanceBriefSerializer, CategoryWithPerformancesSerializer, CategoryBriefSerializer, ScheduleSearchSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from .filters import PerformanceFilter
+from .filters import PerformanceFilter, FullTextSearchFilter, RelevanceOrderingFilter, ScheduleFilter
+from .pagination import KeysetPagination, ReviewPagination, ScheduleKeysetPagination, ScheduleSearchPagination
+from .fuzzy import fuzzy_search, did_you_mean
+from .suggest import suggest, SUGGEST_LIMIT
+from .facets import compute_facets
+from .idempotency import idempotent
+from .orders import TransitionError, check_transition, transition
+from .holds import delete_cart_items, hold_for_cart_item, reclaim_expired_holds
+from . import seatmap, waiting_room
+from .waiting_room import admission_required
+from .cache import cached_response, get_cache_metrics
+from urllib.parse import quote
 from typing import List, Dict, Any, Union, Optional
 from django.utils import timezone
 
@@ -167,15 +180,32 @@ def get_performance_values_list(request):
     data = list(Performance.objects.values_list('name', 'category__name', 'created_at'))
     return JsonResponse(data, safe=False)
 
+def _reviews_limit(request):
+    """
+    С reviews_page=1 в ответ со спектаклями встраивается только первая
+    страница отзывов (ReviewPagination.page_size), иначе все отзывы
+    """
+    if request.query_params.get('reviews_page') in ('1', 'true'):
+        return ReviewPagination.page_size
+    return None
+
 class PerformanceListView(APIView):
     def get(self, request):
-        performances = Performance.objects.select_related('category').prefetch_related('reviews', 'schedule').all()
+        reviews_limit = _reviews_limit(request)
+        performances = Performance.objects.with_catalog_stats(request.user, reviews_limit=reviews_limit)
+        context = {'request': request, 'reviews_limit': reviews_limit}
+        
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(performances, request, view=self)
+        if page is not None:
+            serializer = PerformanceSerializer(page, many=True, context=context)
+            return paginator.get_paginated_response(serializer.data)
         
         # Используем сериализатор с контекстом запроса
         serializer = PerformanceSerializer(
             performances, 
             many=True, 
-            context={'request': request}
+            context=context
         )
         return Response(serializer.data)
 
@@ -199,32 +229,41 @@ class FilteredPerformanceListView(ListAPIView):
     Доступна сортировка по полям:
     - name: Название спектакля
     - created_at: Дата создания
+    - average_rating: Средняя оценка
+    - review_count: Количество отзывов
     
     Доступен поиск по полям:
     - name: Название спектакля
     - description: Описание спектакля
     """
-    queryset = Performance.objects.select_related('category').prefetch_related('reviews', 'schedule').all()
     serializer_class = PerformanceSerializer
+    pagination_class = KeysetPagination
     filterset_class = PerformanceFilter
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RelevanceOrderingFilter]
     search_fields = ['name', 'description']
-    ordering_fields = ['name', 'created_at']
+    ordering_fields = ['name', 'created_at', 'average_rating', 'review_count']
     ordering = ['name']
     
+    def get_queryset(self):
+        return Performance.objects.with_catalog_stats(self.request.user, reviews_limit=_reviews_limit(self.request))
+    
     def get_serializer_context(self):
         context = super().get_serializer_context()
+        context['reviews_limit'] = _reviews_limit(self.request)
         return context
 
 class PerformanceDetailView(RetrieveAPIView):
-    queryset = Performance.objects.select_related('category').prefetch_related('reviews', 'schedule').all()
     serializer_class = PerformanceSerializer
     
+    def get_queryset(self):
+        return Performance.objects.with_catalog_stats(self.request.user, reviews_limit=_reviews_limit(self.request))
+    
     def get_serializer_context(self):
         """
         Добавляем запрос в контекст сериализатора
         """
         context = super().get_serializer_context()
+        context['reviews_limit'] = _reviews_limit(self.request)
         return context
 
 class PerformanceWithReviewsView(APIView):
@@ -257,7 +296,13 @@ class LastPerformanceListView(ListAPIView):
     serializer_class = PerformanceSerializer
 
     def get_queryset(self):
-        return Performance.objects.order_by('-created_at')[:3]
+        reviews_limit = _reviews_limit(self.request)
+        return Performance.objects.with_catalog_stats(self.request.user, reviews_limit=reviews_limit).order_by('-created_at')[:3]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['reviews_limit'] = _reviews_limit(self.request)
+        return context
 
 def update_performances_category(request):
     """
@@ -281,16 +326,47 @@ def delete_performances_by_category(request):
 @api_view(['GET'])
 def search_performances(request):
     query = request.GET.get('q', '')
-    performances = Performance.objects.filter(name__icontains=query)
+    reviews_limit = _reviews_limit(request)
+    performances = Performance.objects.with_catalog_stats(request.user, reviews_limit=reviews_limit).search(query)
+    context = {'request': request, 'reviews_limit': reviews_limit}
+    
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(performances, request)
+    if page is not None:
+        serializer = PerformanceSerializer(page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
     
     # Передаем контекст запроса в сериализатор
     serializer = PerformanceSerializer(
         performances, 
         many=True, 
-        context={'request': request}
+        context=context
     )
     return Response(serializer.data)
 
+@api_view(['GET'])
+def performance_reviews(request, pk):
+    """
+    Отзывы спектакля с keyset-пагинацией.
+    sort=recent (по умолчанию) - сначала новые, sort=likes - по количеству лайков.
+    """
+    sort = request.query_params.get('sort', 'recent')
+    if sort not in ReviewPagination.orderings:
+        return Response(
+            {'error': f"Неизвестная сортировка '{sort}'. Доступны: {', '.join(ReviewPagination.orderings)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not Performance.objects.filter(pk=pk).exists():
+        return Response({'error': 'Спектакль не найден.'}, status=status.HTTP_404_NOT_FOUND)
+    
+    reviews = Review.objects.filter(performance_id=pk).with_user_state(request.user).order_by(
+        *ReviewPagination.orderings[sort]
+    )
+    paginator = ReviewPagination()
+    page = paginator.paginate_queryset(reviews, request)
+    serializer = ReviewSerializer(page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_review(request, pk):
@@ -305,15 +381,20 @@ def add_review(request, pk):
     if serializer.is_valid():
         # Если пользователь авторизован, сохраняем его, иначе user=None
         user = request.user if request.user.is_authenticated else None
-        serializer.save(user=user, performance=performance)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Отзыв и счетчики спектакля (signals.py) сохраняются вместе
+        with transaction.atomic():
+            review = serializer.save(user=user, performance=performance)
+        # Ответ с лайками и автором из аннотаций, без запросов из сериализатора
+        review = Review.objects.with_user_state(request.user).get(pk=review.pk)
+        return Response(ReviewSerializer(review, context={'request': request}).data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['PUT', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def update_review(request, pk):
     try:
-        review = Review.objects.get(pk=pk)
+        # Автор, количество лайков и лайк пользователя загружаются одним запросом
+        review = Review.objects.with_user_state(request.user).get(pk=pk)
     except Review.DoesNotExist:
         return Response({'error': 'Отзыв не найден.'}, status=status.HTTP_404_NOT_FOUND)
     
@@ -325,10 +406,29 @@ def update_review(request, pk):
     serializer = ReviewSerializer(review, data=request.data, partial=True, context={'request': request})
     
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
         return Response(serializer.data)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def review_like(request, pk):
+    """
+    POST ставит лайк отзыву, DELETE снимает его. Повторный запрос ничего не меняет.
+    Счетчики лайков отзыва и общий меняются в той же транзакции (signals.py).
+    """
+    if not Review.objects.filter(pk=pk).exists():
+        return Response({'error': 'Отзыв не найден.'}, status=status.HTTP_404_NOT_FOUND)
+    
+    with transaction.atomic():
+        if request.method == 'POST':
+            Like.objects.get_or_create(user=request.user, review_id=pk)
+        else:
+            Like.objects.filter(user=request.user, review_id=pk).delete()
+    likes_count = Review.objects.values_list('likes_count', flat=True).get(pk=pk)
+    return Response({'liked': request.method == 'POST', 'likes_count': likes_count})
+
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def delete_review(request, pk):
@@ -371,15 +471,33 @@ def admin_delete_performance(request, pk):
 @permission_classes([IsAuthenticated])
 def cart_list(request):
     """
-    Получение списка всех элементов в корзине текущего пользователя
+    Получение списка всех элементов в корзине текущего пользователя.
+    С summary=1 - {"items": [...], "summary": {...}} с итогами корзины.
+    Элементы и итоги загружаются одним запросом.
     """
-    cart_items = CartItem.objects.filter(user=request.user)
-    serializer = CartItemSerializer(cart_items, many=True)
-    return Response(serializer.data)
+    cart_items = list(CartItem.objects.filter(user=request.user).with_summary())
+    items = CartItemSerializer(cart_items, many=True).data
+    if request.query_params.get('summary') not in ('1', 'true'):
+        return Response(items)
+    return Response({"items": items, "summary": CartSummarySerializer.for_items(cart_items).data})
+
+
+def _requested_schedule_ids(request, kwargs):
+    return [request.data.get('performance_schedule_id')]
+
+
+def _cart_item_schedule_ids(request, kwargs):
+    return CartItem.objects.filter(pk=kwargs['item_id'], user=request.user).values_list('performance_schedule_id', flat=True)
+
+
+def _cart_schedule_ids(request, kwargs):
+    return CartItem.objects.filter(user=request.user).values_list('performance_schedule_id', flat=True)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('cart-add')
+@admission_required(_requested_schedule_ids)
 def cart_add(request):
     """
     Добавление билетов в корзину
@@ -403,32 +521,35 @@ def cart_add(request):
         except PerformanceSchedule.DoesNotExist:
             return Response({"error": "Расписание спектакля не найдено"}, status=status.HTTP_404_NOT_FOUND)
         
-        # Проверяем наличие достаточного количества мест
-        if performance_schedule.available_seats < quantity:
-            return Response({
-                "error": f"Недостаточно мест. Доступно: {performance_schedule.available_seats}, запрошено: {quantity}"
-            }, status=status.HTTP_400_BAD_REQUEST)
+        if performance_schedule.seat_map is not None:
+            return Response({"error": "На этот показ билеты продаются с выбором мест на карте зала"},
+                            status=status.HTTP_400_BAD_REQUEST)
         
         user = request.user
         
-        # Проверяем, есть ли уже этот спектакль в корзине пользователя
-        cart_item, created = CartItem.objects.get_or_create(
-            user=user,
-            performance_schedule=performance_schedule,
-            defaults={'quantity': quantity}
-        )
+        # Возвращаем в продажу истекшие удержания мест этого показа
+        reclaim_expired_holds(schedule_ids=[performance_schedule.pk])
+        
+        # Если спектакль уже есть в корзине пользователя, обновляем количество
+        cart_item = CartItem.objects.filter(user=user, performance_schedule=performance_schedule).first()
+        created = cart_item is None
+        if created:
+            cart_item = CartItem(user=user, performance_schedule=performance_schedule)
+        held = cart_item.held_quantity
         
-        # Если элемент уже был в корзине, обновляем количество
-        if not created:
-            # Проверяем наличие достаточного количества мест с учетом уже имеющегося количества в корзине
-            if performance_schedule.available_seats < (quantity - cart_item.quantity):
-                return Response({
-                    "error": f"Недостаточно мест. Доступно: {performance_schedule.available_seats}, "
-                             f"уже в корзине: {cart_item.quantity}, запрошено дополнительно: {quantity - cart_item.quantity}"
-                }, status=status.HTTP_400_BAD_REQUEST)
-                
-            cart_item.quantity = quantity
-            cart_item.save()
+        # Удерживаем места под корзину (с учетом уже удержанных)
+        if not hold_for_cart_item(cart_item, quantity):
+            performance_schedule.refresh_from_db(fields=['available_seats'])
+            if created:
+                error = f"Недостаточно мест. Доступно: {performance_schedule.available_seats}, запрошено: {quantity}"
+            else:
+                error = (f"Недостаточно мест. Доступно: {performance_schedule.available_seats}, "
+                         f"уже в корзине: {held}, запрошено дополнительно: {quantity - held}")
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # В ответе показываем количество мест после удержания
+        performance_schedule.refresh_from_db(fields=['available_seats', 'held_seats'])
+        cart_item.performance_schedule = performance_schedule
         
         # Сериализуем элемент корзины для ответа
         serializer = CartItemSerializer(cart_item)
@@ -441,6 +562,8 @@ def cart_add(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('cart-update-quantity')
+@admission_required(_cart_item_schedule_ids)
 def cart_update_quantity(request, item_id):
     """
     Обновление количества билетов в корзине
@@ -462,22 +585,23 @@ def cart_update_quantity(request, item_id):
         if new_quantity <= 0:
             return Response({"error": "Количество должно быть положительным числом"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Проверяем наличие достаточного количества мест
-        performance_schedule = cart_item.performance_schedule
+        if cart_item.seats:
+            return Response({"error": "Билеты с выбранными местами меняются на карте зала"},
+                            status=status.HTTP_400_BAD_REQUEST)
         
-        # Если увеличиваем количество, проверяем доступность мест
-        if new_quantity > cart_item.quantity:
-            additional_seats = new_quantity - cart_item.quantity
-            
-            if performance_schedule.available_seats < additional_seats:
-                return Response({
-                    "error": f"Недостаточно мест. Доступно: {performance_schedule.available_seats}, "
-                             f"запрошено дополнительно: {additional_seats}"
-                }, status=status.HTTP_400_BAD_REQUEST)
+        # Возвращаем в продажу истекшие удержания мест этого показа
+        reclaim_expired_holds(schedule_ids=[cart_item.performance_schedule_id])
         
-        # Обновляем количество
-        cart_item.quantity = new_quantity
-        cart_item.save()
+        # Удерживаем места под новое количество (лишние места возвращаются)
+        held = cart_item.held_quantity
+        if not hold_for_cart_item(cart_item, new_quantity):
+            available = PerformanceSchedule.objects.values_list('available_seats', flat=True).get(
+                pk=cart_item.performance_schedule_id
+            )
+            return Response({
+                "error": f"Недостаточно мест. Доступно: {available}, "
+                         f"запрошено дополнительно: {new_quantity - held}"
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         # Возвращаем обновленный объект
         serializer = CartItemSerializer(cart_item)
@@ -493,12 +617,12 @@ def cart_remove(request, item_id):
     """
     Удаление элемента из корзины
     """
-    try:
-        cart_item = CartItem.objects.get(id=item_id, user=request.user)
-    except CartItem.DoesNotExist:
+    cart_items = CartItem.objects.filter(id=item_id, user=request.user)
+    if not cart_items.exists():
         return Response({"error": "Элемент корзины не найден"}, status=status.HTTP_404_NOT_FOUND)
     
-    cart_item.delete()
+    # Удаляем элемент и возвращаем удержанные под него места
+    delete_cart_items(cart_items)
     return Response({"message": "Элемент удален из корзины"}, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -508,17 +632,30 @@ def cart_clear(request):
     """
     Очистка корзины текущего пользователя
     """
-    CartItem.objects.filter(user=request.user).delete()
+    delete_cart_items(CartItem.objects.filter(user=request.user))
     return Response({"message": "Корзина очищена"}, status=status.HTTP_204_NO_CONTENT)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def order_list(request):
     """
-    Получение списка заказов текущего пользователя
+    Получение списка заказов текущего пользователя.
+    С summary=1 - заказы без элементов, только их количество.
+    Число запросов не зависит от количества заказов и элементов.
     """
     orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    serializer = OrderSerializer(orders, many=True)
+    if request.query_params.get('summary') in ('1', 'true'):
+        orders, serializer_class = orders.with_items_count(), OrderSummarySerializer
+    else:
+        orders, serializer_class = orders.with_items(), OrderSerializer
+    
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(orders, request)
+    if page is not None:
+        serializer = serializer_class(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+    serializer = serializer_class(orders, many=True)
     return Response(serializer.data)
 
 
@@ -529,7 +666,7 @@ def order_detail(request, order_id):
     Получение детальной информации о заказе
     """
     try:
-        order = Order.objects.get(id=order_id, user=request.user)
+        order = Order.objects.with_items().get(id=order_id, user=request.user)
     except Order.DoesNotExist:
         return Response({"error": "Заказ не найден"}, status=status.HTTP_404_NOT_FOUND)
     
@@ -539,6 +676,8 @@ def order_detail(request, order_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('order-create')
+@admission_required(_cart_schedule_ids, release_on_success=True)
 def create_order(request):
     """
     Создание заказа на основе корзины
@@ -549,8 +688,8 @@ def create_order(request):
         try:
             order = serializer.save()
             return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
-        except serializers.ValidationError as e:
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as e:
+            return Response({"error": e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -597,29 +736,13 @@ def update_order_status(request, order_id):
     if not new_status or new_status not in OrderStatus.values:
         return Response({"error": "Указан неверный статус"}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Если заказ был отменен, и теперь его пытаются восстановить
-    if order.status == OrderStatus.CANCELLED and new_status != OrderStatus.CANCELLED:
-        # Проверяем наличие мест для всех элементов заказа
-        for item in order.items.all():
-            if item.performance_schedule.available_seats < item.quantity:
-                return Response({
-                    "error": f"Недостаточно мест для '{item.performance_schedule.performance.name}'. "
-                             f"Доступно: {item.performance_schedule.available_seats}, "
-                             f"требуется: {item.quantity}"
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Бронируем места
-            item.performance_schedule.reserve_seats(item.quantity)
-    
-    # Если заказ не был отменен, и теперь его отменяют
-    elif order.status != OrderStatus.CANCELLED and new_status == OrderStatus.CANCELLED:
-        # Возвращаем места
-        for item in order.items.all():
-            item.performance_schedule.release_seats(item.quantity)
-    
-    # Обновляем статус
-    order.status = new_status
-    order.save()
+    # Отмена возвращает места, восстановление отмененного заказа снова их бронирует
+    try:
+        check_transition(order.status, new_status)
+        transition(Order.objects.filter(pk=order.pk), new_status)
+    except TransitionError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    order.refresh_from_db()
     
     return Response(OrderSerializer(order).data)
 
@@ -631,11 +754,174 @@ def performance_schedules(request, pk):
     """
     try:
         schedules = PerformanceSchedule.objects.filter(performance_id=pk)
+        
+        paginator = ScheduleKeysetPagination()
+        page = paginator.paginate_queryset(schedules, request)
+        if page is not None:
+            serializer = PerformanceScheduleSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        
         serializer = PerformanceScheduleSerializer(schedules, many=True)
         return Response(serializer.data)
+    except NotFound:
+        raise
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+def _seat_map_schedule(pk):
+    """
+    Показ и схема его зала или (None, None, ответ с ошибкой)
+    """
+    try:
+        schedule = PerformanceSchedule.objects.get(pk=pk)
+    except PerformanceSchedule.DoesNotExist:
+        return None, None, Response({"error": "Расписание спектакля не найдено"}, status=status.HTTP_404_NOT_FOUND)
+    layout = seatmap.ensure_seat_map(schedule)
+    if layout is None:
+        return None, None, Response({"error": "У зала этого показа нет схемы мест"}, status=status.HTTP_404_NOT_FOUND)
+    return schedule, layout, None
+
+
+def _requested_seats(request, layout):
+    """
+    Места из тела запроса или (None, ответ с ошибкой)
+    """
+    seats = request.data.get('seats')
+    if not isinstance(seats, list) or not seats:
+        return None, Response({"error": "Укажите места: [{\"row\": ряд, \"seat\": место}]"},
+                              status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return layout.parse(seats), None
+    except ValueError as e:
+        return None, Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _seat_map_response(cart_item, schedule, http_status=status.HTTP_200_OK):
+    schedule.refresh_from_db(fields=['available_seats', 'held_seats', 'seat_map_version'])
+    return Response({
+        "cart_item": CartItemSerializer(cart_item).data if cart_item else None,
+        "version": schedule.seat_map_version,
+    }, status=http_status)
+
+
+@api_view(['GET'])
+def schedule_seat_map(request, pk):
+    """
+    Схема зала показа с зонами, ценами и занятыми местами
+    """
+    schedule, layout, error = _seat_map_schedule(pk)
+    if error:
+        return error
+    occupied = seatmap.occupancy(schedule)
+    return Response({
+        "schedule": schedule.pk,
+        "version": schedule.seat_map_version,
+        "capacity": layout.capacity,
+        "free": layout.capacity - occupied.bit_count(),
+        "rows": layout.describe(occupied, schedule.price),
+    })
+
+
+@api_view(['GET'])
+def schedule_best_seats(request, pk):
+    """
+    Лучшие count свободных мест подряд в одном ряду (места не удерживаются)
+    """
+    schedule, layout, error = _seat_map_schedule(pk)
+    if error:
+        return error
+    try:
+        count = int(request.query_params.get('count', 1))
+    except ValueError:
+        return Response({"error": "Количество должно быть целым числом"}, status=status.HTTP_400_BAD_REQUEST)
+    if count <= 0:
+        return Response({"error": "Количество должно быть положительным числом"}, status=status.HTTP_400_BAD_REQUEST)
+
+    seats = layout.best_adjacent(seatmap.occupancy(schedule), count)
+    if not seats:
+        return Response({"error": f"Нет {count} свободных мест рядом"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"seats": seats, "version": schedule.seat_map_version})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent('seat-hold')
+@admission_required(lambda request, kwargs: [kwargs['pk']])
+def schedule_seat_hold(request, pk):
+    """
+    Удержание выбранных мест за корзиной пользователя: все места или ни одного
+    """
+    schedule, layout, error = _seat_map_schedule(pk)
+    if error:
+        return error
+    seats, error = _requested_seats(request, layout)
+    if error:
+        return error
+
+    # Возвращаем в продажу истекшие удержания мест этого показа
+    reclaim_expired_holds(schedule_ids=[schedule.pk])
+    try:
+        cart_item = seatmap.hold_seats(request.user, schedule, layout, seats)
+    except seatmap.SeatsUnavailable as e:
+        return Response({"error": "Места уже заняты", "seats": e.seats}, status=status.HTTP_409_CONFLICT)
+    except seatmap.SeatMapConflict:
+        return Response({"error": "Карта мест изменяется, повторите запрос"}, status=status.HTTP_409_CONFLICT)
+    if cart_item is None:
+        return Response({"error": "Недостаточно мест"}, status=status.HTTP_400_BAD_REQUEST)
+    return _seat_map_response(cart_item, schedule)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent('seat-release')
+def schedule_seat_release(request, pk):
+    """
+    Освобождение удержанных пользователем мест
+    """
+    schedule, layout, error = _seat_map_schedule(pk)
+    if error:
+        return error
+    seats, error = _requested_seats(request, layout)
+    if error:
+        return error
+
+    try:
+        cart_item = seatmap.release_held_seats(request.user, schedule, layout, seats)
+    except seatmap.SeatsUnavailable as e:
+        return Response({"error": "Эти места не удержаны вами", "seats": e.seats}, status=status.HTTP_400_BAD_REQUEST)
+    except seatmap.SeatMapConflict:
+        return Response({"error": "Карта мест изменяется, повторите запрос"}, status=status.HTTP_409_CONFLICT)
+    return _seat_map_response(cart_item, schedule)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def schedule_queue_join(request, pk):
+    """
+    Вход в очередь ожидания показа: токен для опроса и позиция в очереди
+    """
+    if not PerformanceSchedule.objects.filter(pk=pk).exists():
+        return Response({"error": "Расписание спектакля не найдено"}, status=status.HTTP_404_NOT_FOUND)
+    token, state = waiting_room.join(request.user, pk)
+    return Response({"token": token, **state})
+
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def schedule_queue_poll(request, pk, token):
+    """
+    Позиция в очереди ожидания по токену. Клиенты опрашивают ее часто,
+    поэтому запрос обходится без аутентификации и базы - только Redis
+    """
+    state = waiting_room.poll(pk, token)
+    if state is None:
+        return Response(
+            {"error": "Токен очереди не найден или больше не действует, встаньте в очередь заново"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(state)
+
 # Представления для каталога
 
 class CatalogCategoryListView(ListAPIView):
@@ -667,31 +953,37 @@ class CatalogFeaturedView(APIView):
     """
     permission_classes = [AllowAny]
     
+    @cached_response('catalog-featured')
     def get(self, request):
         # Получаем текущую дату и время
         now = timezone.now()
+        # Подборки читают аннотации read model, без запросов на каждую строку
+        performances = Performance.objects.with_catalog_stats(with_reviews=False)
         
         # Последние добавленные спектакли
-        latest_performances = Performance.objects.order_by('-created_at')[:6]
+        latest_performances = performances.order_by('-created_at')[:6]
         latest_serializer = PerformanceBriefSerializer(latest_performances, many=True)
         
-        # Популярные спектакли (с наибольшим количеством отзывов)
-        popular_performances = Performance.objects.annotate(
-            review_count=Count('reviews')
-        ).order_by('-review_count')[:6]
+        # Популярные спектакли (с наибольшим количеством отзывов) - по счетчику и индексу
+        popular_performances = performances.order_by('-review_count', 'id')[:6]
         popular_serializer = PerformanceBriefSerializer(popular_performances, many=True)
         
+        # Спектакли с лучшими оценками
+        top_rated_performances = performances.filter(rating_count__gt=0).order_by('-average_rating', 'id')[:6]
+        top_rated_serializer = PerformanceBriefSerializer(top_rated_performances, many=True)
+        
         # Ближайшие по дате спектакли
-        upcoming_schedules = PerformanceSchedule.objects.filter(
-            date_time__gt=now
-        ).order_by('date_time')[:10]
-        upcoming_performances = list({schedule.performance for schedule in upcoming_schedules})[:6]
+        upcoming_ids = list(dict.fromkeys(
+            PerformanceSchedule.objects.filter(
+                date_time__gt=now
+            ).order_by('date_time').values_list('performance_id', flat=True)[:10]
+        ))[:6]
+        upcoming_by_id = performances.in_bulk(upcoming_ids)
+        upcoming_performances = [upcoming_by_id[pk] for pk in upcoming_ids if pk in upcoming_by_id]
         upcoming_serializer = PerformanceBriefSerializer(upcoming_performances, many=True)
         
         # Спектакли с самыми низкими ценами
-        budget_performances = Performance.objects.annotate(
-            min_price=Min('schedule__price')
-        ).order_by('min_price')[:6]
+        budget_performances = performances.order_by('min_price')[:6]
         budget_serializer = PerformanceBriefSerializer(budget_performances, many=True)
         
         # Все категории
@@ -703,6 +995,7 @@ class CatalogFeaturedView(APIView):
         return Response({
             'latest_performances': latest_serializer.data,
             'popular_performances': popular_serializer.data,
+            'top_rated_performances': top_rated_serializer.data,
             'upcoming_performances': upcoming_serializer.data,
             'budget_performances': budget_serializer.data,
             'categories': categories_serializer.data
@@ -715,51 +1008,150 @@ class CatalogSearchView(ListAPIView):
     с расширенными возможностями поиска
     """
     serializer_class = PerformanceBriefSerializer
+    pagination_class = KeysetPagination
     permission_classes = [AllowAny]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RelevanceOrderingFilter]
     filterset_class = PerformanceFilter
     search_fields = ['name', 'description']
-    ordering_fields = ['name', 'created_at']
+    ordering_fields = ['name', 'created_at', 'average_rating', 'review_count']
     ordering = ['name']
     
     def get_queryset(self):
-        queryset = Performance.objects.all()
+        queryset = Performance.objects.with_catalog_stats(with_reviews=False)
         
         # Поиск по ключевому слову в имени или описании
         keyword = self.request.query_params.get('keyword', None)
         if keyword:
-            queryset = queryset.filter(
-                Q(name__icontains=keyword) | Q(description__icontains=keyword)
-            )
-        
-        # Фильтр по категории
-        category_id = self.request.query_params.get('category', None)
-        if category_id:
-            queryset = queryset.filter(category_id=category_id)
-        
-        # Фильтр по доступности мест (мин. количество)
-        min_seats = self.request.query_params.get('min_seats', None)
-        if min_seats:
-            queryset = queryset.filter(schedule__available_seats__gte=min_seats).distinct()
-        
-        # Фильтр по диапазону цен
-        min_price = self.request.query_params.get('min_price', None)
-        max_price = self.request.query_params.get('max_price', None)
-        if min_price:
-            queryset = queryset.filter(schedule__price__gte=min_price).distinct()
-        if max_price:
-            queryset = queryset.filter(schedule__price__lte=max_price).distinct()
-        
-        # Фильтр по дате
-        date_after = self.request.query_params.get('date_after', None)
-        date_before = self.request.query_params.get('date_before', None)
-        if date_after:
-            queryset = queryset.filter(schedule__date_time__gte=date_after).distinct()
-        if date_before:
-            queryset = queryset.filter(schedule__date_time__lte=date_before).distinct()
+            queryset = queryset.search(keyword)
         
+        # Категория, места, цена и даты фильтруются PerformanceFilter (filterset_class)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """
+        С параметром facets=1 добавляет блок facets со счетчиками по категориям,
+        театрам, ценам и датам для текущего фильтра (старый формат списка
+        в этом случае заменяется объектом {results, facets}).
+
+        Если поиск по keyword ничего не нашел, добавляет нечеткие совпадения:
+        в ответе-объекте - поля did_you_mean и fuzzy_matches,
+        в старом формате списка - заголовок X-Did-You-Mean (URL-кодированный)
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        else:
+            response = Response(self.get_serializer(queryset, many=True).data)
+
+        if request.query_params.get('facets') in ('1', 'true'):
+            if not isinstance(response.data, dict):
+                response.data = {'results': response.data}
+            # Фасеты по показам учитывают те же фильтры расписания, что и список.
+            # Условия расписания от queryset не зависят: повторный get_queryset()
+            # заново выполнил бы поиск по keyword
+            filterset = DjangoFilterBackend().get_filterset(request, Performance.objects.all(), self)
+            schedule_conditions = filterset.get_schedule_conditions() if filterset.is_valid() else None
+            response.data['facets'] = compute_facets(queryset, schedule_conditions)
+
+        keyword = request.query_params.get('keyword')
+        if not keyword or request.query_params.get('cursor'):
+            return response
+
+        paginated = isinstance(response.data, dict)
+        results = response.data['results'] if paginated else response.data
+        if results:
+            return response
+
+        matches = fuzzy_search(keyword)
+        suggestion = did_you_mean(matches)
+        if paginated:
+            response.data['did_you_mean'] = suggestion
+            response.data['fuzzy_matches'] = matches
+        elif suggestion:
+            response['X-Did-You-Mean'] = quote(suggestion)
+        return response
+
+
+class CatalogFuzzySearchView(APIView):
+    """
+    Нечеткий поиск по названиям спектаклей, категорий и театров (устойчив к опечаткам)
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "Параметр q обязателен"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            return Response({"error": "Параметр limit должен быть числом"}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches = fuzzy_search(query, limit=limit)
+        return Response({
+            'query': query,
+            'did_you_mean': did_you_mean(matches),
+            'matches': matches
+        })
+
+
+class CatalogSuggestView(APIView):
+    """
+    Автодополнение по началу названий спектаклей, категорий и театров,
+    отсортированное по популярности
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', SUGGEST_LIMIT)), 1), SUGGEST_LIMIT)
+        except ValueError:
+            return Response({"error": "Параметр limit должен быть числом"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'query': query,
+            'suggestions': suggest(query, limit=limit)
+        })
+
+
+class ScheduleSearchView(ListAPIView):
+    """
+    Поиск показов: что идет в заданные даты, в каком театре и по какой цене.
+    Запрос выполняется по расписанию напрямую (range scan по date_time)
+    с keyset-пагинацией по (date_time, id). Без date_after ищутся только
+    предстоящие показы.
+
+    С параметром group=performance остается только ближайший подходящий
+    показ каждого спектакля (ROW_NUMBER() за один проход)
+    """
+    serializer_class = ScheduleSearchSerializer
+    permission_classes = [AllowAny]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ScheduleFilter
+    pagination_class = ScheduleSearchPagination
+
+    def get_queryset(self):
+        return PerformanceSchedule.objects.select_related('performance__category', 'theater', 'hall')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not self.request.query_params.get('date_after'):
+            queryset = queryset.filter(date_time__gte=timezone.now())
+
+        if self.request.query_params.get('group') == 'performance':
+            first_shows = queryset.annotate(
+                row_number=Window(
+                    RowNumber(),
+                    partition_by=[F('performance_id')],
+                    order_by=[F('date_time').asc(), F('id').asc()]
+                )
+            ).filter(row_number=1).values('pk')
+            # Условие курсора должно применяться после группировки, а не внутри нее
+            queryset = self.get_queryset().filter(pk__in=first_shows)
+
+        return queryset.order_by('date_time', 'id')
+
 
 class CatalogStatsView(APIView):
     """
@@ -767,6 +1159,7 @@ class CatalogStatsView(APIView):
     """
     permission_classes = [AllowAny]
     
+    @cached_response('catalog-stats')
     def get(self, request):
         # Общее количество спектаклей
         total_performances = Performance.objects.count()
@@ -787,11 +1180,11 @@ class CatalogStatsView(APIView):
             avg_price=Avg('price')
         )
         
-        # Статистика по отзывам
-        reviews_stats = Review.objects.aggregate(
-            total_reviews=Count('id'),
-            total_likes=Count('likes')
-        )
+        # Статистика по отзывам: лайки - из общего счетчика, без соединения с таблицей лайков
+        reviews_stats = {
+            'total_reviews': Review.objects.count(),
+            'total_likes': Counter.objects.value(Counter.LIKES)
+        }
         
         return Response({
             'total_performances': total_performances,
@@ -809,4 +1202,11 @@ class CatalogStatsView(APIView):
         })
 
 
+class CatalogCacheStatsView(APIView):
+    """
+    Счетчики попаданий и промахов кеша ответов каталога (для администраторов)
+    """
+    permission_classes = [IsAdminUser]
 
+    def get(self, request):
+        return Response(get_cache_metrics(['catalog-featured', 'catalog-stats']))
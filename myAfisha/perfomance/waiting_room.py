@@ -0,0 +1,341 @@
+"""
+Очередь ожидания перед покупкой билетов.
+
+У показа с admission_limit корзину и оформление заказа одновременно
+проходят не больше admission_limit покупателей, остальные ждут в очереди.
+Покупатель встает в очередь (join) и получает токен, по которому опрашивает
+свою позицию (poll). Опрос не обращается к базе: вся очередь хранится
+в Redis, а пропуск следующих покупателей выполняется Lua-скриптом при каждом
+вступлении в очередь и опросе.
+
+Для каждого показа в Redis хранятся:
+    limit  - сколько покупателей пропускать одновременно (копия admission_limit);
+    queue  - очередь, упорядоченное множество пользователь -> номер вступления;
+    active - пропущенные, пользователь -> время окончания пропуска;
+    seen   - время последнего опроса ожидающих: кто перестал опрашивать
+             очередь дольше WAITING_ROOM_HEARTBEAT, выбывает из нее;
+    tokens и users - токен -> пользователь и обратно; пара удаляется, когда
+             покупатель выбывает из очереди, его пропуск истекает или он
+             оформляет заказ, поэтому хеши не растут дольше одной распродажи.
+Пропуск действует WAITING_ROOM_ADMISSION_TTL секунд или до оформления заказа.
+
+Режим включается настройкой WAITING_ROOM_REDIS_URL; без нее покупка
+открыта всем.
+"""
+import secrets
+import time
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+import redis
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+from redis.commands.core import Script
+
+# Ключи показа в одном слоте Redis Cluster
+KEY_PREFIX = 'waiting_room:'
+KEY_NAMES = ('limit', 'queue', 'active', 'seen', 'tokens', 'users', 'seq')
+# Сколько выбывших из очереди удалять за один шаг пропуска
+STALE_BATCH = 100
+
+# Шаг пропуска: снимает истекшие пропуски, удаляет из очереди тех, кто давно
+# не опрашивал ее, и пропускает первых ожидающих на освободившиеся места.
+# Токены выбывших и покупателей с истекшим пропуском удаляются.
+# KEYS - ключи показа (KEY_NAMES), now и stale_before - секунды,
+# lease_until - до какого времени действует новый пропуск.
+ADMIT = b"""
+local function forget(user)
+    local token = redis.call('HGET', KEYS[6], user)
+    if token then
+        redis.call('HDEL', KEYS[5], token)
+        redis.call('HDEL', KEYS[6], user)
+    end
+end
+
+local function admit(now, stale_before, lease_until)
+    local limit = tonumber(redis.call('GET', KEYS[1]))
+    if not limit then
+        return nil
+    end
+    for _, user in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)) do
+        redis.call('ZREM', KEYS[3], user)
+        forget(user)
+    end
+    local stale = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', stale_before, 'LIMIT', 0, %d)
+    for _, user in ipairs(stale) do
+        redis.call('ZREM', KEYS[2], user)
+        redis.call('ZREM', KEYS[4], user)
+        forget(user)
+    end
+    local free = limit - redis.call('ZCARD', KEYS[3])
+    if free > 0 then
+        for _, user in ipairs(redis.call('ZRANGE', KEYS[2], 0, free - 1)) do
+            redis.call('ZADD', KEYS[3], lease_until, user)
+            redis.call('ZREM', KEYS[2], user)
+            redis.call('ZREM', KEYS[4], user)
+        end
+    end
+    return limit
+end
+""" % STALE_BATCH
+
+# ARGV - пользователь, новый токен, now, stale_before, lease_until.
+# Истекший пропуск входящего снимается до выдачи токена, иначе шаг пропуска удалил бы новый токен.
+# Возвращает {1, окончание пропуска, токен} для пропущенного или
+# {0, позиция в очереди, токен}; без очереди у показа - {1, 0, ''}.
+JOIN_SCRIPT = Script(None, ADMIT + b"""
+local user, now = ARGV[1], tonumber(ARGV[3])
+if not redis.call('GET', KEYS[1]) then
+    return {1, 0, ''}
+end
+local lease = tonumber(redis.call('ZSCORE', KEYS[3], user))
+if lease and lease <= now then
+    redis.call('ZREM', KEYS[3], user)
+    forget(user)
+    lease = nil
+end
+local token = redis.call('HGET', KEYS[6], user)
+if not token then
+    token = ARGV[2]
+    redis.call('HSET', KEYS[6], user, token)
+    redis.call('HSET', KEYS[5], token, user)
+end
+if not lease and not redis.call('ZSCORE', KEYS[2], user) then
+    redis.call('ZADD', KEYS[2], redis.call('INCR', KEYS[7]), user)
+end
+if redis.call('ZSCORE', KEYS[2], user) then
+    redis.call('ZADD', KEYS[4], now, user)
+end
+admit(now, ARGV[4], ARGV[5])
+lease = tonumber(redis.call('ZSCORE', KEYS[3], user))
+if lease then
+    return {1, lease, token}
+end
+return {0, redis.call('ZRANK', KEYS[2], user) + 1, token}
+""")
+
+# ARGV - токен, now, stale_before, lease_until.
+# Возвращает {1, окончание пропуска} для пропущенного (окончание 0 - очередь
+# у показа выключена), {0, позиция} для ожидающего и {-1, 0} для неизвестного
+# токена, в том числе удаленного после выбывания из очереди или конца пропуска.
+POLL_SCRIPT = Script(None, ADMIT + b"""
+local user = redis.call('HGET', KEYS[5], ARGV[1])
+if not user then
+    return {-1, 0}
+end
+local now = tonumber(ARGV[2])
+if not redis.call('GET', KEYS[1]) then
+    return {1, 0}
+end
+if redis.call('ZSCORE', KEYS[2], user) then
+    redis.call('ZADD', KEYS[4], now, user)
+end
+admit(now, ARGV[3], ARGV[4])
+local lease = tonumber(redis.call('ZSCORE', KEYS[3], user))
+if lease then
+    return {1, lease}
+end
+local rank = redis.call('ZRANK', KEYS[2], user)
+if rank then
+    return {0, rank + 1}
+end
+return {-1, 0}
+""")
+
+# ARGV - пользователь, now. 1, если у показа нет очереди или пользователь пропущен.
+ADMITTED_SCRIPT = Script(None, b"""
+if not redis.call('GET', KEYS[1]) then
+    return 1
+end
+local lease = tonumber(redis.call('ZSCORE', KEYS[3], ARGV[1]))
+if lease and lease > tonumber(ARGV[2]) then
+    return 1
+end
+return 0
+""")
+
+# ARGV - пользователь. Снимает пропуск после оформления заказа и удаляет токен.
+RELEASE_SCRIPT = Script(None, ADMIT + b"""
+redis.call('ZREM', KEYS[3], ARGV[1])
+forget(ARGV[1])
+""")
+
+_client_override = None
+
+
+@lru_cache(maxsize=None)
+def _connect(url):
+    return redis.Redis.from_url(url)
+
+
+def get_client():
+    """
+    Клиент Redis с очередями или None, если режим выключен
+    """
+    if _client_override is not None:
+        return _client_override
+    url = settings.WAITING_ROOM_REDIS_URL
+    return _connect(url) if url else None
+
+
+@contextmanager
+def using_client(client):
+    """
+    Временно ведет очереди в переданном клиенте (тесты)
+    """
+    global _client_override
+    previous, _client_override = _client_override, client
+    try:
+        yield client
+    finally:
+        _client_override = previous
+
+
+def enabled():
+    return get_client() is not None
+
+
+def _keys(schedule_id):
+    return [f'{KEY_PREFIX}{{{schedule_id}}}:{name}' for name in KEY_NAMES]
+
+
+def _step_args(now):
+    return [
+        now - settings.WAITING_ROOM_HEARTBEAT,
+        now + settings.WAITING_ROOM_ADMISSION_TTL,
+    ]
+
+
+def _state(code, value):
+    if code == 1:
+        return {'status': 'admitted', 'expires_at': value or None}
+    return {'status': 'waiting', 'position': value, 'poll_interval': settings.WAITING_ROOM_POLL_INTERVAL}
+
+
+def set_limit(schedule_id, limit):
+    """
+    Включает очередь показа с лимитом одновременных покупателей
+    или удаляет ее, если limit - None
+    """
+    client = get_client()
+    if client is None:
+        return
+    keys = _keys(schedule_id)
+    if limit is None:
+        client.delete(*keys)
+    else:
+        client.set(keys[0], limit)
+
+
+def sync_limits():
+    """
+    Копирует лимиты всех показов из базы в Redis и удаляет очереди показов,
+    у которых лимита больше нет. Возвращает количество показов с очередью.
+    """
+    from .models import PerformanceSchedule
+
+    client = get_client()
+    if client is None:
+        return 0
+    limits = dict(
+        PerformanceSchedule.objects.filter(admission_limit__isnull=False).values_list('pk', 'admission_limit')
+    )
+    for key in client.scan_iter(match=f'{KEY_PREFIX}*:limit', count=1000):
+        schedule_id = int(key.decode().split('{', 1)[1].split('}', 1)[0])
+        if schedule_id not in limits:
+            set_limit(schedule_id, None)
+    for schedule_id, limit in limits.items():
+        set_limit(schedule_id, limit)
+    return len(limits)
+
+
+def join(user, schedule_id):
+    """
+    Ставит пользователя в очередь показа. Возвращает токен для опроса
+    и состояние: {"status": "admitted", "expires_at": ...}
+    или {"status": "waiting", "position": ..., "poll_interval": ...}
+    """
+    client = get_client()
+    if client is None:
+        return None, _state(1, 0)
+    now = int(time.time())
+    code, value, token = JOIN_SCRIPT(
+        keys=_keys(schedule_id),
+        args=[user.pk, secrets.token_urlsafe(16), now] + _step_args(now),
+        client=client
+    )
+    return (token.decode() if token else None), _state(code, value)
+
+
+def poll(schedule_id, token):
+    """
+    Состояние покупателя в очереди по токену или None для неизвестного токена.
+    Обращается только к Redis.
+    """
+    client = get_client()
+    if client is None:
+        return _state(1, 0)
+    now = int(time.time())
+    code, value = POLL_SCRIPT(keys=_keys(schedule_id), args=[token, now] + _step_args(now), client=client)
+    return None if code == -1 else _state(code, value)
+
+
+def denied(user, schedule_ids):
+    """
+    id показов из schedule_ids, на которые пользователь не пропущен
+    """
+    client = get_client()
+    if client is None:
+        return []
+    now = int(time.time())
+    return [
+        schedule_id for schedule_id in schedule_ids
+        if not ADMITTED_SCRIPT(keys=_keys(schedule_id), args=[user.pk, now], client=client)
+    ]
+
+
+def release(user, schedule_ids):
+    """
+    Освобождает место в очереди после оформления заказа: на него сразу
+    пропускается следующий покупатель
+    """
+    client = get_client()
+    if client is None:
+        return
+    for schedule_id in schedule_ids:
+        RELEASE_SCRIPT(keys=_keys(schedule_id), args=[user.pk], client=client)
+
+
+def admission_required(get_schedule_ids, release_on_success=False):
+    """
+    Декоратор функции-представления (под @api_view и @idempotent): пропускает
+    только покупателей, прошедших очередь показов. get_schedule_ids(request, kwargs)
+    возвращает id показов запроса. С release_on_success успешный ответ
+    освобождает место в очереди.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not enabled():
+                return view(request, *args, **kwargs)
+            schedule_ids = set()
+            for schedule_id in get_schedule_ids(request, kwargs):
+                try:
+                    schedule_ids.add(int(schedule_id))
+                except (TypeError, ValueError):
+                    # Некорректный id отклонит само представление
+                    continue
+            schedule_ids = sorted(schedule_ids)
+            closed = denied(request.user, schedule_ids)
+            if closed:
+                return Response(
+                    {"error": "Покупка доступна после прохождения очереди", "schedules": closed},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            response = view(request, *args, **kwargs)
+            if release_on_success and status.is_success(response.status_code):
+                release(request.user, schedule_ids)
+            return response
+        return wrapper
+    return decorator